@@ -0,0 +1,544 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmarks of the Byteport clients, run offline against the stand-ins in byteport.mock_server.
+
+Suites:
+
+  store           ByteportHttpClient.store() throughput and latency percentiles
+  store_packets   ByteportHttpClient.store_packets() throughput for a few batch sizes
+  load            load_timeseries_data_range() and ByteportPandas.load_to_series() (needs pandas)
+  stomp           ByteportStompClient.store() publish rate (needs stompest)
+  mqtt            ByteportMQTTClient.store() publish rate per QoS level (needs paho-mqtt)
+  i8              ByteportI8Reassembler fragment rate, without storing the messages
+  socks           Connects per second through a SOCKS5 stand-in with and without pipelining, with and
+                  without 5 ms per round trip, and store() latency through it with and without keep-alive
+  tls             TLS handshake time with a shared and a new SSL context per connection, and HTTPS store()
+                  latency with and without keep-alive (needs the openssl command)
+  streaming       ByteportStreamAggregator values per second for 100 devices with 3 fields and 3 windows,
+                  and stats() reads per second (needs numpy)
+  backfill        ByteportBackfill rows per second from a CSV file of 10 devices with 3 fields, with 1 and 4
+                  workers and 50 ms latency per request, compared with store() per row (needs pandas)
+
+Results are printed and can be saved as JSON, a saved result can be given as baseline to compare
+against. Metrics ending with _per_second are better when higher, metrics ending with _ms are
+better when lower.
+
+Usage:
+    python benchmarks/bench_clients.py [--suite store --suite mqtt] [--quick] [--output results.json]
+                                       [--baseline previous.json] [--max-regression 20]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import datetime
+import platform
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from byteport.client_base import ByteportClientException
+from byteport.http_clients import ByteportHttpClient
+from byteport.mock_server import ByteportMockServer, ByteportMockStompBroker, ByteportMockMQTTBroker, \
+    ByteportMockSocksProxy, create_certificate
+
+NAMESPACE = 'bench'
+API_KEY = 'BENCH'
+DEVICE_UID = 'bench-device'
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+SUITES = ['store', 'store_packets', 'load', 'stomp', 'mqtt', 'i8', 'socks', 'tls', 'streaming', 'backfill']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        'p50_ms': percentile(ordered, 0.50) * 1000.0,
+        'p90_ms': percentile(ordered, 0.90) * 1000.0,
+        'p99_ms': percentile(ordered, 0.99) * 1000.0,
+        'max_ms': ordered[-1] * 1000.0,
+    }
+
+
+def start_mock_server():
+    return ByteportMockServer(api_keys={NAMESPACE: API_KEY}, legacy_keys=[API_KEY],
+                              users={USERNAME: PASSWORD}).start()
+
+
+def bench_store(scale):
+    server = start_mock_server()
+    try:
+        client = ByteportHttpClient(NAMESPACE, API_KEY, DEVICE_UID, byteport_api_hostname=server.hostname,
+                                    initial_heartbeat=False)
+        count = int(2000 * scale)
+
+        latencies = list()
+        start = time.time()
+        for n in range(count):
+            before = time.time()
+            client.store({'temp': 20.0 + n % 10, 'status': 'ok'}, timestamp=1400000000 + n)
+            latencies.append(time.time() - before)
+        elapsed = time.time() - start
+
+        result = {'stores': count, 'stores_per_second': count / elapsed}
+        result.update(latency_summary(latencies))
+        return result
+    finally:
+        server.stop()
+
+
+def bench_store_packets(scale):
+    server = start_mock_server()
+    try:
+        client = ByteportHttpClient(NAMESPACE, API_KEY, DEVICE_UID, byteport_api_hostname=server.hostname,
+                                    initial_heartbeat=False)
+        result = dict()
+
+        for batch_size in [10, 100, 1000]:
+            batches = max(1, int(2000 * scale) // batch_size)
+
+            start = time.time()
+            for batch in range(batches):
+                packets = [client.build_simple_string_device_message_packet(
+                    NAMESPACE, DEVICE_UID, 'temp=%s;status=ok' % n, 1400000000 + batch * batch_size + n)
+                    for n in range(batch_size)]
+                client.store_packets(packets, API_KEY)
+            elapsed = time.time() - start
+
+            result['batch_%s_packets_per_second' % batch_size] = batches * batch_size / elapsed
+            result['batch_%s_request_ms' % batch_size] = elapsed / batches * 1000.0
+
+        return result
+    finally:
+        server.stop()
+
+
+def bench_load(scale):
+    server = start_mock_server()
+    try:
+        points = int(20000 * scale)
+        start_time = datetime.datetime(2016, 1, 1)
+        start_epoch = 1451606400
+        for n in range(points):
+            server.store(NAMESPACE, DEVICE_UID, start_epoch + n * 60, {'temp': '%s' % (20.0 + n % 100 / 10.0)})
+        to_time = start_time + datetime.timedelta(minutes=points)
+
+        client = ByteportHttpClient(byteport_api_hostname=server.hostname)
+        client.login(USERNAME, PASSWORD)
+
+        runs = 3
+        start = time.time()
+        for _ in range(runs):
+            client.load_timeseries_data_range(NAMESPACE, DEVICE_UID, 'temp', start_time, to_time)
+        load_seconds = (time.time() - start) / runs
+
+        result = {'points': points, 'load_range_ms': load_seconds * 1000.0,
+                  'load_range_points_per_second': points / load_seconds}
+
+        try:
+            import pandas
+        except ImportError:
+            logging.warn("pandas is not installed, skipping load_to_series")
+            return result
+
+        from byteport.scientific import ByteportPandas
+
+        byteport_pandas = ByteportPandas(USERNAME, PASSWORD, byteport_api_hostname=server.hostname)
+
+        start = time.time()
+        for _ in range(runs):
+            byteport_pandas.load_to_series(NAMESPACE, DEVICE_UID, 'temp', start_time, to_time)
+        series_seconds = (time.time() - start) / runs
+
+        result['load_to_series_ms'] = series_seconds * 1000.0
+        result['load_to_series_points_per_second'] = points / series_seconds
+        # What load_to_series adds on top of the HTTP request and JSON decoding
+        result['parse_ms'] = max(0.0, series_seconds - load_seconds) * 1000.0
+
+        return result
+    finally:
+        server.stop()
+
+
+def bench_stomp(scale):
+    from byteport.stomp_client import ByteportStompClient
+
+    broker = ByteportMockStompBroker().start()
+    try:
+        client = ByteportStompClient(NAMESPACE, USERNAME, PASSWORD, broker_host='127.0.0.1',
+                                     broker_port=broker.port, device_uid=DEVICE_UID)
+        count = int(5000 * scale)
+
+        start = time.time()
+        for n in range(count):
+            client.store({'temp': 20.0 + n % 10, 'status': 'ok'}, timestamp=1400000000 + n)
+        if not broker.wait_for_messages(count):
+            raise ByteportClientException("Broker stand-in did not receive all messages")
+        elapsed = time.time() - start
+
+        client.disconnect()
+        return {'messages': count, 'messages_per_second': count / elapsed}
+    finally:
+        broker.stop()
+
+
+def bench_mqtt(scale):
+    from byteport.mqtt_client import ByteportMQTTClient
+
+    broker = ByteportMockMQTTBroker().start()
+    try:
+        client = ByteportMQTTClient(NAMESPACE, DEVICE_UID, USERNAME, PASSWORD, broker_host='127.0.0.1',
+                                    broker_port=broker.port)
+        client.mqtt_client.loop_start()
+
+        deadline = time.time() + 10
+        while not client.connected:
+            if time.time() > deadline:
+                raise ByteportClientException("Failed to connect to the broker stand-in")
+            time.sleep(0.01)
+
+        count = int(5000 * scale)
+        result = {'messages': count}
+
+        for qos in ByteportMQTTClient.SUPPORTED_QOS_LEVELS:
+            received_before = broker.messages
+
+            start = time.time()
+            for n in range(count):
+                client.store('temp=%s;status=ok' % (20.0 + n % 10), timestamp=1400000000 + n, qos=qos)
+            if not broker.wait_for_messages(received_before + count):
+                raise ByteportClientException("Broker stand-in did not receive all messages")
+            elapsed = time.time() - start
+
+            result['qos%s_messages_per_second' % qos] = count / elapsed
+
+        # Batched publishes, the same number of packets wrapped in JSON lists
+        received_before = broker.packets
+        start = time.time()
+        client.store_batch([('temp=%s;status=ok' % (20.0 + n % 10), 1400000000 + n) for n in range(count)])
+        while broker.packets < received_before + count:
+            time.sleep(0.001)
+        result['batched_packets_per_second'] = count / (time.time() - start)
+
+        client.disconnect()
+        client.mqtt_client.loop_stop()
+        return result
+    finally:
+        broker.stop()
+
+
+def bench_i8(scale):
+    from byteport import i8_packets
+
+    messages = list()
+    reassembler = i8_packets.ByteportI8Reassembler(lambda *message: messages.append(message))
+
+    # 1000 nodes sending 400 byte messages, five fragments each, interleaved
+    nodes = 1000
+    message = ';'.join('field_%s=%s' % (n, 20.0 + n) for n in range(30))[:399] + '\0'
+    fragments = [(node, packet) for packet in i8_packets.fragment_message(message, 1)
+                 for node in range(nodes)]
+
+    rounds = max(1, int(20 * scale))
+    start = time.time()
+    for _ in range(rounds):
+        for (node, packet) in fragments:
+            reassembler.feed(node, packet)
+    elapsed = time.time() - start
+
+    if len(messages) != rounds * nodes:
+        raise ByteportClientException("Reassembled %s messages, expected %s" % (len(messages), rounds * nodes))
+
+    return {'fragments': rounds * len(fragments), 'fragments_per_second': rounds * len(fragments) / elapsed,
+            'messages_per_second': len(messages) / elapsed}
+
+
+def bench_streaming(scale):
+    from byteport.streaming import ByteportStreamAggregator
+
+    aggregator = ByteportStreamAggregator(windows=(60, 300, 3600), capacity=1024)
+    devices = ['device-%s' % n for n in range(100)]
+
+    # A sample per device and second, the ring buffers overflow after 1024 seconds
+    seconds = max(20, int(1200 * scale))
+    start = time.time()
+    for t in range(seconds):
+        for device in devices:
+            aggregator.observe(device, {'temp': 20.0 + t % 7, 'hum': 40.0 + t % 11, 'mvolt': 3700 - t % 13}, t)
+    elapsed = time.time() - start
+    values = 3 * seconds * len(devices)
+
+    start = time.time()
+    for device in devices:
+        aggregator.stats(device, 'temp')
+    read_elapsed = time.time() - start
+
+    return {'values': values, 'values_per_second': values / elapsed,
+            'stats_per_second': len(devices) / read_elapsed,
+            'bytes_per_series': aggregator.memory_per_series()}
+
+
+def bench_backfill(scale):
+    import shutil
+    import tempfile
+    from byteport.backfill import ByteportBackfill
+
+    rows = int(20000 * scale)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'history.csv')
+    with open(path, 'w') as csv_file:
+        csv_file.write('time,uid,temp,hum,mvolt\n')
+        for n in range(rows):
+            csv_file.write('%s,device-%s,%s,%s,%s\n' % (1400000000 + n, n % 10, 20.0 + n % 7, 40 + n % 11, 3700 - n % 13))
+
+    server = ByteportMockServer(api_keys={NAMESPACE: API_KEY}, legacy_keys=[API_KEY], latency=0.05).start()
+    try:
+        client = ByteportHttpClient(NAMESPACE, API_KEY, DEVICE_UID, byteport_api_hostname=server.hostname,
+                                    initial_heartbeat=False)
+        result = {'rows': rows}
+
+        for workers in (1, 4):
+            backfill = ByteportBackfill(client, legacy_key=API_KEY, device_column='uid', time_unit='s',
+                                        batch_size=500, workers=workers, chunk_rows=5000)
+            result['rows_per_second_%s_workers' % workers] = backfill.run(path)['rows_per_second']
+
+        # The same rows stored one at a time, on a part of the file
+        count = min(rows, 100)
+        start = time.time()
+        for n in range(count):
+            client.store({'temp': 20.0 + n % 7, 'hum': 40 + n % 11, 'mvolt': 3700 - n % 13}, 'device-%s' % (n % 10),
+                         1400000000 + n)
+        result['store_rows_per_second'] = count / (time.time() - start)
+
+        return result
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+def bench_socks(scale):
+    from byteport import socks
+
+    server = start_mock_server()
+    result = dict()
+    try:
+        for latency in (0, 0.005):
+            proxy = ByteportMockSocksProxy(username='user', password='secret', latency=latency).start()
+            try:
+                for pipeline in (False, True):
+                    name = '%s%s' % ('pipelined' if pipeline else 'sequential', '_5ms' if latency else '')
+                    count = int((200 if latency == 0 else 50) * scale) or 1
+
+                    latencies = list()
+                    start = time.time()
+                    for _ in range(count):
+                        before = time.time()
+                        sock = socks.socksocket()
+                        sock.setproxy(socks.PROXY_TYPE_SOCKS5, '127.0.0.1', proxy.port, username='user',
+                                      password='secret', pipeline=pipeline)
+                        sock.connect(('127.0.0.1', server.port))
+                        latencies.append(time.time() - before)
+                        sock.close()
+                    elapsed = time.time() - start
+
+                    result['%s_connects_per_second' % name] = count / elapsed
+                    result['%s_connect_p50_ms' % name] = percentile(sorted(latencies), 0.5) * 1000.0
+            finally:
+                proxy.stop()
+
+        proxy = ByteportMockSocksProxy(latency=0.005).start()
+        try:
+            for keep_alive in (False, True):
+                client = ByteportHttpClient(NAMESPACE, API_KEY, DEVICE_UID, byteport_api_hostname=server.hostname,
+                                            initial_heartbeat=False, proxy_addr='127.0.0.1', proxy_port=proxy.port)
+                if not keep_alive:
+                    for handler in client.opener.handlers:
+                        if hasattr(handler, 'keep_alive'):
+                            handler.keep_alive = False
+
+                count = int(100 * scale) or 1
+                latencies = list()
+                for n in range(count):
+                    before = time.time()
+                    client.store({'temp': 20.0 + n % 10}, timestamp=1400000000 + n)
+                    latencies.append(time.time() - before)
+
+                name = 'keep_alive' if keep_alive else 'new_connection'
+                result['%s_5ms_store_p50_ms' % name] = percentile(sorted(latencies), 0.5) * 1000.0
+        finally:
+            proxy.stop()
+
+        return result
+    finally:
+        server.stop()
+
+
+def bench_tls(scale):
+    import ssl
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    try:
+        try:
+            certfile = create_certificate(os.path.join(directory, 'localhost.pem'))
+        except OSError as e:
+            raise ByteportClientException("Failed to create a certificate: %s" % e)
+
+        server = ByteportMockServer(api_keys={NAMESPACE: API_KEY}, certfile=certfile).start()
+        try:
+            result = dict()
+            shared_context = ssl.create_default_context(cafile=certfile)
+
+            # A new context per connection is what httplib.HTTPSConnection does when not given one
+            for shared in (True, False):
+                count = int(200 * scale) or 1
+                latencies = list()
+                for _ in range(count):
+                    before = time.time()
+                    context = shared_context if shared else ssl.create_default_context(cafile=certfile)
+                    sock = context.wrap_socket(socket.create_connection(('localhost', server.port)),
+                                               server_hostname='localhost')
+                    latencies.append(time.time() - before)
+                    sock.close()
+
+                name = 'shared_context' if shared else 'new_context'
+                result['%s_handshake_p50_ms' % name] = percentile(sorted(latencies), 0.5) * 1000.0
+                result['%s_handshakes_per_second' % name] = count / sum(latencies)
+
+            for keep_alive in (False, True):
+                client = ByteportHttpClient(NAMESPACE, API_KEY, DEVICE_UID, byteport_api_hostname=server.hostname,
+                                            initial_heartbeat=False, protocol='https', ssl_context=shared_context)
+                if not keep_alive:
+                    for handler in client.opener.handlers:
+                        if hasattr(handler, 'pool'):
+                            handler.pool.max_idle_per_host = 0
+
+                count = int(500 * scale) or 1
+                latencies = list()
+                for n in range(count):
+                    before = time.time()
+                    client.store({'temp': 20.0 + n % 10}, timestamp=1400000000 + n)
+                    latencies.append(time.time() - before)
+
+                name = 'keep_alive' if keep_alive else 'new_connection'
+                result['%s_store_p50_ms' % name] = percentile(sorted(latencies), 0.5) * 1000.0
+                result['%s_stores_per_second' % name] = count / sum(latencies)
+
+            return result
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(directory)
+
+
+def run(suites, scale=1, benchmarks=None):
+    '''
+    :param benchmarks:  [optional] Dictionary with the bench_<suite> functions, by default the ones in this module
+    '''
+    if benchmarks is None:
+        benchmarks = globals()
+
+    results = dict()
+    for suite in suites:
+        logging.info("Running %s" % suite)
+        try:
+            results[suite] = benchmarks['bench_%s' % suite](scale)
+        except (ByteportClientException, ImportError, socket.error) as e:
+            logging.warn("Skipped %s: %s" % (suite, e))
+            results[suite] = {'skipped': u'%s' % e}
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': datetime.datetime.utcnow().isoformat(),
+            'scale': scale,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, max_regression_percent):
+    '''
+    Prints the change of every metric found in both runs, returns the list of metrics that regressed
+    more than max_regression_percent.
+    '''
+    regressions = list()
+
+    for (suite, metrics) in sorted(current['results'].items()):
+        baseline_metrics = baseline.get('results', {}).get(suite, {})
+
+        for (name, value) in sorted(metrics.items()):
+            old = baseline_metrics.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+
+            if name.endswith('_per_second'):
+                change = (value - old) / float(old) * 100.0
+            elif name.endswith('_ms'):
+                change = (old - value) / float(old) * 100.0
+            else:
+                continue
+
+            # Positive change is an improvement
+            print("%-15s %-36s %12.2f -> %12.2f  %+7.1f%%" % (suite, name, old, value, change))
+
+            if change < -max_regression_percent:
+                regressions.append('%s.%s' % (suite, name))
+
+    return regressions
+
+
+def main(suites=SUITES, benchmarks=None):
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-s", "--suite", dest="suites", action="append", choices=suites,
+                      help="Suite to run, can be repeated. Default is all suites")
+    parser.add_option("-q", "--quick", dest="quick", action="store_true", default=False,
+                      help="Smaller runs for a quick check")
+    parser.add_option("--scale", dest="scale", type="int", default=1, help="Multiply the size of each run")
+    parser.add_option("-o", "--output", dest="output", help="Save results as JSON to this file")
+    parser.add_option("-b", "--baseline", dest="baseline", help="Compare with results saved from an earlier run")
+    parser.add_option("--max-regression", dest="max_regression", type="float", default=20.0,
+                      help="Fail if any metric is more than this many percent worse than the baseline")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # The clients log every failed request, keep the output readable
+    logging.getLogger('stompest').setLevel(logging.WARN)
+
+    if options.quick:
+        # Sizes are multiplied by the scale, a quarter of the default is enough for a smoke test
+        scale = 0.25
+    else:
+        scale = options.scale
+
+    result = run(options.suites or suites, scale, benchmarks)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(result, output_file, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline, 'r') as baseline_file:
+            regressions = compare(result, json.load(baseline_file), options.max_regression)
+
+        if regressions:
+            print("FAIL: regressions in %s" % ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Measures how long it takes to start a Python process that imports the byteport package.
+
+Every sample is a fresh interpreter so nothing is cached between runs, the time of an empty
+interpreter start is measured the same way and subtracted. The benchmark fails (exit code 1)
+if the import takes longer than --max-ms or if any heavy/optional dependency was imported.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 20] [--max-ms 150] [--module byteport]
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+from optparse import OptionParser
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be loaded by a plain "import byteport"
+HEAVY_MODULES = ['pandas', 'numpy', 'pytz', 'paho.mqtt.client', 'stompest.sync', 'bz2']
+
+REPORT_SNIPPET = 'import sys, json; print(json.dumps(sorted(m for m in %r if m in sys.modules)))' % HEAVY_MODULES
+
+
+def time_interpreter(statement):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PYTHON_DIR
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', statement], env=env, cwd=PYTHON_DIR)
+    return time.time() - start
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def heavy_modules_imported_by(module):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PYTHON_DIR
+    output = subprocess.check_output([sys.executable, '-c', 'import %s; %s' % (module, REPORT_SNIPPET)],
+                                     env=env, cwd=PYTHON_DIR)
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def run(module='byteport', runs=20):
+    # Warm up the OS file cache before measuring
+    time_interpreter('import %s' % module)
+
+    baseline = median([time_interpreter('pass') for _ in range(runs)])
+    with_import = median([time_interpreter('import %s' % module) for _ in range(runs)])
+
+    return {
+        'module': module,
+        'runs': runs,
+        'interpreter_start_ms': baseline * 1000.0,
+        'import_ms': max(0.0, with_import - baseline) * 1000.0,
+        'heavy_modules_imported': heavy_modules_imported_by(module),
+    }
+
+
+def main():
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-r", "--runs", dest="runs", type="int", default=20, help="Interpreter starts per measurement")
+    parser.add_option("-m", "--max-ms", dest="max_ms", type="float", default=150.0,
+                      help="Fail if the import takes longer than this")
+    parser.add_option("--module", dest="module", default="byteport", help="Module to import")
+    (options, args) = parser.parse_args()
+
+    result = run(options.module, options.runs)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+    failed = False
+    if result['heavy_modules_imported']:
+        print("FAIL: 'import %s' loaded %s" % (options.module, ', '.join(result['heavy_modules_imported'])))
+        failed = True
+    if result['import_ms'] > options.max_ms:
+        print("FAIL: 'import %s' took %.1f ms (limit %.1f ms)" % (options.module, result['import_ms'], options.max_ms))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the analysis functions in byteport.scientific, run on generated data (needs pandas).
+
+Suites:
+
+  grouping        group_and_describe() of a year of minute data, HOURLY and DAILY, compared with a
+                  describe() per group
+  distance        arrange_by_distance() of 10k daily descriptions with each metric, compared with the
+                  previous loop over the groups (euclidean)
+  typical         distance_to_typical_many() of 16 devices with 90 days of minute data each, in one
+                  process and in a process pool
+  operations      diff, smooth_diff and cum_sum of a year of minute data, and the same with pandas
+  activity        DailyStatistics of a year of minute data added an hour at a time, and the statistics
+                  response with calendar
+  store           appending a year of minute data to a SeriesStore a day at a time, and group_and_describe
+                  of the stored series a chunk at a time, compared with the series in memory
+  downsampling    lttb and min_max of a year of minute data to 2000 points, in memory and a day at a time
+
+Options, output and baseline comparison are the same as for bench_clients.py.
+
+Usage:
+    python benchmarks/bench_scientific.py [--suite grouping|distance|typical|operations|activity|store|downsampling] [--quick] [--output results.json]
+                                          [--baseline previous.json] [--max-regression 20]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_clients
+
+SUITES = ['grouping', 'distance', 'typical', 'operations', 'activity', 'store', 'downsampling']
+
+
+def minute_series(scale, days=365):
+    import numpy
+    import pandas
+
+    periods = int(days * 24 * 60 * scale)
+    index = pandas.date_range('2014-01-01', periods=periods, freq='T')
+    return pandas.Series(numpy.random.RandomState(1).normal(20, 5, periods), index, name='temp')
+
+
+def bench_grouping(scale):
+    import pandas
+    from byteport.scientific import grouping
+
+    series = minute_series(scale)
+    result = {'points': len(series)}
+
+    for grouping_name in (grouping.HOURLY, grouping.DAILY):
+        start = time.time()
+        descriptions = grouping.group_and_describe(series, grouping_name)
+        elapsed = time.time() - start
+
+        start = time.time()
+        frames = list()
+        for (label, group) in grouping.groups(series, grouping_name):
+            description = group.to_frame().describe()
+            description.columns = [label]
+            frames.append(description)
+        pandas.concat(frames, axis=1)
+        per_group_elapsed = time.time() - start
+
+        name = grouping_name.lower()
+        result['%s_groups' % name] = len(descriptions.columns)
+        result['%s_ms' % name] = elapsed * 1000.0
+        result['%s_describe_per_group_ms' % name] = per_group_elapsed * 1000.0
+
+    return result
+
+
+def bench_distance(scale):
+    import numpy
+    import pandas
+    from byteport.scientific import distance, grouping
+
+    segments = max(int(10000 * scale), 10)
+    random = numpy.random.RandomState(2)
+    descriptions = pandas.DataFrame(random.normal(20, 5, (len(grouping.DESCRIBE), segments)),
+                                    index=grouping.DESCRIBE,
+                                    columns=[u'segment %s' % i for i in range(segments)])
+    descriptions.loc['count'] = 1440.0
+    result = {'segments': segments}
+
+    for metric in distance.METRICS:
+        start = time.time()
+        distance.arrange_by_distance(descriptions, judge_strategy=metric)
+        result['%s_ms' % metric] = (time.time() - start) * 1000.0
+
+    # The previous implementation, a distance per group
+    start = time.time()
+    typical = descriptions.median(axis=1)
+    ranked = list()
+    for label in descriptions:
+        ranked.append((label, numpy.sqrt(((descriptions[label].values - typical) ** 2).sum())))
+    ranked.sort(key=lambda item: item[1])
+    result['euclidean_per_group_ms'] = (time.time() - start) * 1000.0
+
+    return result
+
+
+def bench_typical(scale):
+    import multiprocessing
+    from byteport.scientific import typical
+
+    series = minute_series(scale, days=90)
+    series_by_guid = dict(('bench.%s.temp' % uid, series * (1 + uid / 100.0)) for uid in range(16))
+    result = {'devices': len(series_by_guid), 'points_per_device': len(series),
+              'processes': multiprocessing.cpu_count()}
+
+    for (name, processes) in (('serial', 1), ('pool', None)):
+        start = time.time()
+        typical.distance_to_typical_many(series_by_guid, processes, grouping='hourly')
+        result['%s_ms' % name] = (time.time() - start) * 1000.0
+
+    return result
+
+
+def bench_operations(scale):
+    from byteport.scientific import operations
+
+    series = minute_series(scale)
+    result = {'points': len(series)}
+
+    for operation in operations.OPERATIONS:
+        start = time.time()
+        operations.apply_operation(series, operation, scale=2)
+        result['%s_ms' % operation] = (time.time() - start) * 1000.0
+
+    # The central difference with pandas, for reference
+    start = time.time()
+    seconds = series.index.to_series().diff(2).dt.total_seconds().shift(-1)
+    (series.shift(-1) - series.shift(1)) * 2 / seconds
+    result['diff_pandas_ms'] = (time.time() - start) * 1000.0
+
+    return result
+
+
+def bench_activity(scale):
+    from byteport.scientific import activity
+
+    series = minute_series(scale)
+    timestamps = series.index.values
+    values = series.values
+
+    statistics = activity.DailyStatistics()
+    start = time.time()
+    batches = 0
+    for offset in range(0, len(series), 60):
+        statistics.add(timestamps[offset:offset + 60], values[offset:offset + 60])
+        batches += 1
+    elapsed = time.time() - start
+
+    start = time.time()
+    statistics.statistics(build_calendar=True)
+    response_elapsed = time.time() - start
+
+    return {
+        'points': len(series),
+        'batches_per_second': batches / elapsed,
+        'points_per_second': len(series) / elapsed,
+        'statistics_response_ms': response_elapsed * 1000.0,
+    }
+
+
+def bench_store(scale):
+    import shutil
+    import tempfile
+    from byteport.scientific import grouping, series_store
+
+    series = minute_series(scale)
+    directory = tempfile.mkdtemp()
+    try:
+        stored = series_store.SeriesStore(directory).series('bench.6000.temp')
+
+        start = time.time()
+        for offset in range(0, len(series), 24 * 60):
+            stored.append_series(series.iloc[offset:offset + 24 * 60])
+        append_elapsed = time.time() - start
+
+        start = time.time()
+        series_store.group_and_describe_stored(stored, grouping.DAILY, chunk_size=64 * 1024)
+        stored_elapsed = time.time() - start
+
+        start = time.time()
+        grouping.group_and_describe(series, grouping.DAILY)
+        memory_elapsed = time.time() - start
+    finally:
+        shutil.rmtree(directory)
+
+    return {
+        'points': len(series),
+        'append_points_per_second': len(series) / append_elapsed,
+        'describe_stored_ms': stored_elapsed * 1000.0,
+        'describe_in_memory_ms': memory_elapsed * 1000.0,
+    }
+
+
+def bench_downsampling(scale):
+    from byteport.scientific import downsampling
+
+    series = minute_series(scale)
+    times = series.index.asi8
+    values = series.values
+
+    results = {'points': len(series)}
+    for method in downsampling.METHODS:
+        start = time.time()
+        downsampling.downsample(series, 2000, method)
+        results['%s_ms' % method] = (time.time() - start) * 1000.0
+
+        start = time.time()
+        downsampler = downsampling.Downsampler(series.index[0], series.index[-1], 2000, method)
+        for offset in range(0, len(series), 24 * 60):
+            downsampler.add(times[offset:offset + 24 * 60], values[offset:offset + 24 * 60])
+        downsampler.result()
+        results['%s_chunked_ms' % method] = (time.time() - start) * 1000.0
+
+    return results
+
+
+if __name__ == '__main__':
+    bench_clients.main(SUITES, globals())
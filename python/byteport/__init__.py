@@ -0,0 +1,23 @@
+"""
+Python clients for Byteport (www.byteport.se)
+
+Importing this package is kept cheap. Optional dependencies (paho-mqtt, stompest, bz2, pytz) are
+imported first when a client needing them is created or used, and pandas is only needed by the
+byteport.scientific module which is not imported here.
+"""
+from byteport.client_base import ByteportClientException, ByteportConnectException, \
+    ByteportLoginFailedException, ByteportClientForbiddenException, ByteportClientDeviceNotFoundException, \
+    ByteportClientUnsupportedCompressionException, ByteportClientUnsupportedTimestampTypeException, \
+    ByteportClientInvalidFieldNameException, ByteportClientInvalidDataTypeException, ByteportServerException
+from byteport.http_clients import ByteportHttpClient, ByteportHttpGetClient
+from byteport.stomp_client import ByteportStompClient
+from byteport.mqtt_client import ByteportMQTTClient
+from byteport.persistent_queue import ByteportPersistentQueue
+from byteport.unified_client import ByteportClient
+from byteport.instrumentation import ByteportInstrumentation, ByteportMetrics, ByteportRequestTrace
+from byteport.rate_limiting import ByteportRateLimiter
+from byteport.gateway import ByteportGateway
+from byteport.connection_pool import ByteportConnectionPool, ByteportKeepAliveHandler
+from byteport.session_store import ByteportSessionStore
+from byteport.streaming import ByteportStreamAggregator
+from byteport.backfill import ByteportBackfill
@@ -0,0 +1,491 @@
+"""
+Backfill of historic data from CSV or Parquet files.
+
+Storing months of history with store(data, timestamp=...) makes one request per row, and auto_timestamp()
+converts each timestamp on its own. ByteportBackfill reads the file in chunks of rows instead, and for
+each chunk:
+
+ - converts the whole time column at once to the UNIX time strings auto_timestamp() makes
+ - groups the rows by device, the rows of each device stay in the order of the file
+ - cuts the rows into batches that a pool of worker threads sends, with store_packets() (one request per
+   batch) when a legacy key is given, otherwise with the store_now() of the client per row
+
+Either way the requests wait for the rate limiter of the client, if it has one, and the rows sent are added
+to its aggregator. With store_now() a client subclass, ie. ByteportHttpGetClient, sends its own requests.
+
+The next chunk is read while the batches of the one before are sent. At most 2 * workers batches wait
+for a worker, so memory stays bounded whatever the size of the file.
+
+File layout: one row per time, a column with the time ('time' by default) as ISO 8601 (UTC if without
+time zone) or as UNIX time with time_unit='s', optionally a column with the UID of the device, and the
+fields in the other columns. Empty values are not stored, rows with a time that does not parse or without
+a device are left out. The device column is read as strings, so numeric UIDs stay as they are in the file.
+CSV files need pandas, Parquet files also pyarrow.
+
+With a checkpoint file the number of rows stored is saved whenever all batches of a chunk, and of the
+chunks before it, are sent. A backfill that stopped, ie. on a failed request, continues after those rows
+when run again. Rows of chunks sent in part before the stop are sent again. The checkpoint is of one
+file, if the path or the size of the file changes the backfill starts over.
+
+Run from the shell with (see --help):
+
+    python -m byteport.backfill -n myownspace -k f00b4s3cretk3y -l f00b4s3cretk3y -f history.csv --device_column uid
+
+Example:
+
+    client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', 'barDev1')
+    backfill = ByteportBackfill(client, legacy_key='f00b4s3cretk3y', device_column='uid', workers=8)
+    stats = backfill.run('history.csv', checkpoint_path='history.checkpoint')
+    print stats['rows_per_second']
+"""
+import os
+import sys
+import json
+import time
+import Queue
+import logging
+import threading
+
+from client_base import *
+
+
+# pandas and pyarrow are optional dependencies, imported when a backfill starts so importing this
+# module stays cheap
+def load_pandas():
+    global numpy
+    global pandas
+
+    try:
+        import numpy
+        import pandas
+    except ImportError:
+        raise ByteportClientException("Could not import pandas. Backfill is not supported without it, "
+                                      "please do: pip install pandas")
+
+
+def load_pyarrow():
+    global pyarrow
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ByteportClientException("Could not import pyarrow. Backfill of Parquet files is not supported "
+                                      "without it, please do: pip install pyarrow")
+
+
+def read_chunks(path, chunk_rows, skip_rows=0, string_columns=()):
+    '''
+    :param path:            CSV file, or Parquet file when named .parquet
+    :param chunk_rows:      Largest number of rows per chunk
+    :param skip_rows:       [optional] Rows at the start of the file left out, ie. stored before
+    :param string_columns:  [optional] Columns read as strings, empty values are NaN or None
+    :return:                Generator of DataFrames
+    '''
+    load_pandas()
+
+    if path.lower().endswith('.parquet'):
+        load_pyarrow()
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+
+        # Row groups are read whole and cut into chunks of chunk_rows, the rows left over are put in front of
+        # the next row group
+        left_over = None
+        for row_group in range(parquet_file.num_row_groups):
+            rows = parquet_file.metadata.row_group(row_group).num_rows
+            if skip_rows >= rows:
+                skip_rows -= rows
+                continue
+
+            frame = parquet_frame(parquet_file.read_row_group(row_group), string_columns).iloc[skip_rows:]
+            skip_rows = 0
+            if left_over is not None:
+                frame = pandas.concat([left_over, frame], ignore_index=True)
+
+            end = len(frame) - len(frame) % chunk_rows
+            for offset in range(0, end, chunk_rows):
+                yield frame.iloc[offset:offset + chunk_rows]
+            left_over = frame.iloc[end:] if end < len(frame) else None
+
+        if left_over is not None:
+            yield left_over
+    else:
+        # Row 0 is the header
+        skip = (lambda row: 0 < row <= skip_rows) if skip_rows else None
+        dtype = dict((name, str) for name in string_columns)
+        for frame in pandas.read_csv(path, chunksize=chunk_rows, skiprows=skip, dtype=dtype):
+            yield frame
+
+
+def parquet_frame(table, string_columns):
+    '''
+    :return: DataFrame of a pyarrow Table, the string columns as unicode or None
+    '''
+    frame = table.to_pandas()
+    for name in string_columns:
+        if name in frame.columns:
+            column = table.column(name)
+            if not pyarrow.types.is_string(column.type):
+                # Integers with nulls would be floats in pandas, ie. 6001.0
+                frame[name] = pandas.Series([None if value is None else unicode(value) for value in column.to_pylist()],
+                                            index=frame.index, dtype=object)
+    return frame
+
+
+def format_timestamps(times):
+    '''
+    :param times:   datetime64[ns] array in UTC
+    :return:        Array of UNIX times with microseconds and without trailing zeros, as auto_timestamp()
+    '''
+    micros = times.astype('datetime64[ns]').view(numpy.int64) // 1000
+    negative = micros < 0
+    micros = numpy.abs(micros)
+
+    seconds = (micros // 1000000).astype(str)
+    fractions = numpy.char.rstrip(numpy.char.zfill((micros % 1000000).astype(str), 6), '0')
+    strings = numpy.char.add(seconds, numpy.where(fractions == '', '', numpy.char.add('.', fractions)))
+
+    return numpy.where(negative, numpy.char.add('-', strings), strings)
+
+
+def read_checkpoint(checkpoint_path, identity):
+    '''
+    :return: Rows of the file already stored
+    '''
+    if not os.path.exists(checkpoint_path):
+        return 0
+
+    with open(checkpoint_path, 'r') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+
+    if checkpoint.get('path') != identity['path'] or checkpoint.get('size') != identity['size']:
+        logging.warn(u'Checkpoint %s is of another file, or the file has changed, starting over' % checkpoint_path)
+        return 0
+
+    return checkpoint['rows']
+
+
+def write_checkpoint(checkpoint_path, identity, rows):
+    # Written to a temporary file and renamed in place, a crash can not leave a half written checkpoint
+    temporary_path = checkpoint_path + '.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(dict(identity, rows=rows), checkpoint_file)
+    os.rename(temporary_path, checkpoint_path)
+
+
+class ByteportBackfill:
+    '''
+    Stores the rows of large files in batches from a pool of worker threads, see the module documentation.
+    '''
+
+    DEFAULT_BATCH_SIZE = 500
+    DEFAULT_WORKERS = 4
+    DEFAULT_CHUNK_ROWS = 100000
+
+    # Seconds between progress reports in the log
+    REPORT_INTERVAL = 10
+
+    def __init__(self, client, legacy_key=None, time_column='time', device_column=None, fields=None, time_unit=None,
+                 batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, chunk_rows=DEFAULT_CHUNK_ROWS,
+                 clock=time.time):
+        '''
+        :param client:          A ByteportHttpClient created with namespace and API key, its default device UID is
+                                used for files without a device column
+        :param legacy_key:      [optional] Send batches with the legacy packets API, otherwise a request per row
+        :param time_column:     [optional] Name of the column with the time
+        :param device_column:   [optional] Name of the column with the device UID
+        :param fields:          [optional] Names of the columns stored, by default all other columns
+        :param time_unit:       [optional] 's', 'ms', 'us' or 'ns' for a time column of UNIX times
+        :param batch_size:      [optional] Rows per batch, and per store_packets() request
+        :param workers:         [optional] Worker threads sending batches
+        :param chunk_rows:      [optional] Rows read from the file at a time
+        '''
+        if not client.store_enabled:
+            raise ByteportClientException("Backfill needs a client created with namespace and API key")
+        if batch_size < 1 or workers < 1 or chunk_rows < 1:
+            raise ByteportClientException("batch_size, workers and chunk_rows must be at least 1")
+
+        self.client = client
+        self.legacy_key = legacy_key
+        self.time_column = time_column
+        self.device_column = device_column
+        self.fields = fields
+        self.time_unit = time_unit
+        self.batch_size = batch_size
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.clock = clock
+
+        # Field names and device UIDs verified so far
+        self.verified = set()
+
+        self.lock = threading.Lock()
+
+    def verify(self, name):
+        if name not in self.verified:
+            if not self.client.verify_name(name):
+                raise ByteportClientException("Invalid field name or device UID, '%s'" % name)
+            self.verified.add(name)
+
+    def rows(self, frame):
+        '''
+        :return: (rows, invalid), the rows of a chunk as (device UID, list of (field name, value), timestamp)
+                 grouped by device, and the number of rows left out because the time did not parse or the
+                 device is missing
+        '''
+        if self.time_column not in frame.columns:
+            raise ByteportClientException("No time column '%s' in %s" % (self.time_column, list(frame.columns)))
+
+        times = pandas.to_datetime(frame[self.time_column], unit=self.time_unit, utc=True, errors='coerce')
+        valid = times.notnull().values
+        if self.device_column is not None:
+            valid &= frame[self.device_column].notnull().values
+        invalid = int(len(valid) - valid.sum())
+        if invalid:
+            frame = frame[valid]
+            times = times[valid]
+
+        timestamps = format_timestamps(times.values)
+
+        if self.device_column is not None:
+            devices = frame[self.device_column].astype(unicode).values
+        else:
+            devices = numpy.repeat(self.client.device_uid, len(frame)).astype(object)
+        for device_uid in set(devices):
+            self.verify(device_uid)
+
+        fields = self.fields
+        if fields is None:
+            fields = [name for name in frame.columns if name not in (self.time_column, self.device_column)]
+
+        # (name, values as strings), None for empty values
+        columns = list()
+        for name in fields:
+            self.verify(name)
+            column = frame[name]
+            columns.append((name, column.astype(unicode).where(column.notnull(), None).values))
+
+        rows = list()
+        for position in numpy.argsort(devices, kind='mergesort'):
+            data = [(name, values[position]) for (name, values) in columns if values[position] is not None]
+            if data:
+                rows.append((devices[position], data, timestamps[position]))
+
+        return rows, invalid
+
+    def send(self, batch):
+        '''
+        :param batch:   List of (device UID, list of (field name, value), timestamp)
+        :return:        Number of requests made
+        '''
+        rate_limiter = self.client.rate_limiter
+        aggregator = self.client.aggregator
+
+        if self.legacy_key is not None:
+            packets = [{'namespace': self.client.namespace_name, 'uid': device_uid,
+                        'data': u';'.join(u'%s=%s' % field for field in data), 'timestamp': timestamp}
+                       for (device_uid, data, timestamp) in batch]
+            self.client.store_packets(packets, self.legacy_key)
+
+            if aggregator is not None:
+                for (device_uid, data, timestamp) in batch:
+                    aggregator.observe(device_uid, dict(data), timestamp)
+            return 1
+
+        for (device_uid, data, timestamp) in batch:
+            if rate_limiter is not None:
+                # Waits whatever the overflow policy, a backfill never drops or coalesces rows
+                rate_limiter.acquire(device_uid)
+
+            # The timestamp is already the string auto_timestamp() makes, it is passed as is
+            store_data = dict(data)
+            store_data['_ts'] = timestamp
+            self.client.store_now(store_data, device_uid)
+
+            if aggregator is not None:
+                aggregator.observe(device_uid, dict(data), timestamp)
+        return len(batch)
+
+    def work(self, queue, progress):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+
+            (chunk, batch) = item
+            if progress['error'] is not None:
+                # Stopping, the batches left are not sent
+                continue
+
+            try:
+                requests = self.send(batch)
+            except Exception as e:
+                logging.error(u'Backfill of %s rows failed: %s' % (len(batch), e))
+                with self.lock:
+                    if progress['error'] is None:
+                        progress['error'] = e
+                continue
+
+            with self.lock:
+                progress['stored'] += len(batch)
+                progress['requests'] += requests
+                progress['remaining'][chunk] -= 1
+                self.advance(progress)
+
+    def advance(self, progress):
+        # Checkpoints the chunks sent so far, in order. Called with the lock held.
+        while progress['remaining'].get(progress['checkpointed']) == 0:
+            chunk = progress['checkpointed']
+            del progress['remaining'][chunk]
+            progress['rows'] = progress['chunk_ends'].pop(chunk)
+            progress['checkpointed'] += 1
+
+            if progress['checkpoint'] is not None:
+                progress['checkpoint'](progress['rows'])
+
+    def upload(self, frames, start_row=0, checkpoint=None):
+        '''
+        Stores the rows of DataFrames, see the module documentation.
+
+        :param frames:      Iterable of DataFrames with the columns of the file layout
+        :param start_row:   [optional] Rows before the first frame, stored earlier
+        :param checkpoint:  [optional] Function called with the number of rows stored, from the first row before
+                            start_row, whenever it grows
+        :return:            Dictionary with rows (read), stored, invalid, requests, seconds and rows_per_second
+        '''
+        load_pandas()
+
+        progress = {
+            'error': None,
+            'stored': 0,
+            'requests': 0,
+            'rows': start_row,
+            'checkpoint': checkpoint,
+            'checkpointed': 0,
+            # Chunk -> batches not sent
+            'remaining': dict(),
+            # Chunk -> rows from the start of the file to the end of the chunk
+            'chunk_ends': dict(),
+        }
+
+        queue = Queue.Queue(2 * self.workers)
+        threads = [threading.Thread(target=self.work, args=(queue, progress), name='ByteportBackfill-%s' % n)
+                   for n in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        start = self.clock()
+        last_report = start
+        end_row = start_row
+        invalid = 0
+
+        try:
+            for (chunk, frame) in enumerate(frames):
+                if progress['error'] is not None:
+                    break
+
+                (rows, chunk_invalid) = self.rows(frame)
+                invalid += chunk_invalid
+                end_row += len(frame)
+
+                batches = [rows[offset:offset + self.batch_size] for offset in range(0, len(rows), self.batch_size)]
+                with self.lock:
+                    progress['remaining'][chunk] = len(batches)
+                    progress['chunk_ends'][chunk] = end_row
+                    self.advance(progress)
+
+                for batch in batches:
+                    queue.put((chunk, batch))
+
+                now = self.clock()
+                if now - last_report >= self.REPORT_INTERVAL:
+                    logging.info(u'Backfill read %s rows, stored %s, %.0f rows/s' %
+                                 (end_row - start_row, progress['stored'], progress['stored'] / (now - start)))
+                    last_report = now
+        finally:
+            for thread in threads:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if progress['error'] is not None:
+            raise progress['error']
+
+        seconds = self.clock() - start
+        return {
+            'rows': end_row - start_row,
+            'stored': progress['stored'],
+            'invalid': invalid,
+            'requests': progress['requests'],
+            'seconds': seconds,
+            'rows_per_second': progress['stored'] / seconds if seconds > 0 else None,
+        }
+
+    def run(self, path, checkpoint_path=None):
+        '''
+        Stores the rows of a CSV or Parquet file, continuing after the rows of the checkpoint.
+
+        :param path:            CSV file, or Parquet file when named .parquet
+        :param checkpoint_path: [optional] File keeping the number of rows stored
+        :return:                See upload(), rows is the rows read in this run
+        '''
+        identity = {'path': os.path.abspath(path), 'size': os.path.getsize(path)}
+
+        start_row = 0
+        checkpoint = None
+        if checkpoint_path is not None:
+            start_row = read_checkpoint(checkpoint_path, identity)
+            if start_row:
+                logging.info(u'Continuing backfill of %s after row %s' % (path, start_row))
+            checkpoint = lambda rows: write_checkpoint(checkpoint_path, identity, rows)
+
+        string_columns = [self.device_column] if self.device_column is not None else []
+        return self.upload(read_chunks(path, self.chunk_rows, start_row, string_columns), start_row, checkpoint)
+
+
+def main(argv=None):
+    from factories import byteport_option_parser, byteport_client_from_options
+
+    parser = byteport_option_parser("usage: %prog [options] -f FILE")
+    parser.add_option("-f", "--file", dest="file", help="CSV file, or Parquet file named .parquet", metavar="FILE")
+    parser.add_option("-l", "--legacy_key", dest="legacy_key", help="Send batches with the legacy packets API",
+                      metavar="LEGACY_KEY")
+    parser.add_option("-c", "--checkpoint", dest="checkpoint", help="Checkpoint file, continues from it if it exists",
+                      metavar="FILE")
+    parser.add_option("--time_column", dest="time_column", default='time', help="Time column, default %default")
+    parser.add_option("--time_unit", dest="time_unit", help="s, ms, us or ns for a time column of UNIX times")
+    parser.add_option("--device_column", dest="device_column",
+                      help="Device UID column, by default all rows are of the device UID")
+    parser.add_option("--fields", dest="fields", help="Comma separated columns stored, by default all others")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=ByteportBackfill.DEFAULT_WORKERS,
+                      help="Worker threads, default %default")
+    parser.add_option("-b", "--batch_size", dest="batch_size", type="int",
+                      default=ByteportBackfill.DEFAULT_BATCH_SIZE, help="Rows per batch, default %default")
+    parser.add_option("--chunk_rows", dest="chunk_rows", type="int", default=ByteportBackfill.DEFAULT_CHUNK_ROWS,
+                      help="Rows read at a time, default %default")
+
+    (options, args) = parser.parse_args(argv)
+
+    client = byteport_client_from_options(options)
+    if client is None or options.file is None:
+        parser.print_help()
+        return None
+
+    backfill = ByteportBackfill(client, options.legacy_key, options.time_column, options.device_column,
+                                options.fields.split(',') if options.fields else None, options.time_unit,
+                                options.batch_size, options.workers, options.chunk_rows)
+    stats = backfill.run(options.file, options.checkpoint)
+
+    print "Stored %s of %s rows in %.1f s, %s requests, %.0f rows/s" % (
+        stats['stored'], stats['rows'], stats['seconds'], stats['requests'], stats['rows_per_second'] or 0)
+    if stats['invalid']:
+        print "Left out %s rows with a time that did not parse or without a device" % stats['invalid']
+
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if main() is None:
+        sys.exit(1)
@@ -2,9 +2,6 @@ import datetime
 import time
 import re
 
-# Non standard imports, try to reduce if possible
-import pytz
-
 class ByteportClientException(Exception):
     pass
 
@@ -45,6 +42,12 @@ class ByteportServerException(ByteportClientException):
 
 class AbstractByteportClient:
 
+    # A ByteportInstrumentation tracing the requests made by the client, see instrumentation.py
+    instrumentation = None
+
+    # A ByteportStreamAggregator keeping rolling statistics of the data stored, see streaming.py
+    aggregator = None
+
     # Byteport supports milli-second precision timestamps but this client sends micro-second precision
     # timestamps if possible to support a possible future enhancement.
     #
@@ -62,18 +65,23 @@ class AbstractByteportClient:
             as_micros = self.unix_time_micros(as_utc)
             fs = as_micros / 1e6
         else:
-            raise ByteportClientUnsupportedTimestampTypeException("Invalid format for auto_timestamp(): " % type(timestamp))
+            raise ByteportClientUnsupportedTimestampTypeException("Invalid format for auto_timestamp(): %s" % type(timestamp))
 
         # Will not leave trailing zeros, see
         # http://stackoverflow.com/questions/2440692/formatting-floats-in-python-without-superfluous-zeros
         return ('%f' % fs).rstrip('0').rstrip('.')
 
     def unix_time_micros(self, datetime_object):
+        # Non standard import, only loaded when datetime timestamps are used
+        import pytz
+
         td = (datetime_object - datetime.datetime(1970, 1, 1, tzinfo=pytz.utc))
         u_secs = td.microseconds + ((td.seconds + td.days * 24 * 3600) * 10**6)
         return u_secs
 
     def timestamp_as_utc(self, datetime_object):
+        import pytz
+
         if datetime_object.tzinfo:
             return datetime_object
         else:
@@ -114,11 +122,28 @@ class AbstractByteportClient:
 
         return utf8_data
 
-    def build_simple_string_device_message_packet(self, namespace, uid, data_string):
+    def build_delimited_data_string(self, data):
+        # Builds the 'temp=10;last_word=mom' data format used in packets sent to the brokers
+        if type(data) != dict:
+            raise ByteportClientException("Data must be of type dict")
+
+        for key in data.keys():
+            self.verify_field_name(key)
+
+        return ';'.join("%s=%s" % (key, self.utf8_encode_value(val)) for (key, val) in data.iteritems())
+
+    def build_simple_string_device_message_packet(self, namespace, uid, data_string, timestamp=None):
+        # The timestamp can be anything auto_timestamp() accepts, if left out the current
+        # time is used with second resolution
+        if timestamp is None:
+            timestamp = '%s' % int(time.time())
+        else:
+            timestamp = self.auto_timestamp(timestamp)
+
         message = dict()
         message['namespace']= namespace
         message['uid']      = uid
         message['data']     = data_string
-        message['timestamp']= '%s' % int(time.time())
+        message['timestamp']= timestamp
 
         return message
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+Persistent HTTP connections for urllib2.
+
+urllib2 sends "Connection: close" and opens a new connection for every request, which through a SOCKS
+tunnel also means a new proxy negotiation per request. ByteportKeepAliveHandler keeps the connections
+open and reuses them from a ByteportConnectionPool. Responses are read completely before they are
+returned so the connection can be given back to the pool at once, which is fine for the small JSON
+responses of the Byteport API.
+
+A request failing on a reused connection, ie. because the server closed it while it was idle, is
+retried once on a new connection.
+
+HTTPS connections are pooled the same way, so the TLS handshake is made once per connection. All HTTPS
+connections of a handler share one SSLContext, created on first use, instead of loading the trusted
+certificates again for every connection. The ssl module of Python 2.7 can not resume TLS sessions, a
+kept alive connection is what saves the handshake.
+"""
+import time
+import errno
+import socket
+import ssl
+import urllib
+import urllib2
+import httplib
+import logging
+import threading
+from cStringIO import StringIO
+
+from instrumentation import ByteportInstrumentedHTTPConnection, ByteportInstrumentedHTTPSConnection
+
+# Errors meaning the server closed an idle connection
+STALE_CONNECTION_ERRORS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+# The same for TLS connections, reported as SSLErrors
+STALE_TLS_ERRORS = (ssl.SSL_ERROR_EOF, ssl.SSL_ERROR_ZERO_RETURN)
+
+
+class ByteportConnectionPool:
+    '''
+    Idle connections by (scheme, host), thread safe. A connection is taken out of the pool while in use.
+    '''
+
+    # Seconds an idle connection is kept, servers usually close idle connections after 60 seconds or more
+    MAX_IDLE_TIME = 30
+
+    # Idle connections kept per host
+    MAX_IDLE_PER_HOST = 4
+
+    def __init__(self, max_idle_time=MAX_IDLE_TIME, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self.max_idle_time = max_idle_time
+        self.max_idle_per_host = max_idle_per_host
+
+        self.lock = threading.Lock()
+
+        # key -> list of (connection, time it became idle), most recently used last
+        self.idle = dict()
+
+        self.created = 0
+        self.reused = 0
+
+    def get(self, key):
+        '''
+        :return: An idle connection for the key, or None
+        '''
+        expired = list()
+        connection = None
+
+        with self.lock:
+            connections = self.idle.get(key)
+
+            if connections:
+                (candidate, idle_since) = connections.pop()
+
+                if idle_since >= time.time() - self.max_idle_time:
+                    connection = candidate
+                    self.reused += 1
+                else:
+                    # The most recently used one has expired, so have the rest
+                    expired = [candidate] + [older for (older, older_idle_since) in connections]
+                    del connections[:]
+
+        for candidate in expired:
+            candidate.close()
+
+        return connection
+
+    def put(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, list())
+            connections.append((connection, time.time()))
+
+            if len(connections) > self.max_idle_per_host:
+                (oldest, idle_since) = connections.pop(0)
+            else:
+                oldest = None
+
+        if oldest is not None:
+            oldest.close()
+
+    def close(self):
+        '''
+        Closes all idle connections.
+        '''
+        with self.lock:
+            connections = [connection for idle in self.idle.values() for (connection, idle_since) in idle]
+            self.idle.clear()
+
+        for connection in connections:
+            connection.close()
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(connections) for connections in self.idle.values())
+
+
+class ByteportKeepAliveHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    '''
+    urllib2 handler reusing HTTP and HTTPS connections, see the module documentation.
+
+    :param connection_factory:          [optional] Called as factory(host, timeout=timeout) to create
+                                        connections, by default instrumented HTTPConnections
+    :param pool:                        [optional] A ByteportConnectionPool, can be shared between handlers
+    :param https_connection_factory:    [optional] As connection_factory for HTTPS, by default instrumented
+                                        HTTPSConnections using the context
+    :param context:                     [optional] ssl.SSLContext for HTTPS, by default ssl.create_default_context()
+    '''
+
+    def __init__(self, connection_factory=None, pool=None, https_connection_factory=None, context=None):
+        urllib2.HTTPSHandler.__init__(self, context=context)
+        self.connection_factory = connection_factory or ByteportInstrumentedHTTPConnection
+        self.https_connection_factory = https_connection_factory or self.build_https
+        self.pool = pool if pool is not None else ByteportConnectionPool()
+        self.context = context
+
+    def ssl_context(self):
+        if self.context is None:
+            self.context = ssl.create_default_context()
+        return self.context
+
+    def build_https(self, host, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        return ByteportInstrumentedHTTPSConnection(host, timeout=timeout, context=self.ssl_context())
+
+    def http_open(self, req):
+        return self.keep_alive_open(self.connection_factory, req)
+
+    def https_open(self, req):
+        return self.keep_alive_open(self.https_connection_factory, req)
+
+    def keep_alive_open(self, connection_factory, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        key = (req.get_type(), host)
+
+        # The same headers as urllib2 sends, except "Connection: close"
+        headers = dict(req.unredirected_hdrs)
+        headers.update((name, value) for (name, value) in req.headers.items() if name not in headers)
+        headers = dict((name.title(), value) for (name, value) in headers.items())
+
+        connection = self.pool.get(key)
+        if connection is not None:
+            try:
+                return self.send(key, connection, req, headers)
+            except (socket.error, httplib.BadStatusLine) as e:
+                if isinstance(e, ssl.SSLError):
+                    if e.errno not in STALE_TLS_ERRORS:
+                        raise urllib2.URLError(e)
+                elif isinstance(e, socket.error) and e.errno not in STALE_CONNECTION_ERRORS:
+                    raise urllib2.URLError(e)
+                logging.debug(u'Reused connection to %s was closed, retrying on a new connection' % host)
+            except httplib.HTTPException as e:
+                raise urllib2.URLError(e)
+
+        self.pool.created += 1
+        connection = connection_factory(host, timeout=req.timeout)
+        try:
+            return self.send(key, connection, req, headers)
+        except (socket.error, httplib.HTTPException) as e:
+            raise urllib2.URLError(e)
+
+    def send(self, key, connection, req, headers):
+        try:
+            connection.request(req.get_method(), req.get_selector(), req.data, headers)
+            response = connection.getresponse(buffering=True)
+            body = response.read()
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(key, connection)
+
+        result = urllib.addinfourl(StringIO(body), response.msg, req.get_full_url())
+        result.code = response.status
+        result.msg = response.reason
+        return result
@@ -1,3 +1,4 @@
+import os
 import sys
 import re
 import socket
@@ -5,20 +6,42 @@ import logging
 from optparse import OptionParser
 
 from http_clients import ByteportHttpClient
+from profiler import ByteportSamplingProfiler
 
-def byteport_client_from_optparse():
 
-    usage = "usage: %prog [options]"
+def start_profiler(output=None):
+    # Samples the process until it exits, the report is written on SIGUSR1 and at exit
+    profiler = ByteportSamplingProfiler(output=output).start()
+    profiler.install()
+    logging.info("Profiling enabled, send SIGUSR1 to pid %s for a report" % os.getpid())
+    return profiler
+
+
+def byteport_option_parser(usage="usage: %prog [options]"):
+    # The options of byteport_client_from_optparse(), add more before parsing
     parser = OptionParser(usage)
     parser.add_option("-n", "--namespace", dest="namespace", help="Namespace name", metavar="NAMESPACE")
     parser.add_option("-k", "--api_key", dest="api_key", help="Namespace API key", metavar="API_KEY")
     parser.add_option("-d", "--device_uid", dest="device_uid", help="Device UID", metavar="DEVICE_UID")
     parser.add_option("-p", "--proxy_port", dest="proxy_port", help="SOCKS5 Proxy port", metavar="PROXY_PORT")
+    parser.add_option("--hostname", dest="hostname", default=ByteportHttpClient.DEFAULT_BYTEPORT_API_HOSTNAME,
+                      help="Byteport API hostname, default %default", metavar="HOSTNAME")
+    parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                      help="Sample where the process spends time, report on SIGUSR1 and at exit")
+    parser.add_option("--profile_output", dest="profile_output", help="Write the profile report to this file",
+                      metavar="FILE")
+    return parser
 
-    (options, args) = parser.parse_args()
+
+def byteport_client_from_options(options):
+    # Returns a ByteportHttpClient for the parsed options of byteport_option_parser(), None if the
+    # namespace or API key is missing
+
+    if options.profile:
+        start_profiler(options.profile_output)
 
     if options.namespace is None or options.api_key is None:
-        return None, parser
+        return None
 
     if options.device_uid is None:
         hostname = socket.gethostname()
@@ -27,10 +50,16 @@ def byteport_client_from_optparse():
         device_uid = options.device_uid
 
     # Create client object
-    client = ByteportHttpClient(
-        options.namespace, options.api_key, device_uid, proxy_port=options.proxy_port)
+    return ByteportHttpClient(options.namespace, options.api_key, device_uid, byteport_api_hostname=options.hostname,
+                              proxy_port=options.proxy_port)
 
-    return client, parser
+
+def byteport_client_from_optparse():
+
+    parser = byteport_option_parser()
+    (options, args) = parser.parse_args()
+
+    return byteport_client_from_options(options), parser
 
 
 def byteport_client_from_simple_argv():
@@ -44,23 +73,34 @@ def byteport_client_from_simple_argv():
     # 3   - (optional) device uid if other than 'hostname'
     # 4   - (optional) SOCKS5 proxy port
     #
-    # returns a ByteportHttpPostClient() object
-
-    if len(sys.argv) < 3:
-        print "Usage: %s <namespace name> <namespace api write key> [device uid] [proxy port]" % sys.argv[0]
+    # --profile[=FILE] anywhere in argv enables the sampling profiler, see profiler.py
+    #
+    # returns a ByteportHttpClient() object
+
+    argv = list()
+    for arg in sys.argv:
+        if arg == '--profile':
+            start_profiler()
+        elif arg.startswith('--profile='):
+            start_profiler(arg[len('--profile='):])
+        else:
+            argv.append(arg)
+
+    if len(argv) < 3:
+        print "Usage: %s <namespace name> <namespace api write key> [device uid] [proxy port] [--profile[=FILE]]" % argv[0]
         exit(1)
 
-    namespace = sys.argv[1]
-    namespace_api_write_key = sys.argv[2]
+    namespace = argv[1]
+    namespace_api_write_key = argv[2]
 
     try:
-        device_uid = sys.argv[3]
+        device_uid = argv[3]
     except Exception:
         hostname = socket.gethostname()
         device_uid = re.sub('[^0-9a-zA-Z]+', '_', hostname)
 
     try:
-        proxy_port = int(sys.argv[4])
+        proxy_port = int(argv[4])
     except Exception:
         proxy_port = None
 
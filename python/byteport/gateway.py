@@ -0,0 +1,258 @@
+"""
+Gateway mode, one client storing data for many devices.
+
+A gateway proxying a sensor network can have thousands of devices behind it. ByteportGateway keeps a
+compact registry of the devices seen, with the last value of each field and the time of the last
+contact of each device. Stored samples are queued per device and flushed in bulk, using the legacy
+packets API (one request for all devices) when a legacy key is given, otherwise with store_now() of
+the client per sample, waiting for the rate limiter of the client if it has one. With store_now() a
+client subclass, ie. ByteportHttpGetClient, sends its own requests.
+
+Field names are verified once per gateway and device UIDs once per device, not on every store.
+
+Memory per device (CPython 2.7, 64 bit) is 80 bytes for the device entry and up to 72 bytes for its
+slot in the registry, plus the UID string (37 + len(uid) bytes), plus the dictionary of last values
+(280 bytes for up to 5 fields, 1 kB for up to 21 fields) and the value strings (37 bytes + the length
+each). For 10000 devices with 8 character UIDs and 3 fields this is about 6 MB. Pending samples take a tuple and a dictionary each until the next flush.
+
+Example:
+
+    client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', initial_heartbeat=False)
+    gateway = ByteportGateway(client, legacy_key='f00b4s3cretk3y', flush_interval=10)
+
+    for (sensor_id, reading) in sensor_network.readings():
+        gateway.store(sensor_id, {'temp': reading.temperature}, reading.time)
+
+    gateway.flush()
+"""
+import time
+import logging
+
+from client_base import *
+
+
+class ByteportGatewayDevice(object):
+    '''
+    Registry entry of a device behind the gateway. Uses __slots__ to keep the size per device small.
+    '''
+    __slots__ = ('uid', 'last_values', 'last_contact', 'pending')
+
+    def __init__(self, uid):
+        self.uid = uid
+
+        # Field name -> last value as UTF-8 string
+        self.last_values = dict()
+
+        # UNIX timestamp of the last store, None if nothing was stored yet
+        self.last_contact = None
+
+        # List of (UTF-8 encoded data, timestamp) waiting for the next flush, None when empty
+        self.pending = None
+
+    def __repr__(self):
+        return '<ByteportGatewayDevice %s>' % self.uid
+
+
+class ByteportGateway:
+    '''
+    Stores data for many devices through a single ByteportHttpClient, see the module documentation.
+    '''
+
+    # Flush when this many samples are pending in total
+    MAX_PENDING = 1000
+
+    # Packets per request to the legacy packets API
+    MAX_PACKETS_PER_REQUEST = 1000
+
+    def __init__(self, client, legacy_key=None, flush_interval=None, max_pending=MAX_PENDING,
+                 max_packets_per_request=MAX_PACKETS_PER_REQUEST):
+        '''
+        :param client:                  A ByteportHttpClient created with namespace and API key
+        :param legacy_key:              [optional] Send all samples in bulk using the legacy packets API
+        :param flush_interval:          [optional] Flush on store if this many seconds passed since the last flush
+        :param max_pending:             [optional] Flush on store if this many samples are pending
+        :param max_packets_per_request: [optional] Largest batch sent to the legacy packets API
+        '''
+        if not client.store_enabled:
+            raise ByteportClientException("The client must be created with a namespace and an API key")
+
+        self.client = client
+        self.namespace = client.namespace_name
+        self.legacy_key = legacy_key
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_packets_per_request = max_packets_per_request
+
+        # Device UID -> ByteportGatewayDevice
+        self.devices = dict()
+
+        # Field names already verified
+        self.valid_field_names = set()
+
+        # Devices with pending samples, in the order their first sample was queued
+        self.pending_devices = list()
+        self.pending_count = 0
+
+        self.last_flush = time.time()
+
+    def device(self, device_uid):
+        '''
+        :return: The registry entry of the device, registering it if it was not seen before
+        '''
+        device = self.devices.get(device_uid)
+        if device is None:
+            if not self.client.verify_name(device_uid):
+                raise ByteportClientException("Invalid device UID '%s'" % device_uid)
+
+            device = self.devices[device_uid] = ByteportGatewayDevice(device_uid)
+        return device
+
+    def encode(self, data):
+        encoded = dict()
+        for (field_name, value) in data.iteritems():
+            if field_name not in self.valid_field_names:
+                self.client.verify_field_name(field_name)
+                self.valid_field_names.add(field_name)
+
+            encoded[field_name] = self.client.utf8_encode_value(value)
+
+        return encoded
+
+    def store(self, device_uid, data, timestamp=None):
+        '''
+        Queues a sample of the device, flushing if the pending samples or the flush interval calls for it.
+
+        :param device_uid:  UID of the device
+        :param data:        Dictionary with field names and values
+        :param timestamp:   [optional] Any timestamp accepted by auto_timestamp(), by default the current time
+        '''
+        device = self.device(device_uid)
+        encoded = self.encode(data)
+
+        now = time.time()
+        if timestamp is None:
+            timestamp = '%s' % int(now)
+        else:
+            timestamp = self.client.auto_timestamp(timestamp)
+
+        device.last_values.update(encoded)
+        device.last_contact = now
+
+        if device.pending is None:
+            device.pending = list()
+            self.pending_devices.append(device)
+        device.pending.append((encoded, timestamp))
+        self.pending_count += 1
+
+        if self.pending_count >= self.max_pending or \
+                (self.flush_interval is not None and now - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        '''
+        Sends all pending samples. Samples that failed to be sent stay pending and the error is raised.
+
+        :return: Number of samples sent
+        '''
+        self.last_flush = time.time()
+
+        if self.legacy_key is not None:
+            return self.flush_packets()
+
+        rate_limiter = self.client.rate_limiter
+        aggregator = self.client.aggregator
+
+        # The lists are walked and what was sent is removed once, not a sample at a time
+        sent = 0
+        flushed_devices = 0
+        try:
+            for device in self.pending_devices:
+                device_sent = 0
+                try:
+                    for (encoded, timestamp) in device.pending:
+                        if rate_limiter is not None:
+                            rate_limiter.acquire(device.uid)
+
+                        # The timestamp is already the string auto_timestamp() makes, it is passed as is
+                        store_data = dict(encoded)
+                        store_data['_ts'] = timestamp
+                        self.client.store_now(store_data, device.uid)
+
+                        if aggregator is not None:
+                            aggregator.observe(device.uid, encoded, timestamp)
+                        device_sent += 1
+                finally:
+                    del device.pending[:device_sent]
+                    self.pending_count -= device_sent
+                    sent += device_sent
+
+                device.pending = None
+                flushed_devices += 1
+        finally:
+            del self.pending_devices[:flushed_devices]
+
+        return sent
+
+    def flush_packets(self):
+        sent = 0
+        flushed_devices = 0
+        try:
+            while flushed_devices < len(self.pending_devices):
+                # Whole devices per request so a failed request leaves every device either sent or pending
+                devices = list()
+                packets = list()
+                for index in xrange(flushed_devices, len(self.pending_devices)):
+                    device = self.pending_devices[index]
+                    if packets and len(packets) + len(device.pending) > self.max_packets_per_request:
+                        break
+
+                    devices.append(device)
+                    for (encoded, timestamp) in device.pending:
+                        data_string = ';'.join('%s=%s' % item for item in encoded.iteritems())
+                        packets.append({'namespace': self.namespace, 'uid': device.uid,
+                                        'data': data_string, 'timestamp': timestamp})
+
+                self.client.store_packets(packets, self.legacy_key)
+
+                for device in devices:
+                    if self.client.aggregator is not None:
+                        for (encoded, timestamp) in device.pending:
+                            self.client.aggregator.observe(device.uid, encoded, timestamp)
+                    device.pending = None
+                flushed_devices += len(devices)
+                self.pending_count -= len(packets)
+                sent += len(packets)
+        finally:
+            del self.pending_devices[:flushed_devices]
+
+        return sent
+
+    def last_values(self, device_uid):
+        '''
+        :return: Dictionary with the last value stored for each field of the device
+        '''
+        device = self.devices.get(device_uid)
+        if device is None:
+            return dict()
+        return dict(device.last_values)
+
+    def silent_devices(self, seconds):
+        '''
+        :return: UIDs of the devices that did not store anything during the last seconds
+        '''
+        deadline = time.time() - seconds
+        return [device.uid for device in self.devices.itervalues()
+                if device.last_contact is None or device.last_contact < deadline]
+
+    def forget(self, device_uid):
+        '''
+        Removes the device from the registry, pending samples of it are dropped.
+        '''
+        device = self.devices.pop(device_uid, None)
+        if device is not None and device.pending:
+            logging.warn(u'Dropped %s pending samples of device %s' % (len(device.pending), device_uid))
+            self.pending_devices.remove(device)
+            self.pending_count -= len(device.pending)
+
+    def __len__(self):
+        return len(self.devices)
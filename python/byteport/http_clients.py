@@ -8,21 +8,28 @@ import time
 import os
 import socks
 import json
-import cookielib
-
-try:
-    import bz2
-    bzip2_enabled = True
-except Exception:
-    print "Failed to import bz2 library (Did you compile Python from sources?). Bzip2 compression will not be a available."
-    bzip2_enabled = False
+import urlparse
+from cStringIO import StringIO
 
 from urllib2 import HTTPError
 from utils import DictDiffer
 
 from socksipyhandler import SocksiPyHandler
+from instrumentation import ByteportInstrumentedHTTPHandler
+from connection_pool import ByteportKeepAliveHandler
+from session_store import ByteportCookieJar
 from client_base import *
 
+def load_bz2():
+    # Imported on first use, bz2 is not available in Pythons compiled from sources without libbz2
+    try:
+        import bz2
+        return bz2
+    except ImportError:
+        raise ByteportClientUnsupportedCompressionException("Failed to import bz2 library (Did you compile Python "
+                                                            "from sources?). Bzip2 compression is not available.")
+
+
 class ByteportHTTPRedirectHandler(urllib2.HTTPRedirectHandler):
     def http_error_302(self, req, fp, code, msg, headers):
         print "Cookie Manip Right Here"
@@ -33,6 +40,7 @@ class ByteportHTTPRedirectHandler(urllib2.HTTPRedirectHandler):
 class ByteportHttpClient(AbstractByteportClient):
 
     DEFAULT_BYTEPORT_API_PROTOCOL = 'http'
+    SUPPORTED_PROTOCOLS = ['http', 'https']
     DEFAULT_BYTEPORT_API_HOSTNAME = 'api.byteport.se'
 
     # DATETIME FORMAT
@@ -52,12 +60,21 @@ class ByteportHttpClient(AbstractByteportClient):
     GET_FIELD_DEFINITION        = '/api/v1/namespace/%s/device_type/%s/field_definition/'
 
     LOAD_TIMESERIES_DATA        = '/api/v1/timeseries/%s/%s/%s/'
+    LOAD_TIMESERIES_STATISTICS  = '/api/v1/timeseries/statistics/%s/%s/%s/'
     DEFAULT_BYTEPORT_STORE_PATH = '/api/v1/timeseries/'
     PACKETS_STORE_PATH          = '/api/legacy/packets/timeseries/'
 
     SEND_MESSAGE    = '/api/v1/message/%s/%s/'
     SET_FIELDS      = '/api/v1/device_control/set_fields/%s/%s/'
 
+    # Parameters authenticating a request by key, such requests are not retried after logging in again
+    KEY_PARAMETERS = ['_key', 'legacy_key']
+
+    # Used to label traced requests by endpoint rather than by the full path
+    ENDPOINT_TEMPLATES = [DEFAULT_BYTEPORT_STORE_PATH + '%s/%s/', PACKETS_STORE_PATH, LOAD_TIMESERIES_DATA,
+                          LOGIN_PATH, LOGOUT_PATH, SESSION_PATH, ECHO_PATH, LIST_NAMESPACES, QUERY_DEVICES,
+                          GET_DEVICE, GET_DEVICE_TYPE, GET_FIRMWARE, GET_FIELD_DEFINITION, SEND_MESSAGE, SET_FIELDS]
+
     #
     DEFAULT_BYTEPORT_API_STORE_URL = '%s://%s%s' % (DEFAULT_BYTEPORT_API_PROTOCOL,
                                                     DEFAULT_BYTEPORT_API_HOSTNAME,
@@ -73,7 +90,13 @@ class ByteportHttpClient(AbstractByteportClient):
                  proxy_port=None,
                  proxy_username=None,
                  proxy_password=None,
-                 initial_heartbeat=True
+                 initial_heartbeat=True,
+                 instrumentation=None,
+                 rate_limiter=None,
+                 protocol=DEFAULT_BYTEPORT_API_PROTOCOL,
+                 ssl_context=None,
+                 session_store=None,
+                 aggregator=None
                  ):
 
         # If any of the following are left as default (None), no store methods can be used
@@ -89,18 +112,48 @@ class ByteportHttpClient(AbstractByteportClient):
         self.device_uid = default_device_uid
         self.byteport_api_hostname = byteport_api_hostname
 
+        if protocol not in self.SUPPORTED_PROTOCOLS:
+            raise ByteportClientException("Unsupported protocol '%s', use one of %s" %
+                                          (protocol, ', '.join(self.SUPPORTED_PROTOCOLS)))
+        self.protocol = protocol
+
+        # A ByteportInstrumentation tracing all requests, see instrumentation.py
+        self.instrumentation = instrumentation
+
+        # A ByteportRateLimiter for the stores, see rate_limiting.py
+        self.rate_limiter = rate_limiter
+
+        # A ByteportSessionStore to reuse logins across processes, see session_store.py
+        self.session_store = session_store
+
+        # A ByteportStreamAggregator keeping rolling statistics of the stored data, see streaming.py
+        self.aggregator = aggregator
+
+        # (username, password, login path) of the last login, to log in again when the session has ended
+        self.credentials = None
+
         # Ie. for tunneling HTTP via SSH, first do:
         # ssh -D 5000 -N username@sshserver.org
-        if proxy_port is not None:
-            self.opener = urllib2.build_opener(SocksiPyHandler(proxy_type, proxy_addr, proxy_port))
+        self.cookiejar = ByteportCookieJar()
+
+        self.proxied = proxy_port is not None
+
+        if self.proxied:
+            # Proxied connections are kept alive, see socksipyhandler.py
+            self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar),
+                                               SocksiPyHandler(proxy_type, proxy_addr, int(proxy_port),
+                                                               username=proxy_username, password=proxy_password,
+                                                               context=ssl_context))
             logging.info("Connecting through type %s proxy at %s:%s" % (proxy_type, proxy_addr, proxy_port))
+        elif protocol == 'https':
+            # Keep HTTPS connections alive to make the TLS handshake once, see connection_pool.py
+            self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar),
+                                               ByteportKeepAliveHandler(context=ssl_context))
         else:
             self.opener = None
 
-        self.cookiejar = cookielib.CookieJar()
-
         if self.store_enabled:
-            self.store_base_url = '%s://%s%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL,
+            self.store_base_url = '%s://%s%s%s' % (self.protocol,
                                                     byteport_api_hostname,
                                                     self.DEFAULT_BYTEPORT_STORE_PATH,
                                                     namespace_name)
@@ -113,14 +166,30 @@ class ByteportHttpClient(AbstractByteportClient):
                 self.store()
 
     def login(self, username, password, login_path=LOGIN_PATH):
+        self.credentials = (username, password, login_path)
+
+        if self.session_store is not None:
+            cookies = self.session_store.load(self.byteport_api_hostname, username)
+            if cookies is not None:
+                for cookie in cookies:
+                    self.cookiejar.set_cookie(cookie)
+                logging.info(u'Reusing the saved session of user %s' % username)
+                return
+
+        self.authenticate(username, password, login_path)
+
+        if self.session_store is not None:
+            self.session_store.save(self.byteport_api_hostname, username, self.cookiejar)
+
+    def authenticate(self, username, password, login_path=LOGIN_PATH):
 
-        url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, login_path)
+        url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, login_path)
 
         # This will induce a GET-call to obtain the csrftoken needed for the actual login
         self.make_request(url)
 
         # Now, also extract the value of the csrftoken since we need it as a post data also
-        csrftoken = self.__get_value_of_cookie('csrftoken')
+        csrftoken = self.cookiejar.value('csrftoken')
 
         if csrftoken is None:
             raise ByteportClientException("Failed to extract csrftoken.")
@@ -136,24 +205,34 @@ class ByteportHttpClient(AbstractByteportClient):
             raise ByteportLoginFailedException("Failed to login user with name %s" % username)
 
         # Make sure the sessionid cookie is present in the cookie jar now
-        for cookie in self.cookiejar:
-            if cookie.name == 'sessionid':
-                return
+        if self.cookiejar.value('sessionid') is None:
+            raise ByteportLoginFailedException("Failed to login user with name %s" % username)
+
+    def reauthenticate(self):
+        (username, password, login_path) = self.credentials
+        logging.info(u'Session of user %s has ended, logging in again' % username)
 
-        raise ByteportLoginFailedException("Failed to login user with name %s" % username)
+        if self.session_store is not None:
+            self.session_store.forget(self.byteport_api_hostname, username)
 
-    def __get_value_of_cookie(self, cookie_name):
-        for cookie in self.cookiejar:
-            if cookie.name == cookie_name:
-                return cookie.value
-        return None
+        self.cookiejar.clear()
+        self.authenticate(username, password, login_path)
+
+        if self.session_store is not None:
+            self.session_store.save(self.byteport_api_hostname, username, self.cookiejar)
 
     def logout(self):
-        url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.LOGOUT_PATH)
+        url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.LOGOUT_PATH)
+        credentials = self.credentials
+        self.credentials = None
+
+        if self.session_store is not None and credentials is not None:
+            self.session_store.forget(self.byteport_api_hostname, credentials[0])
+
         return self.make_request(url).read()
 
     def list_namespaces(self):
-        url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.LIST_NAMESPACES)
+        url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.LIST_NAMESPACES)
 
         rq = self.make_request(url)
 
@@ -162,7 +241,7 @@ class ByteportHttpClient(AbstractByteportClient):
     def query_devices(self, term, full=False, limit=20):
         request_parameters = {'term': term, 'full': u'%s' % full, 'limit': limit}
         encoded_data = urllib.urlencode(request_parameters)
-        url = '%s://%s%s?%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL,
+        url = '%s://%s%s?%s' % (self.protocol,
                                 self.byteport_api_hostname,
                                 self.QUERY_DEVICES,
                                 encoded_data)
@@ -173,13 +252,13 @@ class ByteportHttpClient(AbstractByteportClient):
         return self.query_devices(term, full, limit)
 
     def send_message(self, namespace, device_uid, message, format='json'):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL,
+        base_url = '%s://%s%s' % (self.protocol,
                                 self.byteport_api_hostname,
                                 self.SEND_MESSAGE)
 
         url = base_url % (namespace, device_uid)
 
-        csrftoken = self.__get_value_of_cookie('csrftoken')
+        csrftoken = self.cookiejar.value('csrftoken')
         post_data = {'message': message, 'format': format, 'csrfmiddlewaretoken': csrftoken}
 
         # Encode data to UTF-8 before storing
@@ -189,7 +268,7 @@ class ByteportHttpClient(AbstractByteportClient):
 
 #TODO: Deprecated. Remove at some point.
     def get_device(self, namespace, uid):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.GET_DEVICE)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.GET_DEVICE)
 
         encoded_data = urllib.urlencode( {'uid':u'%s' % uid, 'depth': 1 } )
         url = base_url % (namespace) + "?%s" % encoded_data
@@ -197,7 +276,7 @@ class ByteportHttpClient(AbstractByteportClient):
 
 #TODO: Deprecated. Remove at some point.
     def list_devices(self, namespace, depth=0):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.GET_DEVICE)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.GET_DEVICE)
         request_parameters = {'depth': u'%s' % depth}
         encoded_data = urllib.urlencode(request_parameters)
 
@@ -206,7 +285,7 @@ class ByteportHttpClient(AbstractByteportClient):
         return json.loads(self.make_request(url).read())
 
     def get_devices(self, namespace, key=None):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.GET_DEVICE)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.GET_DEVICE)
         request_parameters = {}
         if( key is not None ):
             request_parameters['key'] = key
@@ -216,7 +295,7 @@ class ByteportHttpClient(AbstractByteportClient):
         return json.loads(self.make_request(url).read())
 
     def get_device_types(self, namespace, key=None):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.GET_DEVICE_TYPE)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.GET_DEVICE_TYPE)
         request_parameters = {}
         if( key is not None ):
             request_parameters['key'] = key
@@ -226,7 +305,7 @@ class ByteportHttpClient(AbstractByteportClient):
         return json.loads(self.make_request(url).read())
 
     def get_firmwares(self, namespace, device_type_id, key=None):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.GET_FIRMWARE)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.GET_FIRMWARE)
         request_parameters = {}
         if( key is not None ):
             request_parameters['key'] = key
@@ -236,7 +315,7 @@ class ByteportHttpClient(AbstractByteportClient):
         return json.loads(self.make_request(url).read())
 
     def get_field_definitions(self, namespace, device_type_id, key=None):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.GET_FIELD_DEFINITION)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.GET_FIELD_DEFINITION)
         request_parameters = {}
         if key is not None:
             request_parameters['key'] = key
@@ -256,7 +335,7 @@ class ByteportHttpClient(AbstractByteportClient):
         :param to_time:
         :return:
         """
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.LOAD_TIMESERIES_DATA)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.LOAD_TIMESERIES_DATA)
         request_parameters = {'from': from_time.strftime(self.ISO8601), 'to': to_time.strftime(self.ISO8601)}
         encoded_data = urllib.urlencode(request_parameters)
 
@@ -274,21 +353,39 @@ class ByteportHttpClient(AbstractByteportClient):
         :param kwargs:
         :return:
         """
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.LOAD_TIMESERIES_DATA)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.LOAD_TIMESERIES_DATA)
         encoded_data = urllib.urlencode(kwargs)
 
         url = base_url % (namespace, uid, field_name) + '?%s' % encoded_data
 
         return json.loads(self.make_request(url).read())
 
+    def load_timeseries_statistics(self, namespace, uid, field_name, build_calendar=False):
+        """
+        Load the daily activity of a field, computed by Byteport from all stored data. See
+        byteport.scientific.activity to keep the same statistics locally.
+
+        :param namespace:
+        :param uid:
+        :param field_name:
+        :param build_calendar: Also return the daily activity by year, month and week
+        :return:
+        """
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.LOAD_TIMESERIES_STATISTICS)
+        encoded_data = urllib.urlencode({'build_calendar': build_calendar})
+
+        url = base_url % (namespace, uid, field_name) + '?%s' % encoded_data
+
+        return json.loads(self.make_request(url).read())
+
     def set_fields(self, namespace, uid, set_fields):
-        base_url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.SET_FIELDS)
+        base_url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.SET_FIELDS)
 
         url = base_url % (namespace, uid)
 
         post_data = set_fields
 
-        post_data['csrfmiddlewaretoken'] = self.__get_value_of_cookie('csrftoken')
+        post_data['csrfmiddlewaretoken'] = self.cookiejar.value('csrftoken')
 
         # Encode data to UTF-8 before storing
         utf8_encoded_data = self.convert_data_to_utf8(post_data)
@@ -303,6 +400,43 @@ class ByteportHttpClient(AbstractByteportClient):
         :param body: If set, this will override any post_data and be directly set as the request body
         :return:
         '''
+        try:
+            return self.make_request_once(url, post_data, body)
+        except ByteportClientForbiddenException:
+            if not self.uses_session(url, post_data):
+                raise
+
+        # The session has ended, ie. it expired on the server or a saved session was reused
+        self.reauthenticate()
+
+        if post_data is not None and 'csrfmiddlewaretoken' in post_data:
+            post_data = dict(post_data)
+            post_data['csrfmiddlewaretoken'] = self.cookiejar.value('csrftoken')
+
+        return self.make_request_once(url, post_data, body, retries=1)
+
+    def uses_session(self, url, post_data):
+        '''
+        :return: True if the request was authenticated by the session of a login that can be made again
+        '''
+        if self.credentials is None or urlparse.urlparse(url).path == self.credentials[2]:
+            return False
+
+        parameters = urlparse.parse_qs(urlparse.urlparse(url).query)
+        if post_data is not None:
+            parameters.update(post_data)
+
+        return not any(name in parameters for name in self.KEY_PARAMETERS)
+
+    def make_request_once(self, url, post_data=None, body=None, retries=0):
+
+        if self.instrumentation is not None:
+            method = 'GET' if post_data is None and body is None else 'POST'
+            endpoint = self.instrumentation.endpoint(urlparse.urlparse(url).path, self.ENDPOINT_TEMPLATES)
+            trace = self.instrumentation.start('http', method, endpoint, url)
+            trace.retries = retries
+        else:
+            trace = None
 
         try:
             logging.debug(url)
@@ -321,13 +455,28 @@ class ByteportHttpClient(AbstractByteportClient):
 
             if self.opener:
                 opener = self.opener
+            elif trace is not None:
+                opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar),
+                                              ByteportInstrumentedHTTPHandler())
             else:
                 opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar))
 
-            return opener.open(req)
+            response = opener.open(req)
 
+            if trace is not None:
+                # Read the body here so the total time and size of the response is known
+                response_body = response.read()
+                trace.bytes_received = len(response_body)
+                response = urllib.addinfourl(StringIO(response_body), response.info(), response.geturl(),
+                                             response.getcode())
+                self.instrumentation.finish(trace, response.getcode())
+
+            return response
 
         except HTTPError as http_error:
+            if trace is not None:
+                self.instrumentation.finish(trace, http_error.code, 'HTTPError')
+
             logging.error(u'HTTPError accessing %s, Error was: %s' % (url, http_error))
             if http_error.code == 403:
                 message = u'403, You were not allowed to access the requested resource.'
@@ -343,12 +492,20 @@ class ByteportHttpClient(AbstractByteportClient):
                 raise ByteportServerException(message)
 
         except urllib2.URLError as e:
+            if trace is not None:
+                self.instrumentation.finish(trace, None, 'URLError')
+
             logging.error(u'URLError accessing %s, Error was: %s' % (url, e))
             logging.info(u'Got URLError, make sure you have the correct network connections (ie. to the internet)!')
-            if self.opener is not None:
+            if self.proxied:
                 logging.info(u'Make sure your proxy settings are correct and you can connect to the proxy host you specified.')
             raise ByteportConnectException(u'Failed to connect to byteport, check your network and proxy settings and setup.')
 
+        except Exception as e:
+            if trace is not None:
+                self.instrumentation.finish(trace, None, e.__class__.__name__)
+            raise
+
     # Simple wrapper for logging with ease
     def log(self, message, level='info', device_uid=None):
         self.store({level: message}, device_uid)
@@ -452,8 +609,8 @@ class ByteportHttpClient(AbstractByteportClient):
             data_block = fileobj
         elif compression == 'gzip':
             data_block = zlib.compress(fileobj)
-        elif compression == 'bzip2' and bzip2_enabled:
-            data_block = bz2.compress(fileobj)
+        elif compression == 'bzip2':
+            data_block = load_bz2().compress(fileobj)
         else:
             raise ByteportClientUnsupportedCompressionException("Unsupported compression method '%s'" % compression)
 
@@ -466,13 +623,37 @@ class ByteportHttpClient(AbstractByteportClient):
         self.store(data, device_uid)
 
     def store(self, data=None, device_uid=None, timestamp=None):
+        '''
+        :return: True if the data was sent, False if the rate limiter dropped it or will send it later
+        '''
         if data is None:
             data = dict()
         if device_uid is None:
             device_uid = self.device_uid
 
+        if self.rate_limiter is not None:
+            return self.rate_limiter.submit(device_uid, data, timestamp, self.store_and_observe)
+
+        self.store_and_observe(data, device_uid, timestamp)
+        return True
+
+    def store_and_observe(self, data, device_uid, timestamp=None):
+        # The aggregator only gets data that was actually stored
+        self.store_now(data, device_uid, timestamp)
+
+        if self.aggregator is not None:
+            self.aggregator.observe(device_uid, data, timestamp)
+
+    def build_store_url(self, device_uid):
+        return '%s/%s/' % (self.store_base_url, device_uid)
+
+    def store_now(self, data, device_uid, timestamp=None):
         data['_key'] = self.api_key
-        url = '%s/%s/' % (self.store_base_url, device_uid)
+
+        if timestamp is not None:
+            data['_ts'] = self.auto_timestamp(timestamp)
+
+        url = self.build_store_url(device_uid)
 
         # Encode data to UTF-8 before storing
         utf8_encoded_data = self.convert_data_to_utf8(data)
@@ -480,7 +661,7 @@ class ByteportHttpClient(AbstractByteportClient):
         self.make_request(url, utf8_encoded_data)
 
     def store_packets(self, packets, legacy_key, json_encode=True):
-        url = '%s://%s%s' % (self.DEFAULT_BYTEPORT_API_PROTOCOL, self.byteport_api_hostname, self.PACKETS_STORE_PATH)
+        url = '%s://%s%s' % (self.protocol, self.byteport_api_hostname, self.PACKETS_STORE_PATH)
 
         if json_encode:
             packets_as_json = json.dumps(packets)
@@ -491,6 +672,10 @@ class ByteportHttpClient(AbstractByteportClient):
         data['packets'] = packets_as_json
         data['legacy_key'] = legacy_key
 
+        if self.rate_limiter is not None:
+            # A batch is never dropped or coalesced, only delayed
+            self.rate_limiter.acquire()
+
         self.make_request(url, self.convert_data_to_utf8(data))
 
 '''
@@ -507,12 +692,7 @@ class ByteportHttpGetClient(ByteportHttpClient):
 
     # Can use another device_uid to override the one used in the constructor
     # Useful for Clients that acts as proxies for other devices, ie. over a sensor-network
-    def store(self, data=None, device_uid=None, timestamp=None):
-        if data is None:
-            data = dict()
-        if device_uid is None:
-            device_uid = self.device_uid
-
+    def store_now(self, data, device_uid, timestamp=None):
         data['_key'] = self.api_key
 
         if timestamp is not None:
@@ -525,7 +705,7 @@ class ByteportHttpGetClient(ByteportHttpClient):
         # By URL-encoding, the make_request call will be made using GET-request
         encoded_data = urllib.urlencode(utf8_encoded_data)
 
-        url = '%s/%s/?%s' % (self.store_base_url, device_uid, encoded_data)
+        url = '%s?%s' % (self.build_store_url(device_uid), encoded_data)
 
         self.make_request(url)
 
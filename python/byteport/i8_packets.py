@@ -0,0 +1,348 @@
+"""
+Decoding and reassembly of the fragmented node messages sent over IEEE 802.15.4 (i8).
+
+This is the Python counterpart of packet_t in c/i8-transceiver/packets.h, so Python gateways can ingest
+the same radio traffic as the C i8-transceiver. Each packet is 91 bytes, little endian and packed:
+
+    flags       1 byte, version in bits 0-2, req_ack in bit 3, is_ack in bit 4
+    packet_id   1 byte, ID of the message, also used for ACKs
+    total_size  4 bytes, size of the whole message
+    offset      4 bytes, offset of the data of this packet in the message
+    data_size   1 byte, bytes of data in this packet
+    data        80 bytes
+
+ByteportI8Reassembler collects the fragments of each (source, packet_id) in a preallocated bytearray,
+fragments are copied once from the received datagram straight into place using memoryview. Fragments
+may arrive in any order, duplicates are ignored and fragments overlapping bytes already received with
+other data are rejected. Completed messages are handed to a deliver function, messages not completed
+within the timeout are dropped. ByteportI8Ingest is a deliver function storing the messages to Byteport
+with store() or in batches with store_packets().
+
+A packet is ACKed only once it is accepted: rejected packets are not, and neither is the fragment
+completing a message that failed to be delivered. The node then sends that fragment again and the
+delivery is retried.
+
+Example, a gateway receiving the UDP traffic of the i8-transceiver test mode:
+
+    client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', initial_heartbeat=False)
+    ingest = ByteportI8Ingest(client, legacy_key='f00b4s3cretk3y')
+    reassembler = ByteportI8Reassembler(ingest)
+
+    while True:
+        (datagram, address) = sock.recvfrom(PACKET_SIZE)
+        ack = reassembler.feed(TEST_MODE_ADDR, datagram)
+        if ack is not None:
+            sock.sendto(ack, address)
+"""
+import time
+import struct
+import logging
+
+from client_base import *
+
+# Size of payload from IEEE 802.15.4 frame
+PAYLOAD_SIZE = 80
+
+# Protocol version
+PROTO_VER = 1
+
+HEADER = struct.Struct('<BBIIB')
+HEADER_SIZE = HEADER.size
+PACKET = struct.Struct('<BBIIB%ds' % PAYLOAD_SIZE)
+PACKET_SIZE = PACKET.size
+
+VERSION_MASK = 0x07
+REQ_ACK_FLAG = 0x08
+IS_ACK_FLAG = 0x10
+
+# Largest message accepted, same as the buffers of the C gateway
+MAX_MESSAGE_SIZE = 20 * 1024
+
+# UDP port and node address of the i8-transceiver test mode, see c/i8-transceiver/test_mode.h
+TEST_PORT = 12000
+TEST_MODE_ADDR = 0x0102030405060708
+
+
+class ByteportI8PacketException(ByteportClientException):
+    pass
+
+
+class ByteportI8Packet(object):
+    '''
+    A decoded packet. The data is a memoryview into the received datagram, nothing is copied.
+    '''
+    __slots__ = ('version', 'req_ack', 'is_ack', 'packet_id', 'total_size', 'offset', 'data_size', 'data')
+
+    def __init__(self, version, req_ack, is_ack, packet_id, total_size, offset, data_size, data):
+        self.version = version
+        self.req_ack = req_ack
+        self.is_ack = is_ack
+        self.packet_id = packet_id
+        self.total_size = total_size
+        self.offset = offset
+        self.data_size = data_size
+        self.data = data
+
+    def __repr__(self):
+        return '<ByteportI8Packet v=%s ia=%s ra=%s pid=%s tsize=%s off=%s dsize=%s>' % (
+            self.version, self.is_ack, self.req_ack, self.packet_id, self.total_size, self.offset, self.data_size)
+
+
+def decode_packet(datagram):
+    '''
+    :param datagram:    A received packet, str or bytearray of at least the header size
+    :return:            ByteportI8Packet
+    '''
+    if len(datagram) < HEADER_SIZE:
+        raise ByteportI8PacketException("Packet is %s bytes, the header alone is %s" % (len(datagram), HEADER_SIZE))
+
+    (flags, packet_id, total_size, offset, data_size) = HEADER.unpack_from(datagram)
+
+    if data_size > PAYLOAD_SIZE or HEADER_SIZE + data_size > len(datagram):
+        raise ByteportI8PacketException("Invalid data size %s in packet of %s bytes" % (data_size, len(datagram)))
+    if offset + data_size > total_size:
+        raise ByteportI8PacketException("Data at offset %s size %s is outside the message of %s bytes" %
+                                        (offset, data_size, total_size))
+
+    return ByteportI8Packet(flags & VERSION_MASK, bool(flags & REQ_ACK_FLAG), bool(flags & IS_ACK_FLAG),
+                            packet_id, total_size, offset, data_size,
+                            memoryview(datagram)[HEADER_SIZE:HEADER_SIZE + data_size])
+
+
+def encode_packet(packet_id, data, total_size=None, offset=0, req_ack=False, is_ack=False, version=PROTO_VER):
+    '''
+    :return: The packet as a string of PACKET_SIZE bytes, data is zero padded
+    '''
+    if len(data) > PAYLOAD_SIZE:
+        raise ByteportI8PacketException("At most %s bytes of data fit in a packet, got %s" % (PAYLOAD_SIZE, len(data)))
+
+    if total_size is None:
+        total_size = len(data)
+
+    flags = (version & VERSION_MASK) | (REQ_ACK_FLAG if req_ack else 0) | (IS_ACK_FLAG if is_ack else 0)
+    return PACKET.pack(flags, packet_id, total_size, offset, len(data), bytes(data))
+
+
+def encode_ack(packet_id):
+    return encode_packet(packet_id, '', is_ack=True)
+
+
+def fragment_message(message, packet_id, req_ack=False):
+    '''
+    Splits a message into packets the way the nodes do, see send_message() in c/i8-transceiver/test_mode.c
+
+    :return: List of packets
+    '''
+    view = memoryview(message)
+    total_size = len(message)
+
+    return [encode_packet(packet_id, view[offset:offset + PAYLOAD_SIZE].tobytes(), total_size, offset, req_ack)
+            for offset in range(0, max(total_size, 1), PAYLOAD_SIZE)]
+
+
+def parse_data_string(data_string):
+    '''
+    Parses the 'temp=10;last_word=mom' format of the message data into a dictionary
+    '''
+    data = dict()
+    for field in data_string.split(';'):
+        if field:
+            (name, _, value) = field.partition('=')
+            data[name] = value
+    return data
+
+
+class ByteportI8Reassembler:
+    '''
+    Reassembles messages from fragments, see the module documentation.
+    '''
+
+    # Seconds to wait for the remaining fragments of a message
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, deliver, timeout=DEFAULT_TIMEOUT, max_message_size=MAX_MESSAGE_SIZE, clock=time.time):
+        '''
+        :param deliver:             Called with (device_uid, message, timestamp) for every completed message.
+                                    The device UID is the source address as 16 hex digits, as in the C gateway.
+        :param timeout:             [optional] Seconds before an incomplete message is dropped
+        :param max_message_size:    [optional] Larger messages are rejected
+        :param clock:               [optional] Function returning the current time in seconds
+        '''
+        self.deliver = deliver
+        self.timeout = timeout
+        self.max_message_size = max_message_size
+        self.clock = clock
+
+        # (source, packet_id) -> [buffer, received bytes, mask of the received bytes, first fragment time]
+        self.partial = dict()
+
+        # Expired messages are looked for at most once per second
+        self.next_expiry = clock() + 1
+
+        self.fragments = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.acks_received = 0
+
+    def feed(self, source, datagram):
+        '''
+        Handles a received packet.
+
+        :param source:      Address of the node as an integer
+        :param datagram:    The packet as received, str or bytearray
+        :return:            An ACK packet to send back to the node if it requested one and the packet was
+                            accepted, otherwise None
+        '''
+        self.fragments += 1
+
+        now = self.clock()
+        if now >= self.next_expiry:
+            self.expire(now)
+
+        try:
+            packet = decode_packet(datagram)
+        except ByteportI8PacketException as e:
+            self.rejected += 1
+            logging.warn(u'Rejected packet from %016x: %s' % (source, e))
+            return None
+
+        if packet.version != PROTO_VER:
+            logging.warn(u'Received packet with wrong version (%s != %s)' % (packet.version, PROTO_VER))
+
+        if packet.is_ack:
+            self.acks_received += 1
+            return None
+
+        if packet.total_size > self.max_message_size:
+            self.rejected += 1
+            logging.warn(u'Rejected message of %s bytes from %016x' % (packet.total_size, source))
+            accepted = False
+        elif packet.total_size == packet.data_size:
+            # Not fragmented
+            accepted = self.complete(source, packet.data.tobytes(), now)
+        else:
+            accepted = self.add_fragment(source, packet, now)
+
+        if packet.req_ack and accepted:
+            return encode_ack(packet.packet_id)
+        return None
+
+    def add_fragment(self, source, packet, now):
+        '''
+        :return: False if the fragment was rejected or completed a message that failed to be delivered
+        '''
+        key = (source, packet.packet_id)
+        message = self.partial.get(key)
+
+        if message is not None and len(message[0]) != packet.total_size:
+            # The packet ID was reused for a new message before the old one completed
+            logging.warn(u'Dropped incomplete message %s from %016x' % (packet.packet_id, source))
+            message = None
+
+        if message is None:
+            message = self.partial[key] = [bytearray(packet.total_size), 0, bytearray(packet.total_size), now]
+
+        (start, end) = (packet.offset, packet.offset + packet.data_size)
+        covered = message[2].count('\1', start, end)
+        if covered:
+            if covered == packet.data_size and message[0][start:end] == packet.data.tobytes():
+                self.duplicates += 1
+                return True
+
+            self.rejected += 1
+            logging.warn(u'Rejected fragment of message %s from %016x overlapping %s received bytes' %
+                         (packet.packet_id, source, covered))
+            return False
+
+        message[0][start:end] = packet.data
+        message[1] += packet.data_size
+        message[2][start:end] = '\1' * packet.data_size
+
+        if message[1] < packet.total_size:
+            return True
+
+        del self.partial[key]
+        if self.complete(source, bytes(message[0]), message[3]):
+            return True
+
+        # Wait for the node to send the fragment again, which retries the delivery
+        message[1] -= packet.data_size
+        message[2][start:end] = '\0' * packet.data_size
+        self.partial[key] = message
+        return False
+
+    def complete(self, source, message, timestamp):
+        '''
+        :return: True if the message was delivered
+        '''
+        # Messages from the nodes are NUL terminated C strings
+        if message.endswith('\0'):
+            message = message.rstrip('\0')
+
+        try:
+            self.deliver('%016x' % source, message, timestamp)
+        except Exception as e:
+            self.failed += 1
+            logging.error(u'Failed to deliver message from %016x: %s' % (source, e))
+            return False
+
+        self.completed += 1
+        return True
+
+    def expire(self, now=None):
+        '''
+        Drops the messages that were not completed within the timeout.
+        '''
+        if now is None:
+            now = self.clock()
+        self.next_expiry = now + 1
+
+        deadline = now - self.timeout
+        for (key, message) in self.partial.items():
+            if message[3] < deadline:
+                del self.partial[key]
+                self.expired += 1
+                logging.warn(u'Message %s from %016x timed out with %s of %s bytes received' %
+                             (key[1], key[0], message[1], len(message[0])))
+
+
+class ByteportI8Ingest:
+    '''
+    Deliver function for ByteportI8Reassembler storing the messages to Byteport.
+
+    With a legacy key the messages are sent as they are in batches using store_packets(), otherwise each
+    message is parsed and stored using store(). Call flush() to send a partial batch.
+    '''
+
+    BATCH_SIZE = 100
+
+    def __init__(self, client, legacy_key=None, batch_size=BATCH_SIZE):
+        '''
+        :param client:      A ByteportHttpClient created with namespace and API key
+        :param legacy_key:  [optional] Send the messages in batches using the legacy packets API
+        :param batch_size:  [optional] Messages per store_packets() request
+        '''
+        self.client = client
+        self.legacy_key = legacy_key
+        self.batch_size = batch_size
+        self.batch = list()
+
+    def __call__(self, device_uid, message, timestamp):
+        if self.legacy_key is None:
+            self.client.store(parse_data_string(message), device_uid, timestamp)
+            return
+
+        self.batch.append(self.client.build_simple_string_device_message_packet(
+            self.client.namespace_name, device_uid, message, timestamp))
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            batch = self.batch
+            self.batch = list()
+            self.client.store_packets(batch, self.legacy_key)
@@ -0,0 +1,346 @@
+"""
+Metrics and tracing for the Byteport clients.
+
+Give a ByteportInstrumentation to the HTTP, STOMP or MQTT client (instrumentation=...) and every request
+made by the client is traced. A ByteportRequestTrace carries the timing breakdown, bytes sent and received,
+status and errors of a request. Hooks are called when a request starts and ends, and the built-in
+ByteportMetrics keeps counters and latency histograms that can be exported as a dict or in the Prometheus
+text format.
+
+Example:
+
+    instrumentation = ByteportInstrumentation()
+    instrumentation.add_hook(lambda event, trace: event == 'end' and log_slow_requests(trace))
+
+    client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', 'barDev1', instrumentation=instrumentation)
+    client.store({'temp': 20})
+
+    print instrumentation.metrics.to_prometheus()
+
+For HTTP the breakdown is connect (including the TLS handshake for HTTPS), send (request written), first
+byte (status line and headers read) and total (body read). For the brokers only the total time of handing
+the frame/packet to the socket is known, the broker does not answer SEND or QoS 0 PUBLISH.
+"""
+import re
+import time
+import urllib2
+import httplib
+import logging
+import threading
+
+TRACE_START = 'start'
+TRACE_END = 'end'
+
+# The trace of the request currently made by each thread, used by the connection classes
+# to record the timing breakdown without having to pass the trace through urllib2
+_current = threading.local()
+
+
+def current_trace():
+    return getattr(_current, 'trace', None)
+
+
+def mark(phase):
+    # Called by the connection classes, a no-op if no request is traced in this thread
+    trace = getattr(_current, 'trace', None)
+    if trace is not None:
+        setattr(trace, '%s_time' % phase, time.time())
+
+
+def count_bytes_sent(count):
+    trace = getattr(_current, 'trace', None)
+    if trace is not None:
+        trace.bytes_sent += count
+
+
+class ByteportRequestTrace:
+    '''
+    A single request made by a client. Times are UNIX timestamps, use durations() for the breakdown.
+    '''
+
+    def __init__(self, transport, method, endpoint, url=None):
+        self.transport = transport
+        self.method = method
+        self.endpoint = endpoint
+        self.url = url
+
+        self.start_time = time.time()
+        self.connect_time = None
+        self.send_time = None
+        self.first_byte_time = None
+        self.end_time = None
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.status = None
+        self.error = None
+        self.retries = 0
+
+    def durations(self):
+        '''
+        :return: Dictionary with connect, send, first_byte and total in seconds since the start of the request.
+                 Phases that were not recorded (ie. connect for a reused connection) are None.
+        '''
+        def since_start(timestamp):
+            if timestamp is None:
+                return None
+            return timestamp - self.start_time
+
+        return {
+            'connect': since_start(self.connect_time),
+            'send': since_start(self.send_time),
+            'first_byte': since_start(self.first_byte_time),
+            'total': since_start(self.end_time),
+        }
+
+    def __repr__(self):
+        return '<ByteportRequestTrace %s %s %s status=%s error=%s>' % (
+            self.transport, self.method, self.endpoint, self.status, self.error)
+
+
+class ByteportMetrics:
+    '''
+    Counters and histograms fed by the finished requests.
+
+    Counters:   byteport_requests_total, byteport_request_errors_total, byteport_request_retries_total,
+                byteport_bytes_sent_total and byteport_bytes_received_total
+    Histograms: byteport_request_duration_seconds, byteport_request_connect_seconds and
+                byteport_request_first_byte_seconds
+
+    All are labeled by transport and endpoint, the request counter also by status.
+    '''
+
+    # Upper bounds in seconds
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    HELP = {
+        'byteport_requests_total': 'Requests made, by transport, endpoint and status.',
+        'byteport_request_errors_total': 'Requests that failed.',
+        'byteport_request_retries_total': 'Requests that were retried.',
+        'byteport_bytes_sent_total': 'Bytes sent in request bodies and headers.',
+        'byteport_bytes_received_total': 'Bytes received in response bodies.',
+        'byteport_request_duration_seconds': 'Total time of requests.',
+        'byteport_request_connect_seconds': 'Time to establish new connections.',
+        'byteport_request_first_byte_seconds': 'Time until the response headers were received.',
+    }
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+
+        # name -> {labels tuple: value}
+        self.counters = dict()
+
+        # name -> {labels tuple: [count per bucket..., count above last bucket, sum]}
+        self.histograms = dict()
+
+    def increment(self, name, labels, value=1):
+        with self.lock:
+            series = self.counters.setdefault(name, dict())
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            series = self.histograms.setdefault(name, dict())
+            values = series.get(labels)
+            if values is None:
+                values = series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            for (index, bound) in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[index] += 1
+                    break
+            else:
+                values[len(self.buckets)] += 1
+            values[-1] += seconds
+
+    def record(self, trace):
+        labels = (('transport', trace.transport), ('endpoint', trace.endpoint))
+
+        self.increment('byteport_requests_total', labels + (('status', '%s' % trace.status),))
+        if trace.error is not None:
+            self.increment('byteport_request_errors_total', labels)
+        if trace.retries:
+            self.increment('byteport_request_retries_total', labels, trace.retries)
+        self.increment('byteport_bytes_sent_total', labels, trace.bytes_sent)
+        self.increment('byteport_bytes_received_total', labels, trace.bytes_received)
+
+        durations = trace.durations()
+        self.observe('byteport_request_duration_seconds', labels, durations['total'])
+        if durations['connect'] is not None:
+            self.observe('byteport_request_connect_seconds', labels, durations['connect'])
+        if durations['first_byte'] is not None:
+            self.observe('byteport_request_first_byte_seconds', labels, durations['first_byte'])
+
+    def as_dict(self):
+        '''
+        :return: {'counters': {name: [{'labels': {..}, 'value': n}]},
+                  'histograms': {name: [{'labels': {..}, 'buckets': {bound: cumulative count}, 'count': n, 'sum': s}]}}
+        '''
+        with self.lock:
+            counters = dict()
+            for (name, series) in self.counters.items():
+                counters[name] = [{'labels': dict(labels), 'value': value} for (labels, value) in series.items()]
+
+            histograms = dict()
+            for (name, series) in self.histograms.items():
+                histograms[name] = list()
+                for (labels, values) in series.items():
+                    cumulative = 0
+                    buckets = dict()
+                    for (bound, count) in zip(self.buckets, values):
+                        cumulative += count
+                        buckets[bound] = cumulative
+                    histograms[name].append({'labels': dict(labels), 'buckets': buckets,
+                                             'count': sum(values[:-1]), 'sum': values[-1]})
+
+            return {'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self):
+        '''
+        :return: The metrics in the Prometheus text exposition format
+        '''
+        lines = list()
+        exported = self.as_dict()
+
+        for (name, series) in sorted(exported['counters'].items()):
+            lines.append('# HELP %s %s' % (name, self.HELP.get(name, name)))
+            lines.append('# TYPE %s counter' % name)
+            for item in series:
+                lines.append('%s%s %s' % (name, format_labels(item['labels']), item['value']))
+
+        for (name, series) in sorted(exported['histograms'].items()):
+            lines.append('# HELP %s %s' % (name, self.HELP.get(name, name)))
+            lines.append('# TYPE %s histogram' % name)
+            for item in series:
+                for bound in self.buckets:
+                    labels = dict(item['labels'], le=repr(bound))
+                    lines.append('%s_bucket%s %s' % (name, format_labels(labels), item['buckets'][bound]))
+                lines.append('%s_bucket%s %s' % (name, format_labels(dict(item['labels'], le='+Inf')), item['count']))
+                lines.append('%s_sum%s %r' % (name, format_labels(item['labels']), item['sum']))
+                lines.append('%s_count%s %s' % (name, format_labels(item['labels']), item['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    def escape(value):
+        return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for (name, value) in sorted(labels.items()))
+
+
+class ByteportInstrumentation:
+    '''
+    Traces requests made by the clients, calls the hooks and feeds the metrics.
+
+    A hook is any callable taking (event, trace) where event is 'start' or 'end'. Exceptions raised
+    by hooks are logged and ignored so they can not break the clients.
+    '''
+
+    def __init__(self, metrics=None, hooks=None):
+        '''
+        :param metrics: [optional] A ByteportMetrics, by default a new one is created. Use False to disable metrics.
+        :param hooks:   [optional] List of hooks
+        '''
+        if metrics is None:
+            metrics = ByteportMetrics()
+        self.metrics = metrics or None
+
+        self.hooks = list(hooks or [])
+
+        # Compiled endpoint templates, see endpoint()
+        self.endpoint_patterns = dict()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def endpoint(self, path, templates):
+        '''
+        Maps a request path to the first matching template, ie. '/api/v1/timeseries/test/6000/' to
+        '/api/v1/timeseries/%s/%s/', so metrics are labeled by endpoint and not by device.
+        '''
+        for template in templates:
+            pattern = self.endpoint_patterns.get(template)
+            if pattern is None:
+                parts = [re.escape(part) for part in template.split('%s')]
+                pattern = self.endpoint_patterns[template] = re.compile('^%s$' % '[^/]*'.join(parts))
+            if pattern.match(path):
+                return template
+        return path
+
+    def start(self, transport, method, endpoint, url=None):
+        trace = ByteportRequestTrace(transport, method, endpoint, url)
+        _current.trace = trace
+        self.call_hooks(TRACE_START, trace)
+        return trace
+
+    def finish(self, trace, status=None, error=None):
+        trace.end_time = time.time()
+        trace.status = status
+        trace.error = error
+
+        if getattr(_current, 'trace', None) is trace:
+            _current.trace = None
+
+        if self.metrics is not None:
+            self.metrics.record(trace)
+
+        self.call_hooks(TRACE_END, trace)
+
+    def call_hooks(self, event, trace):
+        for hook in self.hooks:
+            try:
+                hook(event, trace)
+            except Exception as e:
+                logging.error(u'Instrumentation hook %s failed: %s' % (hook, e))
+
+
+class ByteportInstrumentedHTTPConnection(httplib.HTTPConnection):
+    '''
+    HTTPConnection recording the timing breakdown and bytes sent to the trace of the current thread.
+    '''
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        mark('connect')
+
+    def send(self, data):
+        httplib.HTTPConnection.send(self, data)
+        if isinstance(data, basestring):
+            count_bytes_sent(len(data))
+
+    def request(self, method, url, body=None, headers={}):
+        httplib.HTTPConnection.request(self, method, url, body, headers)
+        mark('send')
+
+    def getresponse(self, *args, **kwargs):
+        response = httplib.HTTPConnection.getresponse(self, *args, **kwargs)
+        mark('first_byte')
+        return response
+
+
+class ByteportInstrumentedHTTPSConnection(ByteportInstrumentedHTTPConnection, httplib.HTTPSConnection):
+    '''
+    HTTPSConnection recording the same breakdown, connect includes the TLS handshake.
+    '''
+
+    # The httplib classes are old-style, attributes are looked up depth first through HTTPConnection
+    default_port = httplib.HTTPS_PORT
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+
+    def connect(self):
+        httplib.HTTPSConnection.connect(self)
+        mark('connect')
+
+
+class ByteportInstrumentedHTTPHandler(urllib2.HTTPHandler):
+    # Replaces the default urllib2 HTTP handler when a client is instrumented
+
+    def http_open(self, req):
+        return self.do_open(ByteportInstrumentedHTTPConnection, req)
@@ -0,0 +1,847 @@
+"""
+Lightweight in-process stand-ins for the Byteport HTTP API and message brokers.
+
+Implements the parts of API v1 used by the HTTP client so it can be tested and benchmarked offline:
+
+ - Store data using API-key, GET and POST         /api/v1/timeseries/[namespace]/[uid]/
+ - Store packets using the legacy API             /api/legacy/packets/timeseries/
+ - Log in (csrftoken + sessionid) and log out     /api/v1/login/ and /api/v1/logout/
+ - Load timeseries data                           /api/v1/timeseries/[namespace]/[uid]/[field name]/
+ - Echo                                           /api/v1/echo/
+
+Latency and errors can be injected to see how the clients behave under load or with a failing server.
+Given a certificate (see create_certificate) the server speaks HTTPS and counts the TLS handshakes.
+
+ByteportMockStompBroker and ByteportMockMQTTBroker accept connections from the STOMP and MQTT clients
+and count the packets published to them. They do not route any messages.
+
+ByteportMockSocksProxy is a SOCKS5 proxy relaying connections, ie. to the ByteportMockServer, counting
+the connections negotiated through it and the round trips needed to negotiate them.
+
+Example:
+
+    server = ByteportMockServer(latency=0.01, error_rate=0.05)
+    server.start()
+
+    client = ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=server.hostname)
+    client.store({'temp': 20})
+
+    server.stop()
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import datetime
+import threading
+import struct
+import select
+import socket
+import ssl
+import shutil
+import tempfile
+import subprocess
+import urlparse
+import Cookie
+import SocketServer
+import BaseHTTPServer
+
+ISO8601 = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class ByteportMockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # HTTP/1.1 so keep-alive connections can be used by the clients
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer the status line, headers and body into one write as real servers do, unbuffered they are
+    # written line by line and Nagle's algorithm delays keep-alive responses by the delayed ACK time
+    wbufsize = -1
+
+    ROUTES = [
+        (re.compile(r'^/api/v1/timeseries/(?P<namespace>[^/]*)/(?P<uid>[^/]*)/$'), 'store'),
+        (re.compile(r'^/api/v1/timeseries/(?P<namespace>[^/]+)/(?P<uid>[^/]+)/(?P<field_name>[^/]+)/$'), 'load'),
+        (re.compile(r'^/api/legacy/packets/timeseries/$'), 'store_packets'),
+        (re.compile(r'^/api/v1/login/$'), 'login'),
+        (re.compile(r'^/api/v1/logout/$'), 'logout'),
+        (re.compile(r'^/api/v1/echo/$'), 'echo'),
+    ]
+
+    def setup(self):
+        # As web servers do, ie. tcp_nodelay of nginx. Otherwise the response would wait for the client to
+        # acknowledge the TLS session tickets, which it delays by 40 ms.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        context = self.server.mock.ssl_context
+        if context is not None:
+            # Handshake in the thread of the connection, not in the accepting thread
+            self.request = context.wrap_socket(self.request, server_side=True)
+            self.server.mock.count_handshake()
+
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.mock.count_connection()
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def log_message(self, format, *args):
+        logging.debug("ByteportMockServer: " + format % args)
+
+    def dispatch(self):
+        mock = self.server.mock
+
+        parsed_url = urlparse.urlparse(self.path)
+        parameters = dict(urlparse.parse_qsl(parsed_url.query, keep_blank_values=True))
+
+        content_length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(content_length) if content_length else ''
+        if body and self.headers.getheader('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            parameters.update(urlparse.parse_qsl(body, keep_blank_values=True))
+
+        self.cookies = Cookie.SimpleCookie(self.headers.getheader('Cookie', ''))
+        self.response_cookies = dict()
+
+        mock.count_request(self.command, parsed_url.path)
+
+        if mock.latency or mock.latency_jitter:
+            time.sleep(mock.latency + mock.random.uniform(0, mock.latency_jitter))
+
+        if mock.error_rate and mock.random.random() < mock.error_rate:
+            return self.respond(mock.error_code, {'error': 'Injected error'})
+
+        for (pattern, name) in self.ROUTES:
+            match = pattern.match(parsed_url.path)
+            if match:
+                return getattr(self, 'handle_%s' % name)(parameters, **match.groupdict())
+
+        self.respond(404, {'error': 'Not found'})
+
+    def respond(self, code, data=None):
+        payload = json.dumps(data) if data is not None else ''
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for (name, value) in self.response_cookies.items():
+            self.send_header('Set-Cookie', '%s=%s; Path=/' % (name, value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def cookie_value(self, name):
+        if name in self.cookies:
+            return self.cookies[name].value
+        return None
+
+    def session_user(self):
+        return self.server.mock.sessions.get(self.cookie_value('sessionid'))
+
+    def handle_store(self, parameters, namespace, uid):
+        mock = self.server.mock
+
+        if not uid or namespace not in mock.api_keys:
+            return self.respond(404, {'error': 'Device not found'})
+
+        if parameters.pop('_key', None) != mock.api_keys[namespace]:
+            return self.respond(403, {'error': 'Invalid API key'})
+
+        timestamp = float(parameters.pop('_ts', time.time()))
+
+        mock.store(namespace, uid, timestamp, parameters)
+        self.respond(200)
+
+    def handle_store_packets(self, parameters):
+        mock = self.server.mock
+
+        if parameters.get('legacy_key') not in mock.legacy_keys:
+            return self.respond(403, {'error': 'Invalid legacy key'})
+
+        try:
+            packets = json.loads(parameters['packets'])
+        except (KeyError, ValueError):
+            return self.respond(500, {'error': 'Malformed packets'})
+
+        for packet in packets:
+            data = dict()
+            for field in packet['data'].split(';'):
+                if '=' in field:
+                    (name, value) = field.split('=', 1)
+                    data[name] = value
+            mock.store(packet['namespace'], packet['uid'], float(packet['timestamp']), data)
+
+        self.respond(200)
+
+    def handle_login(self, parameters):
+        mock = self.server.mock
+
+        if self.command == 'GET':
+            self.response_cookies['csrftoken'] = uuid.uuid4().hex
+            return self.respond(200)
+
+        csrftoken = self.cookie_value('csrftoken')
+        if csrftoken is None or csrftoken != parameters.get('csrfmiddlewaretoken'):
+            return self.respond(403, {'error': 'CSRF verification failed'})
+
+        username = parameters.get('username')
+        if username not in mock.users or mock.users[username] != parameters.get('password'):
+            return self.respond(403, {'error': 'Invalid credentials'})
+
+        session_id = uuid.uuid4().hex
+        mock.sessions[session_id] = username
+
+        self.response_cookies['csrftoken'] = csrftoken
+        self.response_cookies['sessionid'] = session_id
+        self.respond(200)
+
+    def handle_logout(self, parameters):
+        self.server.mock.sessions.pop(self.cookie_value('sessionid'), None)
+        self.respond(200)
+
+    def handle_echo(self, parameters):
+        self.respond(200, parameters)
+
+    def handle_load(self, parameters, namespace, uid, field_name):
+        mock = self.server.mock
+
+        if self.session_user() is None:
+            return self.respond(403, {'error': 'Not logged in'})
+
+        now = datetime.datetime.utcnow()
+
+        if 'from' in parameters:
+            from_time = datetime.datetime.strptime(parameters['from'], ISO8601)
+        elif 'timedelta_minutes' in parameters:
+            from_time = now - datetime.timedelta(minutes=float(parameters['timedelta_minutes']))
+        elif 'timedelta_hours' in parameters:
+            from_time = now - datetime.timedelta(hours=float(parameters['timedelta_hours']))
+        else:
+            from_time = now - datetime.timedelta(days=float(parameters.get('timedelta_days', 1)))
+
+        if 'to' in parameters:
+            to_time = datetime.datetime.strptime(parameters['to'], ISO8601)
+        else:
+            to_time = now
+
+        rows = mock.load(namespace, uid, field_name, epoch_seconds(from_time), epoch_seconds(to_time))
+        path = '%s.%s.%s' % (namespace, uid, field_name)
+
+        ts_data = list()
+        for (timestamp, value) in rows:
+            ts_data.append({
+                'r': str(uuid.uuid1()),
+                'm': {'trv': 'False', 'vlen': str(len(value)), 'hdts': '%d' % (timestamp * 1e6)},
+                't': datetime.datetime.utcfromtimestamp(timestamp).strftime(ISO8601),
+                'v': number_or_string(value),
+            })
+
+        data_type = 'number' if all(type(row['v']) is not unicode for row in ts_data) else 'text'
+
+        self.respond(200, {
+            'meta': {'path': path},
+            'data': {
+                'ts_data': ts_data,
+                'ts_meta': {
+                    'orig_len': len(ts_data),
+                    'len': len(ts_data),
+                    'from': from_time.strftime(ISO8601),
+                    'to': to_time.strftime(ISO8601),
+                    'seconds': int((to_time - from_time).total_seconds()),
+                    'data_type': data_type,
+                    'conversion_errors': 0,
+                    'path': path,
+                    'reduced': False,
+                },
+            },
+        })
+
+
+def epoch_seconds(naive_utc_datetime):
+    return (naive_utc_datetime - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def number_or_string(value):
+    try:
+        return float(value) if '.' in value or 'e' in value.lower() else int(value)
+    except ValueError:
+        return value.decode('utf8')
+
+
+class ByteportMockHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing TLS connections without close_notify or failing the handshake are expected
+        if isinstance(sys.exc_info()[1], ssl.SSLError):
+            logging.debug("ByteportMockServer: TLS error from %s:%s: %s" % (client_address + (sys.exc_info()[1],)))
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+def create_certificate(path, hostname='localhost'):
+    '''
+    Writes a self-signed certificate and its private key for the hostname to a PEM file using the openssl
+    command, use as certfile of ByteportMockServer and as cafile of the clients' SSL context.
+
+    :raises OSError: If the openssl command is not installed
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        key_path = os.path.join(directory, 'key.pem')
+        cert_path = os.path.join(directory, 'cert.pem')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                                   '-subj', '/CN=%s' % hostname, '-keyout', key_path, '-out', cert_path],
+                                  stdout=devnull, stderr=devnull)
+
+        with open(path, 'w') as pem_file:
+            for part in (key_path, cert_path):
+                with open(part) as part_file:
+                    pem_file.write(part_file.read())
+    finally:
+        shutil.rmtree(directory)
+
+    return path
+
+
+class ByteportMockServer:
+    '''
+    Byteport HTTP API stand-in running in a background thread of the current process.
+
+    :param api_keys:        Namespace name -> API key accepted when storing data
+    :param legacy_keys:     Keys accepted by the legacy packets API
+    :param users:           Username -> password accepted by the login
+    :param latency:         Seconds added to every request
+    :param latency_jitter:  Additional random 0..latency_jitter seconds added to every request
+    :param error_rate:      Fraction (0..1) of requests that fail with error_code
+    :param error_code:      HTTP status code of injected errors
+    :param random_seed:     Seed for latency jitter and error injection to make runs repeatable
+    :param port:            Port to listen on, the default 0 picks any free port
+    :param certfile:        PEM file with the certificate and private key to serve HTTPS with
+    '''
+
+    def __init__(self, api_keys=None, legacy_keys=None, users=None, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, error_code=500, random_seed=None, port=0, certfile=None):
+        self.api_keys = api_keys if api_keys is not None else {'test': 'TEST'}
+        self.legacy_keys = legacy_keys if legacy_keys is not None else ['TEST']
+        self.users = users if users is not None else {'admin': 'admin'}
+
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(random_seed)
+
+        self.lock = threading.Lock()
+        self.sessions = dict()
+
+        # (namespace, uid, field name) -> list of (timestamp, value)
+        self.timeseries = dict()
+
+        # (method, path) -> number of requests
+        self.request_counts = dict()
+
+        # Connections accepted, fewer than requests when connections are kept alive
+        self.connections = 0
+
+        if certfile is not None:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            self.ssl_context.load_cert_chain(certfile)
+        else:
+            self.ssl_context = None
+        self.handshakes = 0
+
+        self.httpd = ByteportMockHTTPServer(('127.0.0.1', port), ByteportMockRequestHandler)
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def hostname(self):
+        # Use as byteport_api_hostname of the clients, the certificates of create_certificate() are for localhost
+        if self.ssl_context is not None:
+            return 'localhost:%s' % self.port
+        return '127.0.0.1:%s' % self.port
+
+    @property
+    def protocol(self):
+        # Use as protocol of the clients
+        return 'https' if self.ssl_context is not None else 'http'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.1},
+                                       name='byteport-mock-server')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def count_handshake(self):
+        with self.lock:
+            self.handshakes += 1
+
+    def count_request(self, method, path):
+        with self.lock:
+            key = (method, path)
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    @property
+    def total_requests(self):
+        return sum(self.request_counts.values())
+
+    def store(self, namespace, uid, timestamp, data):
+        with self.lock:
+            for (field_name, value) in data.items():
+                self.timeseries.setdefault((namespace, uid, field_name), list()).append((timestamp, value))
+
+    def load(self, namespace, uid, field_name, from_timestamp, to_timestamp):
+        with self.lock:
+            rows = self.timeseries.get((namespace, uid, field_name), list())
+            return sorted(row for row in rows if from_timestamp <= row[0] <= to_timestamp)
+
+    def values(self, namespace, uid, field_name):
+        # Stored values in time order, handy in tests
+        return [value for (timestamp, value) in self.load(namespace, uid, field_name, 0, float('inf'))]
+
+
+class ByteportMockBroker:
+    '''
+    Base for the broker stand-ins, runs a threaded TCP server in a background thread and keeps count of
+    the messages and packets published to it.
+    '''
+
+    def __init__(self, handler_class, port=0):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.packets = 0
+        self.last_message = None
+
+        self.server = ByteportMockTCPServer(('127.0.0.1', port), handler_class)
+        self.server.mock = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.1},
+                                       name='byteport-mock-broker')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def received(self, message):
+        # Messages are JSON lists of simple string device message packets
+        try:
+            packets = len(json.loads(message))
+        except ValueError:
+            packets = 0
+
+        with self.lock:
+            self.messages += 1
+            self.packets += packets
+            self.last_message = message
+
+    def wait_for_messages(self, count, timeout=10.0):
+        deadline = time.time() + timeout
+        while self.messages < count:
+            if time.time() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+
+class ByteportMockTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ByteportMockStompHandler(SocketServer.StreamRequestHandler):
+
+    def read_frame(self):
+        # Returns (command, headers, body) or None when the connection is closed
+        line = self.rfile.readline()
+        while line in ('\n', '\r\n'):
+            # Heart-beats
+            line = self.rfile.readline()
+        if not line:
+            return None
+
+        command = line.rstrip('\r\n')
+        headers = dict()
+        while True:
+            line = self.rfile.readline().rstrip('\r\n')
+            if not line:
+                break
+            (name, value) = line.split(':', 1)
+            headers.setdefault(name, value)
+
+        if 'content-length' in headers:
+            body = self.rfile.read(int(headers['content-length']))
+            self.rfile.read(1)
+        else:
+            body = ''
+            while True:
+                byte = self.rfile.read(1)
+                if byte in ('\x00', ''):
+                    break
+                body += byte
+
+        return command, headers, body
+
+    def send_frame(self, command, headers=None):
+        lines = [command] + ['%s:%s' % item for item in (headers or dict()).items()]
+        self.wfile.write('\n'.join(lines) + '\n\n\x00')
+
+    def handle(self):
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+
+            (command, headers, body) = frame
+
+            if command in ('CONNECT', 'STOMP'):
+                version = headers.get('accept-version', '1.0').split(',')[-1]
+                self.send_frame('CONNECTED', {'version': version, 'heart-beat': '0,0', 'session': uuid.uuid4().hex})
+            elif command == 'SEND':
+                self.server.mock.received(body)
+            elif command == 'DISCONNECT':
+                if 'receipt' in headers:
+                    self.send_frame('RECEIPT', {'receipt-id': headers['receipt']})
+                return
+
+            if 'receipt' in headers and command != 'DISCONNECT':
+                self.send_frame('RECEIPT', {'receipt-id': headers['receipt']})
+
+
+class ByteportMockStompBroker(ByteportMockBroker):
+    '''
+    STOMP broker stand-in, use the port as broker_port of the ByteportStompClient.
+    '''
+
+    def __init__(self, port=0):
+        ByteportMockBroker.__init__(self, ByteportMockStompHandler, port)
+
+
+class ByteportMockMQTTHandler(SocketServer.StreamRequestHandler):
+
+    CONNECT = 0x10
+    CONNACK = 0x20
+    PUBLISH = 0x30
+    PUBACK = 0x40
+    PUBREC = 0x50
+    PUBREL = 0x60
+    PUBCOMP = 0x70
+    SUBSCRIBE = 0x80
+    SUBACK = 0x90
+    PINGREQ = 0xC0
+    PINGRESP = 0xD0
+    DISCONNECT = 0xE0
+
+    def read_packet(self):
+        # Returns (fixed header byte, remaining bytes) or None when the connection is closed
+        header = self.rfile.read(1)
+        if not header:
+            return None
+
+        remaining_length = 0
+        multiplier = 1
+        while True:
+            byte = ord(self.rfile.read(1))
+            remaining_length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+
+        return ord(header), self.rfile.read(remaining_length)
+
+    def handle(self):
+        while True:
+            packet = self.read_packet()
+            if packet is None:
+                return
+
+            (header, remaining) = packet
+            packet_type = header & 0xF0
+
+            if packet_type == self.CONNECT:
+                self.wfile.write(struct.pack('!BBBB', self.CONNACK, 2, 0, 0))
+            elif packet_type == self.PUBLISH:
+                qos = (header >> 1) & 0x03
+                (topic_length,) = struct.unpack('!H', remaining[:2])
+                position = 2 + topic_length
+                if qos:
+                    (message_id,) = struct.unpack('!H', remaining[position:position + 2])
+                    position += 2
+                self.server.mock.received(remaining[position:])
+                if qos == 1:
+                    self.wfile.write(struct.pack('!BBH', self.PUBACK, 2, message_id))
+                elif qos == 2:
+                    self.wfile.write(struct.pack('!BBH', self.PUBREC, 2, message_id))
+            elif packet_type == self.PUBREL:
+                self.wfile.write(struct.pack('!BB', self.PUBCOMP, 2) + remaining[:2])
+            elif packet_type == self.SUBSCRIBE:
+                # Grant QoS 0 for every topic filter
+                (message_id,) = struct.unpack('!H', remaining[:2])
+                position, granted = 2, ''
+                while position < len(remaining):
+                    (topic_length,) = struct.unpack('!H', remaining[position:position + 2])
+                    position += 2 + topic_length + 1
+                    granted += '\x00'
+                self.wfile.write(struct.pack('!BBH', self.SUBACK, 2 + len(granted), message_id) + granted)
+            elif packet_type == self.PINGREQ:
+                self.wfile.write(struct.pack('!BB', self.PINGRESP, 0))
+            elif packet_type == self.DISCONNECT:
+                return
+
+
+class ByteportMockMQTTBroker(ByteportMockBroker):
+    '''
+    MQTT 3.1.1 broker stand-in, use the port as broker_port of the ByteportMQTTClient.
+    '''
+
+    def __init__(self, port=0):
+        ByteportMockBroker.__init__(self, ByteportMockMQTTHandler, port)
+
+
+class ByteportMockSocksHandler(SocketServer.StreamRequestHandler):
+
+    # Unbuffered, data sent by the client after the negotiation must be left in the socket for relay()
+    rbufsize = 0
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+
+        # Whether the client waited for the previous reply before sending more, ie. it is waiting for this reply
+        self.waited = True
+
+    def read_exactly(self, count):
+        data = self.rfile.read(count)
+        if len(data) < count:
+            raise socket.error("Connection closed during negotiation")
+        return data
+
+    def read_until(self, terminator):
+        data = ''
+        while not data.endswith(terminator):
+            data += self.read_exactly(1)
+        return data
+
+    def reply(self, data):
+        """
+        Sends a negotiation reply. A reply the client is waiting for costs a round trip of latency,
+        a reply to data the client sent without waiting (pipelined) does not.
+        """
+        proxy = self.server.mock
+
+        if self.waited:
+            with proxy.lock:
+                proxy.round_trips += 1
+            if proxy.latency:
+                time.sleep(proxy.latency)
+
+        # Data already sent by the client before this reply was not sent in response to it
+        self.waited = not select.select([self.connection], [], [], 0)[0]
+
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        proxy = self.server.mock
+
+        try:
+            version = self.read_exactly(1)
+            if version == '\x05':
+                negotiated = self.negotiate(proxy)
+            elif version == '\x04':
+                negotiated = self.negotiate_socks4(proxy)
+            elif version == 'C':
+                negotiated = self.negotiate_http(proxy)
+            else:
+                return
+        except (socket.error, struct.error) as e:
+            logging.debug("ByteportMockSocksProxy: negotiation failed: %s" % e)
+            return
+
+        if negotiated is None:
+            return
+        (destination, succeeded, refused) = negotiated
+
+        try:
+            upstream = socket.create_connection(destination)
+        except socket.error:
+            self.reply(refused)
+            return
+
+        with proxy.lock:
+            proxy.negotiations += 1
+            proxy.destinations.append(destination)
+
+        if succeeded is None:
+            bound = upstream.getsockname()
+            succeeded = '\x05\x00\x00\x01' + socket.inet_aton(bound[0]) + struct.pack('>H', bound[1])
+        self.reply(succeeded)
+
+        self.relay(upstream)
+
+    def negotiate(self, proxy):
+        methods = self.read_exactly(ord(self.read_exactly(1)))
+
+        if proxy.username is not None:
+            if '\x02' not in methods:
+                self.reply('\x05\xff')
+                return None
+            self.reply('\x05\x02')
+
+            self.read_exactly(1)
+            username = self.read_exactly(ord(self.read_exactly(1)))
+            password = self.read_exactly(ord(self.read_exactly(1)))
+            if (username, password) != (proxy.username, proxy.password):
+                self.reply('\x01\x01')
+                return None
+            self.reply('\x01\x00')
+        else:
+            if '\x00' not in methods:
+                self.reply('\x05\xff')
+                return None
+            self.reply('\x05\x00')
+
+        (version, command, reserved, address_type) = struct.unpack('BBBB', self.read_exactly(4))
+        if address_type == 1:
+            host = socket.inet_ntoa(self.read_exactly(4))
+        elif address_type == 3:
+            host = self.read_exactly(ord(self.read_exactly(1)))
+        else:
+            self.reply('\x05\x08\x00\x01' + '\x00' * 6)
+            return None
+        (port,) = struct.unpack('>H', self.read_exactly(2))
+
+        if command != 1:
+            self.reply('\x05\x07\x00\x01' + '\x00' * 6)
+            return None
+
+        return (host, port), None, '\x05\x05\x00\x01' + '\x00' * 6
+
+    def negotiate_socks4(self, proxy):
+        (command, port) = struct.unpack('>BH', self.read_exactly(3))
+        address = self.read_exactly(4)
+        self.read_until('\0')
+
+        if address.startswith('\0\0\0') and address != '\0\0\0\0':
+            # SOCKS4A, the host name follows the user ID
+            host = self.read_until('\0')[:-1]
+        else:
+            host = socket.inet_ntoa(address)
+
+        if command != 1:
+            self.reply('\x00\x5b' + '\x00' * 6)
+            return None
+
+        return (host, port), '\x00\x5a' + '\x00' * 6, '\x00\x5b' + '\x00' * 6
+
+    def negotiate_http(self, proxy):
+        request = 'C' + self.read_until('\r\n\r\n')
+        (method, target) = request.split(' ', 2)[:2]
+        (host, _, port) = target.rpartition(':')
+
+        if method != 'CONNECT':
+            self.reply('HTTP/1.1 405 Method Not Allowed\r\n\r\n')
+            return None
+
+        return (host, int(port)), 'HTTP/1.1 200 Connection established\r\n\r\n', \
+            'HTTP/1.1 502 Bad Gateway\r\n\r\n'
+
+    def relay(self, upstream):
+        sockets = [self.connection, upstream]
+
+        # Forward small writes at once as proxies do, Nagle's algorithm would hold back every write
+        # made before the previous one is acknowledged and the client delays acknowledging by 40 ms
+        for relayed in sockets:
+            relayed.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                (readable, writable, failed) = select.select(sockets, [], sockets, 1.0)
+                if failed:
+                    return
+                for source in readable:
+                    data = source.recv(65536)
+                    if not data:
+                        return
+                    (upstream if source is self.connection else self.connection).sendall(data)
+        except socket.error:
+            return
+        finally:
+            upstream.close()
+
+
+class ByteportMockSocksProxy:
+    '''
+    SOCKS5 proxy stand-in relaying connections to any destination, thread per connection. SOCKS4(A) and
+    HTTP CONNECT are accepted too, without authentication.
+
+    :param username:    [optional] Require username/password authentication
+    :param password:    [optional] Password for the username
+    :param port:        [optional] Port to listen on, the default 0 picks any free port
+    :param latency:     [optional] Seconds added per negotiation round trip, to model a remote proxy
+    '''
+
+    def __init__(self, username=None, password=None, port=0, latency=0):
+        self.username = username
+        self.password = password
+        self.latency = latency
+
+        self.lock = threading.Lock()
+
+        # Connections successfully negotiated, and their (host, port) destinations
+        self.negotiations = 0
+        self.destinations = list()
+
+        # Negotiation replies the clients had to wait for
+        self.round_trips = 0
+
+        self.server = ByteportMockTCPServer(('127.0.0.1', port), ByteportMockSocksHandler)
+        self.server.mock = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.1},
+                                       name='byteport-mock-socks-proxy')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
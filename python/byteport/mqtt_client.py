@@ -1,28 +1,81 @@
 
 from client_base import *
+from i8_packets import parse_data_string
 import json
+import time
+import logging
+import threading
 
-try:
-    import paho.mqtt.client as mqtt
-    from paho.mqtt.client import error_string
-    from paho.mqtt.client import MQTTv31, MQTTv311
+# Paho is an optional dependency, it is imported when the first client is created
+# so importing this module stays cheap
+def load_paho():
+    global mqtt, error_string, MQTTv31, MQTTv311, MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
 
-except ImportError:
-    print "Could not import MQTT library. The MQTT client will not be supported."
-    print ""
-    print "If you need to use that client, please do:"
-    print "pip install paho-mqtt"
+    try:
+        import paho.mqtt.client as mqtt
+        from paho.mqtt.client import error_string
+        from paho.mqtt.client import MQTTv31, MQTTv311
+        from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+    except ImportError:
+        raise ByteportClientException("Could not import MQTT library. The MQTT client is not supported "
+                                      "without it, please do: pip install paho-mqtt")
 
 class ByteportMQTTClient(AbstractByteportClient):
     DEFAULT_BROKER_HOST = 'broker.byteport.se'
+    DEFAULT_BROKER_PORT = 1883
     PUBLISH_TOPIC = 'simple_string_dev_message'
     QOS_LEVEL = 0
 
+    SUPPORTED_QOS_LEVELS = [0, 1, 2]
+
+    # Upper limit of packets wrapped in the JSON list of a single publish by store_batch()
+    MAX_PACKETS_PER_PUBLISH = 100
+
+    # Publishes per second when draining the offline queue after a reconnect
+    DRAIN_RATE = 20
+
+    # Seconds to wait before a publish from the offline queue that failed is tried again
+    DRAIN_RETRY_INTERVAL = 1
+
     def __init__(self, namespace, device_uid, username, password,
-                 broker_host=DEFAULT_BROKER_HOST, loop_forever=False, explicit_vhost=None):
+                 broker_host=DEFAULT_BROKER_HOST, loop_forever=False, explicit_vhost=None,
+                 qos=QOS_LEVEL, max_packets_per_publish=MAX_PACKETS_PER_PUBLISH,
+                 offline_queue=None, drain_rate=DRAIN_RATE, broker_port=DEFAULT_BROKER_PORT, instrumentation=None,
+                 aggregator=None):
+        '''
+        Create a ByteportMQTTClient and connect to the Byteport Broker.
+
+        :param qos:                     [optional] Default QoS level (0, 1 or 2) used for all publishes, can be
+                                        overridden per call to store(), store_batch() and store_raw()
+        :param max_packets_per_publish: [optional] Number of packets store_batch() will put in a single publish
+        :param offline_queue:           [optional] A ByteportPersistentQueue that buffers publishes while the client
+                                        is disconnected, it is drained when the connection is up again
+        :param drain_rate:              [optional] Max publishes per second when draining the offline queue
+        :param broker_port:             [optional] Port of the broker
+        :param instrumentation:         [optional] A ByteportInstrumentation tracing every publish
+        :param aggregator:              [optional] A ByteportStreamAggregator keeping rolling statistics of the data
+                                        stored and of the data packets received, see streaming.py
+        '''
+
+        load_paho()
 
         self.namespace = str(namespace)
 
+        self.qos = self.verify_qos(qos)
+
+        if max_packets_per_publish < 1:
+            raise ByteportClientException("max_packets_per_publish must be at least 1")
+        self.max_packets_per_publish = max_packets_per_publish
+
+        self.offline_queue = offline_queue
+        self.drain_rate = drain_rate
+        self.drain_lock = threading.Lock()
+        self.drain_thread = None
+        self.draining = False
+        self.connected = False
+        self.instrumentation = instrumentation
+        self.aggregator = aggregator
+
         self.device_uid = device_uid
 
         self.guid = '%s.%s' % (namespace, device_uid)
@@ -40,11 +93,12 @@ class ByteportMQTTClient(AbstractByteportClient):
         self.mqtt_client = mqtt.Client(client_id=self.guid, clean_session=False, protocol=MQTTv311)
         self.mqtt_client.username_pw_set(username, password)
         self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_disconnect = self.on_disconnect
         self.mqtt_client.on_message = self.on_message
 
         print "Connecting to %s" % broker_host
 
-        rc = self.mqtt_client.connect(broker_host, 1883, 60)
+        rc = self.mqtt_client.connect(broker_host, broker_port, 60)
         print('connect(): %s' % error_string(rc))
 
         # Blocking call that processes network traffic, dispatches callbacks and
@@ -62,6 +116,11 @@ class ByteportMQTTClient(AbstractByteportClient):
         if rc != 0:
             raise ByteportConnectException("Error while connecting to MQTT Broker: " + error_string(rc))
 
+        self.connected = True
+
+        if self.offline_queue is not None and len(self.offline_queue) > 0:
+            self.start_draining()
+
         # Subscribing in on_connect() means that if we lose the connection and
         # reconnect then subscriptions will be renewed.
         #self.mqtt_client.subscribe(self.self_topic_name, qos=self.QOS_LEVEL)
@@ -69,25 +128,183 @@ class ByteportMQTTClient(AbstractByteportClient):
         # For testing pub/subscribe via. RabbitMQ -> Exchange -> Queue
         #self.client.subscribe(self.PUBLISH_TOPIC, qos=self.QOS_LEVEL)
 
+    def on_disconnect(self, client, userdata, rc):
+        logging.info('on_disconnect: %s' % error_string(rc))
+        self.connected = False
+
     # The callback for when a PUBLISH message is received from the server.
     def on_message(self, client, userdata, msg):
         print(msg.topic+" "+str(msg.payload))
 
-    def store(self, data_string):
-        ssdm_packet = self.build_simple_string_device_message_packet(self.namespace, self.device_uid, data_string)
+        if self.aggregator is not None:
+            self.aggregator.observe_packets(msg.payload)
+
+    def verify_qos(self, qos):
+        if qos not in self.SUPPORTED_QOS_LEVELS:
+            raise ByteportClientException("Unsupported QoS level: %s" % qos)
+        return qos
+
+    def store(self, data_string, timestamp=None, qos=None, device_uid=None):
+        '''
+        Store a single data string, ie. 'temp=10;last_word=mom'
+
+        :param timestamp:   [optional] Any timestamp accepted by auto_timestamp(), defaults to now (second resolution)
+        :param qos:         [optional] QoS level for this publish, defaults to the client QoS
+        :param device_uid:  [optional] Store on behalf of another device than the one given in the constructor
+        '''
+        if device_uid is None:
+            device_uid = self.device_uid
+
+        ssdm_packet = self.build_simple_string_device_message_packet(self.namespace, device_uid, data_string, timestamp)
 
         json_string = json.dumps([ssdm_packet])
 
-        self.store_raw(json_string)
+        result = self.store_raw(json_string, qos)
+        if result == MQTT_ERR_SUCCESS:
+            self.observe_published([ssdm_packet])
+        return result
+
+    def store_batch(self, data_strings, qos=None, device_uid=None):
+        '''
+        Store many data strings using as few publishes as possible. The packets are wrapped in one
+        JSON list per publish, each list holding at most max_packets_per_publish packets.
+
+        :param data_strings:    Iterable of data strings or (data string, timestamp) tuples
+        :param qos:             [optional] QoS level for the publishes, defaults to the client QoS
+        :param device_uid:      [optional] Store on behalf of another device than the one given in the constructor
+        :return:                A list with the result code of each publish
+        '''
+        if device_uid is None:
+            device_uid = self.device_uid
+
+        results = list()
+        packets = list()
+
+        for item in data_strings:
+            if isinstance(item, tuple):
+                data_string, timestamp = item
+            else:
+                data_string, timestamp = item, None
+
+            packets.append(self.build_simple_string_device_message_packet(self.namespace, device_uid,
+                                                                          data_string, timestamp))
+
+            if len(packets) >= self.max_packets_per_publish:
+                results.append(self.store_raw(json.dumps(packets), qos))
+                if results[-1] == MQTT_ERR_SUCCESS:
+                    self.observe_published(packets)
+                packets = list()
+
+        if packets:
+            results.append(self.store_raw(json.dumps(packets), qos))
+            if results[-1] == MQTT_ERR_SUCCESS:
+                self.observe_published(packets)
 
-    def store_raw(self, message):
-        # TODO: Wrap in JSON packet
+        return results
 
-        # Publish with QoS=2
+    def observe_published(self, packets):
+        # The aggregator only gets data that was published, queued data is added when it is drained
+        if self.aggregator is not None:
+            for packet in packets:
+                self.aggregator.observe(packet['uid'], parse_data_string(packet['data']), packet['timestamp'])
+
+    def store_raw(self, message, qos=None):
+        # The message is expected to be a JSON list of simple string device message packets
+        #
+        # QoS 0 gives the highest throughput, use 1 or 2 when delivery must be guaranteed, see
         # http://www.hivemq.com/blog/mqtt-essentials-part-6-mqtt-quality-of-service-levels
-        (result, mid) = self.mqtt_client.publish(topic=self.PUBLISH_TOPIC, payload=message, qos=self.QOS_LEVEL)
+        if qos is None:
+            qos = self.qos
+        else:
+            qos = self.verify_qos(qos)
+
+        if self.offline_queue is not None:
+            with self.drain_lock:
+                # Queue behind any messages not yet drained to keep the order of the data
+                queued = self.draining or not self.connected or len(self.offline_queue) > 0
+                if queued:
+                    self.offline_queue.put(message, qos)
+
+            if queued:
+                if self.connected:
+                    self.start_draining()
+                return MQTT_ERR_NO_CONN
+
+        (result, mid) = self.publish(message, qos)
+
+        logging.debug("store(): %s" % error_string(result))
+
+        if result != MQTT_ERR_SUCCESS and self.offline_queue is not None:
+            logging.info("Publish failed, message was put in the offline queue")
+            self.offline_queue.put(message, qos)
+            self.start_draining()
+
+        return result
+
+    def publish(self, message, qos):
+        if self.instrumentation is None:
+            return self.mqtt_client.publish(topic=self.PUBLISH_TOPIC, payload=message, qos=qos)
+
+        # NOTE: With QoS 1 and 2 the publish is acknowledged later, the trace only covers handing it to paho
+        trace = self.instrumentation.start('mqtt', 'PUBLISH', self.PUBLISH_TOPIC)
+        trace.bytes_sent = len(message)
+        try:
+            (result, mid) = self.mqtt_client.publish(topic=self.PUBLISH_TOPIC, payload=message, qos=qos)
+        except Exception as e:
+            self.instrumentation.finish(trace, None, e.__class__.__name__)
+            raise
+
+        if result == MQTT_ERR_SUCCESS:
+            self.instrumentation.finish(trace, result)
+        else:
+            self.instrumentation.finish(trace, result, error_string(result))
+
+        return result, mid
+
+    def start_draining(self):
+        with self.drain_lock:
+            if self.draining:
+                return
+            self.draining = True
+
+        self.drain_thread = threading.Thread(target=self.drain_offline_queue, name='byteport-mqtt-drain')
+        self.drain_thread.daemon = True
+        self.drain_thread.start()
+
+    def drain_offline_queue(self):
+        # Runs in its own thread so the network loop can keep on processing traffic while draining.
+        # Stops when the queue is empty or the client is disconnected, on_connect() starts it again.
+        logging.info("Draining %s messages from the offline queue" % len(self.offline_queue))
+
+        interval = 1.0 / self.drain_rate
+
+        while True:
+            with self.drain_lock:
+                if self.connected:
+                    queued = self.offline_queue.peek()
+                else:
+                    queued = None
+
+                if queued is None:
+                    self.draining = False
+                    return
+
+            (message, qos) = queued
+            (result, mid) = self.publish(message, qos)
+
+            if result != MQTT_ERR_SUCCESS:
+                # Stores queue behind the message until it is published, so keep on trying
+                logging.warn("Publish from the offline queue failed, trying again in %s seconds: %s" %
+                             (self.DRAIN_RETRY_INTERVAL, error_string(result)))
+                time.sleep(self.DRAIN_RETRY_INTERVAL)
+                continue
+
+            self.offline_queue.pop()
+
+            if self.aggregator is not None:
+                self.aggregator.observe_packets(message)
 
-        print "store(): %s" % error_string(result)
+            time.sleep(interval)
 
     def block(self):
         self.mqtt_client.loop_forever()
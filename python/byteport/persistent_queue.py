@@ -0,0 +1,94 @@
+import os
+import json
+import logging
+import threading
+from collections import deque
+
+from client_base import ByteportClientException
+
+
+class ByteportPersistentQueue:
+    '''
+    Bounded first-in-first-out queue of outbound messages persisted on disk.
+
+    Every message is kept in its own file in the queue directory and named by a sequence number so the
+    queue survives restarts of the process. Files are written to a temporary name and then renamed in
+    place, so a crash can not leave a half written message behind.
+
+    When max_messages is reached the oldest message is dropped to make room for the new one, this keeps
+    the latest data which is usually the most interesting after a long period offline.
+    '''
+
+    FILE_SUFFIX = '.msg'
+    TEMP_SUFFIX = '.tmp'
+
+    DEFAULT_MAX_MESSAGES = 10000
+
+    def __init__(self, directory, max_messages=DEFAULT_MAX_MESSAGES):
+        if max_messages < 1:
+            raise ByteportClientException("max_messages must be at least 1")
+
+        self.directory = directory
+        self.max_messages = max_messages
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        sequence_numbers = list()
+        for file_name in os.listdir(directory):
+            if file_name.endswith(self.FILE_SUFFIX):
+                sequence_numbers.append(int(file_name[:-len(self.FILE_SUFFIX)]))
+            elif file_name.endswith(self.TEMP_SUFFIX):
+                # Left over from an interrupted put()
+                os.remove(os.path.join(directory, file_name))
+
+        self.sequence_numbers = deque(sorted(sequence_numbers))
+
+        if self.sequence_numbers:
+            self.next_sequence_number = self.sequence_numbers[-1] + 1
+            logging.info("Found %s queued messages in %s" % (len(self.sequence_numbers), directory))
+        else:
+            self.next_sequence_number = 0
+
+    def __len__(self):
+        return len(self.sequence_numbers)
+
+    def __path(self, sequence_number, suffix=FILE_SUFFIX):
+        return os.path.join(self.directory, '%020d%s' % (sequence_number, suffix))
+
+    def put(self, payload, qos=0):
+        with self.lock:
+            while len(self.sequence_numbers) >= self.max_messages:
+                dropped = self.sequence_numbers.popleft()
+                os.remove(self.__path(dropped))
+                logging.warn("Offline queue in %s is full, dropped the oldest message" % self.directory)
+
+            sequence_number = self.next_sequence_number
+            self.next_sequence_number += 1
+
+            temp_path = self.__path(sequence_number, self.TEMP_SUFFIX)
+            with open(temp_path, 'w') as queue_file:
+                json.dump({'payload': payload, 'qos': qos}, queue_file)
+            os.rename(temp_path, self.__path(sequence_number))
+
+            self.sequence_numbers.append(sequence_number)
+
+    def peek(self):
+        '''
+        :return: The oldest message as a (payload, qos) tuple without removing it, or None if the queue is empty
+        '''
+        with self.lock:
+            if not self.sequence_numbers:
+                return None
+
+            with open(self.__path(self.sequence_numbers[0]), 'r') as queue_file:
+                message = json.load(queue_file)
+
+            return message['payload'], message['qos']
+
+    def pop(self):
+        # Remove the message previously returned by peek()
+        with self.lock:
+            if self.sequence_numbers:
+                os.remove(self.__path(self.sequence_numbers.popleft()))
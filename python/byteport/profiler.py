@@ -0,0 +1,255 @@
+"""
+Sampling profiler for long running collector processes.
+
+ByteportSamplingProfiler runs a daemon thread that samples the stacks of all other threads at a fixed
+interval and counts in which category each sample was taken:
+
+    validation      verifying names and data types of fields
+    encoding        building data strings and packets, UTF-8, JSON, URL and base64 encoding
+    compression     gzip and bzip2
+    network         sockets, HTTP, SOCKS, STOMP and MQTT
+    sleep           waiting in time.sleep() or for a lock or event
+    other           anything else
+
+Sampling does not slow down the profiled code, only the sampling thread itself uses CPU (about a
+hundred stack walks per second with the default interval). The report lists the time per category
+and the functions where most samples were taken. It is written to the output file, or to stderr, when
+the process receives SIGUSR1 and when the process exits.
+
+Enable it with --profile in collectors using the factories, or directly:
+
+    profiler = ByteportSamplingProfiler(output='/tmp/collector.profile')
+    profiler.start()
+    profiler.install()
+"""
+import os
+import sys
+import time
+import signal
+import atexit
+import logging
+import datetime
+import linecache
+import threading
+
+VALIDATION = 'validation'
+ENCODING = 'encoding'
+COMPRESSION = 'compression'
+NETWORK = 'network'
+SLEEP = 'sleep'
+OTHER = 'other'
+
+CATEGORIES = [VALIDATION, ENCODING, COMPRESSION, NETWORK, SLEEP, OTHER]
+
+# Python functions, checked from the innermost frame and outwards
+CATEGORY_FUNCTIONS = {
+    'special_match': VALIDATION,
+    'verify_name': VALIDATION,
+    'verify_field_name': VALIDATION,
+    'verify_qos': VALIDATION,
+    'auto_timestamp': ENCODING,
+    'utf8_encode_value': ENCODING,
+    'convert_data_to_utf8': ENCODING,
+    'build_delimited_data_string': ENCODING,
+    'build_simple_string_device_message_packet': ENCODING,
+    'urlencode': ENCODING,
+    'b64encode': ENCODING,
+    'encodestring': ENCODING,
+    'dumps': ENCODING,
+    'encode': ENCODING,
+    'compress': COMPRESSION,
+}
+
+# Modules by file name, all code in them is counted as network
+NETWORK_MODULES = ['socket', 'ssl', 'httplib', 'urllib2', 'socks', 'socksipyhandler']
+
+# Packages of third party network libraries, matched against the full path of the module
+NETWORK_PACKAGES = ['paho', 'stompest']
+
+# C functions do not have frames, the calls are found in the source line of the innermost Python frame
+CATEGORY_CALLS = [
+    ('sleep(', SLEEP),
+    ('.wait(', SLEEP),
+    ('.acquire(', SLEEP),
+    ('compress(', COMPRESSION),
+    ('.recv(', NETWORK),
+    ('.send(', NETWORK),
+    ('.sendall(', NETWORK),
+    ('.connect(', NETWORK),
+    ('select(', NETWORK),
+    ('getaddrinfo(', NETWORK),
+]
+
+# Functions of the threading module that only wait
+WAITING_FUNCTIONS = ['wait', 'join', 'acquire']
+
+
+class ByteportSamplingProfiler:
+    '''
+    Samples the stacks of all threads and aggregates the samples per category and function.
+    '''
+
+    DEFAULT_INTERVAL = 0.01
+
+    # Functions listed in the report
+    TOP_FUNCTIONS = 20
+
+    def __init__(self, interval=DEFAULT_INTERVAL, output=None):
+        '''
+        :param interval:    [optional] Seconds between samples
+        :param output:      [optional] File the report is written to, by default it is written to stderr
+        '''
+        self.interval = interval
+        self.output = output
+
+        self.lock = threading.Lock()
+        self.category_samples = dict((category, 0) for category in CATEGORIES)
+
+        # (file name, line number, function name) -> [samples, category]
+        self.function_samples = dict()
+
+        self.samples = 0
+        self.started = None
+        self.running = False
+        self.thread = None
+
+        # Module file name -> is network module, frames are categorized thousands of times per second
+        self.network_files = dict()
+
+    def start(self):
+        if self.running:
+            return self
+
+        self.running = True
+        self.started = time.time()
+
+        self.thread = threading.Thread(target=self.run, name='ByteportSamplingProfiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def install(self, signum=getattr(signal, 'SIGUSR1', None)):
+        '''
+        Write the report at exit and when the given signal is received.
+        Must be called from the main thread since signal handlers can only be set there.
+        '''
+        atexit.register(self.dump)
+
+        if signum is not None:
+            signal.signal(signum, lambda received_signum, frame: self.dump())
+
+    def run(self):
+        own_thread_id = threading.current_thread().ident
+
+        while self.running:
+            time.sleep(self.interval)
+
+            for (thread_id, frame) in sys._current_frames().items():
+                if thread_id != own_thread_id:
+                    self.sample(frame)
+
+    def sample(self, frame):
+        code = frame.f_code
+        location = (code.co_filename, frame.f_lineno, code.co_name)
+        category = self.categorize(frame)
+
+        with self.lock:
+            self.samples += 1
+            self.category_samples[category] += 1
+
+            entry = self.function_samples.get(location)
+            if entry is None:
+                self.function_samples[location] = [1, category]
+            else:
+                entry[0] += 1
+
+    def categorize(self, frame):
+        innermost = frame
+
+        # C calls made by the innermost frame, ie. time.sleep() or bz2.compress()
+        line = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+        for (call, category) in CATEGORY_CALLS:
+            if call in line:
+                return category
+
+        while frame is not None:
+            code = frame.f_code
+
+            category = CATEGORY_FUNCTIONS.get(code.co_name)
+            if category is not None:
+                return category
+
+            if self.is_network_file(code.co_filename):
+                return NETWORK
+
+            if frame is innermost and code.co_name in WAITING_FUNCTIONS and \
+                    os.path.basename(code.co_filename).startswith('threading.'):
+                return SLEEP
+
+            frame = frame.f_back
+
+        return OTHER
+
+    def is_network_file(self, filename):
+        network = self.network_files.get(filename)
+
+        if network is None:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            parts = filename.replace('\\', '/').split('/')
+            network = module in NETWORK_MODULES or any(package in parts for package in NETWORK_PACKAGES)
+            self.network_files[filename] = network
+
+        return network
+
+    def report(self):
+        '''
+        :return: The report as text
+        '''
+        with self.lock:
+            samples = self.samples
+            category_samples = dict(self.category_samples)
+            functions = sorted(self.function_samples.items(), key=lambda item: -item[1][0])[:self.TOP_FUNCTIONS]
+
+        elapsed = time.time() - (self.started or time.time())
+
+        def percent(count):
+            if not samples:
+                return 0.0
+            return count * 100.0 / samples
+
+        lines = ['Byteport sampling profile of process %s at %s' % (os.getpid(), datetime.datetime.now().isoformat()),
+                 '%s samples in %.1f seconds, sampled every %s seconds' % (samples, elapsed, self.interval),
+                 '',
+                 '%-12s %10s %8s %12s' % ('category', 'samples', '%', 'seconds')]
+
+        for category in CATEGORIES:
+            count = category_samples[category]
+            lines.append('%-12s %10d %7.1f%% %12.2f' % (category, count, percent(count), count * self.interval))
+
+        lines += ['', '%10s %8s  %-12s %s' % ('samples', '%', 'category', 'function')]
+        for ((filename, line_number, function_name), (count, category)) in functions:
+            lines.append('%10d %7.1f%%  %-12s %s (%s:%s)' % (count, percent(count), category, function_name,
+                                                             filename, line_number))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self):
+        report = self.report()
+
+        if self.output is None:
+            # Not logged, collectors usually leave the root logger at WARNING
+            sys.stderr.write(report)
+            return
+
+        try:
+            with open(self.output, 'w') as output_file:
+                output_file.write(report)
+        except IOError as e:
+            logging.error(u'Failed to write profile to %s: %s' % (self.output, e))
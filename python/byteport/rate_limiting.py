@@ -0,0 +1,351 @@
+"""
+Token bucket rate limiting of outbound stores.
+
+A ByteportRateLimiter given to the HTTP clients (rate_limiter=...) limits the stores made, in total
+and/or per device. A bucket holds up to burst tokens and is refilled with rate tokens per second,
+each store takes one token. When there is no token left the store is handled by the overflow policy:
+
+    block       wait until a token is available (default)
+    drop        drop the store, counted in dropped
+    coalesce    merge the store with the other pending stores of the device. The newest value of each
+                field and the newest timestamp are kept, and the merged store is sent as soon as there
+                is a token. Use this when only the latest values matter, ie. for a directory poller.
+                A merged store that fails to be sent is put back, first in line and merged with the
+                stores of the device queued meanwhile, and sent again when there is a token. flush()
+                also raises the error. Stores with invalid data are dropped, they would never succeed.
+
+Example:
+
+    # At most 10 stores per second in total, bursts of 50, and one store per 5 seconds per device
+    limiter = ByteportRateLimiter(rate=10, burst=50, device_rate=0.2, overflow=ByteportRateLimiter.COALESCE)
+    client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', 'barDev1', rate_limiter=limiter)
+"""
+import time
+import logging
+import threading
+import collections
+
+from client_base import ByteportClientException, ByteportClientInvalidFieldNameException, \
+    ByteportClientInvalidDataTypeException, ByteportClientUnsupportedTimestampTypeException
+
+
+class ByteportTokenBucket:
+    '''
+    A bucket of up to burst tokens refilled with rate tokens per second. Not thread safe by itself,
+    the ByteportRateLimiter serializes all access.
+    '''
+
+    def __init__(self, rate, burst=None, clock=time.time):
+        '''
+        :param rate:    Tokens added per second
+        :param burst:   [optional] Size of the bucket, by default one second worth of tokens (at least one)
+        :param clock:   [optional] Function returning the current time in seconds
+        '''
+        if rate <= 0:
+            raise ByteportClientException("The rate must be positive, was %s" % rate)
+
+        if burst is None:
+            burst = max(1.0, float(rate))
+        if burst < 1:
+            raise ByteportClientException("The burst must be at least 1, was %s" % burst)
+
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+
+        # Starts full
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, tokens=1):
+        '''
+        :return: Seconds until the tokens are available, 0 if they are available now
+        '''
+        self.refill()
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def take(self, tokens=1):
+        self.refill()
+        self.tokens -= tokens
+
+    def is_full(self):
+        self.refill()
+        return self.tokens >= self.burst
+
+
+class ByteportRateLimiter:
+    '''
+    Limits stores with a global and/or a per device token bucket, see the module documentation.
+    '''
+
+    BLOCK = 'block'
+    DROP = 'drop'
+    COALESCE = 'coalesce'
+
+    OVERFLOW_POLICIES = [BLOCK, DROP, COALESCE]
+
+    # Errors in the data itself, a coalesced store failing with one of these is not sent again
+    DATA_EXCEPTIONS = (ByteportClientInvalidFieldNameException,
+                       ByteportClientInvalidDataTypeException,
+                       ByteportClientUnsupportedTimestampTypeException)
+
+    # Per device buckets kept, beyond this the least recently used is forgotten. A forgotten bucket
+    # starts full again, so keep this above the number of devices storing within device_burst / device_rate
+    MAX_DEVICE_BUCKETS = 1000
+
+    def __init__(self, rate=None, burst=None, device_rate=None, device_burst=None, overflow=BLOCK, clock=time.time):
+        '''
+        :param rate:            [optional] Stores per second in total
+        :param burst:           [optional] Stores that can be made at once in total
+        :param device_rate:     [optional] Stores per second per device
+        :param device_burst:    [optional] Stores that can be made at once per device
+        :param overflow:        [optional] One of 'block', 'drop' or 'coalesce'
+        :param clock:           [optional] Function returning the current time in seconds
+        '''
+        if rate is None and device_rate is None:
+            raise ByteportClientException("At least one of rate or device_rate must be given")
+
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ByteportClientException("Unsupported overflow policy '%s', use one of %s" %
+                                          (overflow, ', '.join(self.OVERFLOW_POLICIES)))
+
+        self.clock = clock
+        self.overflow = overflow
+
+        if rate is not None:
+            self.bucket = ByteportTokenBucket(rate, burst, clock)
+        else:
+            self.bucket = None
+
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        # Device UID -> ByteportTokenBucket, least recently used first
+        self.device_buckets = collections.OrderedDict()
+
+        self.condition = threading.Condition()
+
+        # Device UID -> [send function, data, timestamp] of the coalesced stores waiting for a token,
+        # in the order the devices were first queued
+        self.pending = dict()
+        self.pending_order = list()
+
+        # Devices of the coalesced stores being sent, by the flush thread or flush()
+        self.sending = set()
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+        self.flush_thread = None
+
+    def device_bucket(self, device_uid):
+        # Taken out and put back last to keep the least recently used first
+        bucket = self.device_buckets.pop(device_uid, None)
+        if bucket is None:
+            if len(self.device_buckets) >= self.MAX_DEVICE_BUCKETS:
+                self.device_buckets.popitem(last=False)
+            bucket = ByteportTokenBucket(self.device_rate, self.device_burst, self.clock)
+
+        self.device_buckets[device_uid] = bucket
+        return bucket
+
+    def reserve(self, device_uid):
+        '''
+        Takes a token from the buckets if there is one in all of them. Must be called holding the condition.
+
+        :return: 0 if a token was taken, otherwise the seconds until there is one
+        '''
+        delay = 0
+        if self.bucket is not None:
+            delay = self.bucket.delay()
+
+        if self.device_rate is not None and device_uid is not None:
+            device_bucket = self.device_bucket(device_uid)
+            delay = max(delay, device_bucket.delay())
+        else:
+            device_bucket = None
+
+        if delay == 0:
+            if self.bucket is not None:
+                self.bucket.take()
+            if device_bucket is not None:
+                device_bucket.take()
+            self.sent += 1
+
+        return delay
+
+    def acquire(self, device_uid=None):
+        '''
+        Waits until a store for the device is allowed, regardless of the overflow policy.
+        '''
+        while True:
+            with self.condition:
+                delay = self.reserve(device_uid)
+            if delay == 0:
+                return
+            time.sleep(delay)
+
+    def submit(self, device_uid, data, timestamp, send):
+        '''
+        Calls send(data, device_uid, timestamp) now, later or not at all depending on the overflow policy.
+
+        :return: True if the store was sent, False if it was dropped or queued to be coalesced
+        '''
+        if self.overflow == self.BLOCK:
+            self.acquire(device_uid)
+            send(data, device_uid, timestamp)
+            return True
+
+        with self.condition:
+            waiting = self.pending.get(device_uid)
+
+            if waiting is not None:
+                # Never overtake the stores already waiting for the device
+                self.coalesce(waiting, data, timestamp)
+                self.coalesced += 1
+                self.condition.notify_all()
+                return False
+
+            if device_uid in self.sending:
+                # Nor the store being sent, it is put back if it fails
+                self.pending[device_uid] = [send, dict(data), timestamp]
+                self.pending_order.append(device_uid)
+                self.condition.notify_all()
+                return False
+
+            if self.reserve(device_uid) > 0:
+                if self.overflow == self.DROP:
+                    self.dropped += 1
+                    logging.warn(u'Rate limit exceeded, dropped store for device %s' % device_uid)
+                    return False
+
+                self.pending[device_uid] = [send, dict(data), timestamp]
+                self.pending_order.append(device_uid)
+                self.start_flushing()
+                self.condition.notify_all()
+                return False
+
+        send(data, device_uid, timestamp)
+        return True
+
+    def coalesce(self, waiting, data, timestamp):
+        waiting[1].update(data)
+        if timestamp is not None:
+            waiting[2] = timestamp
+
+    def put_back(self, device_uid, send, data, timestamp):
+        '''
+        Puts a coalesced store that failed to be sent first in line, under the stores of the device queued
+        since. Must be called holding the condition.
+        '''
+        store = [send, data, timestamp]
+
+        waiting = self.pending.pop(device_uid, None)
+        if waiting is not None:
+            self.pending_order.remove(device_uid)
+            self.coalesce(store, waiting[1], waiting[2])
+
+        self.pending[device_uid] = store
+        self.pending_order.insert(0, device_uid)
+        self.condition.notify_all()
+
+    def start_flushing(self):
+        if self.flush_thread is None:
+            self.flush_thread = threading.Thread(target=self.flush_pending, name='ByteportRateLimiter')
+            self.flush_thread.daemon = True
+            self.flush_thread.start()
+
+    def next_pending(self):
+        '''
+        :return: (device_uid, [send, data, timestamp]) of the first pending store that may be sent,
+                 waits until there is one
+        '''
+        with self.condition:
+            while True:
+                if not self.pending_order:
+                    self.condition.wait()
+                    continue
+
+                shortest_delay = None
+                for device_uid in self.pending_order:
+                    if device_uid in self.sending:
+                        continue
+
+                    delay = self.reserve(device_uid)
+                    if delay == 0:
+                        self.pending_order.remove(device_uid)
+                        self.sending.add(device_uid)
+                        return device_uid, self.pending.pop(device_uid)
+
+                    if shortest_delay is None or delay < shortest_delay:
+                        shortest_delay = delay
+
+                    # All devices wait for the same global bucket
+                    if self.bucket is not None and self.bucket.delay() > 0:
+                        break
+
+                self.condition.wait(shortest_delay)
+
+    def send_pending(self, device_uid, send, data, timestamp):
+        '''
+        Sends a coalesced store taken from pending, putting it back if it fails.
+        '''
+        try:
+            # The clients add their own fields to the data sent
+            send(dict(data), device_uid, timestamp)
+        except self.DATA_EXCEPTIONS as e:
+            logging.error(u'Dropped coalesced store for device %s: %s' % (device_uid, e))
+            raise
+        except Exception as e:
+            logging.error(u'Failed to send coalesced store for device %s, sending it again later: %s' %
+                          (device_uid, e))
+            with self.condition:
+                self.put_back(device_uid, send, data, timestamp)
+            raise
+        finally:
+            with self.condition:
+                self.sending.discard(device_uid)
+                self.condition.notify_all()
+
+    def flush_pending(self):
+        while True:
+            (device_uid, (send, data, timestamp)) = self.next_pending()
+            try:
+                self.send_pending(device_uid, send, data, timestamp)
+            except Exception:
+                # Logged, and put back unless the data is invalid
+                pass
+
+    def flush(self):
+        '''
+        Sends all pending stores in the calling thread, waiting for tokens as needed. Call before exiting.
+        A store that fails to be sent stays pending and the error is raised.
+        '''
+        while True:
+            with self.condition:
+                while True:
+                    device_uid = next((uid for uid in self.pending_order if uid not in self.sending), None)
+                    if device_uid is not None or not self.sending:
+                        break
+                    # Let the flush thread finish the store it is sending, it may be put back
+                    self.condition.wait(0.1)
+
+                if device_uid is None:
+                    return
+                self.pending_order.remove(device_uid)
+                (send, data, timestamp) = self.pending.pop(device_uid)
+                self.sending.add(device_uid)
+
+            self.acquire(device_uid)
+            self.send_pending(device_uid, send, data, timestamp)
+
+    def __len__(self):
+        return len(self.pending_order)
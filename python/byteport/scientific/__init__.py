@@ -0,0 +1,355 @@
+
+"""
+Support-package that will leverage stored Byteport data for scientific usage, typically in
+some kind of analytics case.
+
+Main functions of this package are:
+
+ - Show how to integrate with Byteports Web-service APIs.
+ - Basic analytics and visualization using Pandas
+
+You can use this package in your python scientific tool of choice, such as SciPy or Anaconda
+
+
+INSTALLATION
+============
+
+# If not run from pandas_examples.py, install Byteport API to your Python env:
+#
+git clone https://github.com/iGW/byteport-api
+cd byteport-api/python
+python setup.py install
+pip install pandas
+
+# Pandas
+#
+pip install pandas
+
+# Pandas profiling ( will install matplotlib and pandas )
+#
+cd /tmp
+git clone https://github.com/JosPolfliet/pandas-profiling
+cd pandas-profiling
+python setup.py install
+
+"""
+from byteport.http_clients import ByteportHttpClient
+import datetime
+
+# NOTE: pandas is imported by the methods using it, it is slow to import and not needed
+# until data is actually loaded or analysed
+
+ISO8601 = '%Y-%m-%dT%H:%M:%S.%f'
+
+class ByteportPandas:
+    """
+    Provides base functionality for connecting and loading data into Pandas data formats
+
+    Extend at will!
+    """
+
+    def __init__(self, username, password, byteport_api_hostname=ByteportHttpClient.DEFAULT_BYTEPORT_API_HOSTNAME,
+                 session_store=None):
+        '''
+        :param session_store:   [optional] A ByteportSessionStore, reuses the login of earlier runs while it is valid
+        '''
+        self.client = ByteportHttpClient(byteport_api_hostname=byteport_api_hostname, session_store=session_store)
+        self.client.login(username, password)
+        print "Successfully logged in to Byteport!"
+
+    def load_to_series(self, namespace, device_uid, field_name, from_time, to_time):
+        import pandas
+
+        timeseries_data = self.client.load_timeseries_data_range(namespace, device_uid, field_name, from_time, to_time)
+
+        # create pandas data-frame
+        timestamps = list()
+        values = list()
+
+        # Prepare by splitting the time series data into two arrays
+        for row in timeseries_data['data']['ts_data']:
+            try:
+                dt = datetime.datetime.strptime(row['t'], ISO8601)
+                fv = float(row['v'])
+
+                timestamps.append(dt)
+                values.append(fv)
+            except Exception:
+                print "Failed to parse data (%s), ignoring" % row
+
+        return pandas.Series(values, timestamps)
+
+    def load_responses(self, namespace, device_uid, field_name, from_time, to_time, chunk=datetime.timedelta(days=1)):
+        """
+
+        Load data a chunk of time at a time, for processing ranges larger than memory.
+
+        :param chunk: [optional] timedelta loaded per request
+        :return: Generator of the response of load_timeseries_data_range() of each chunk. Both ends of each range
+                 are included, so the first sample can be the last of the chunk before.
+        """
+        while from_time < to_time:
+            chunk_to_time = min(from_time + chunk, to_time)
+            yield self.client.load_timeseries_data_range(namespace, device_uid, field_name, from_time, chunk_to_time)
+            from_time = chunk_to_time
+
+    def load_chunks(self, namespace, device_uid, field_name, from_time, to_time, chunk=datetime.timedelta(days=1)):
+        """
+
+        Load data a chunk of time at a time as NumPy arrays, see load_responses().
+
+        :param chunk: [optional] timedelta loaded per request
+        :return: Generator of (times, values) of each chunk, NumPy arrays of int64 nanoseconds since the epoch
+                 and float64 values, in order of time and without the samples of the chunk before
+        """
+        from byteport.scientific import series_store as series_store_module
+
+        last_time = None
+        for timeseries_data in self.load_responses(namespace, device_uid, field_name, from_time, to_time, chunk):
+            (times, values) = series_store_module.parse_ts_data(timeseries_data['data']['ts_data'])
+
+            if last_time is not None:
+                later = times > last_time
+                times = times[later]
+                values = values[later]
+            if len(times):
+                last_time = times[-1]
+                yield times, values
+
+    def load_to_store(self, namespace, device_uid, field_name, from_time, to_time, store,
+                      chunk=datetime.timedelta(days=1)):
+        """
+
+        Load data into a SeriesStore on disk a chunk of time at a time, so ranges larger than memory can be loaded.
+        Loading continues from the last sample already stored, see byteport.scientific.series_store.
+
+        :param namespace:
+        :param device_uid:
+        :param field_name:
+        :param from_time:
+        :param to_time:
+        :param store: A SeriesStore
+        :param chunk: [optional] timedelta loaded per request
+        :return: The StoredSeries, with the key 'namespace.uid.field name'
+        """
+        import pandas
+
+        stored = store.series('%s.%s.%s' % (namespace, device_uid, field_name))
+
+        last_time = stored.last_time()
+        if last_time is not None:
+            from_time = max(from_time, pandas.Timestamp(last_time).to_pydatetime())
+
+        for (times, values) in self.load_chunks(namespace, device_uid, field_name, from_time, to_time, chunk):
+            stored.append(times, values)
+
+        return stored
+
+
+class TimeseriesAnalyser(ByteportPandas):
+
+    def groupby(self, data_frame, grouping='DAILY'):
+        """
+
+        Split the series into sub-sets of _hours_, _days_, _weeks_ or _months_.
+
+        :param data_frame:
+        :param grouping: One of 'DAILY', 'HOURLY', 'WEEKLY' or 'MONTHLY'
+        :return: List of (label, sub-set) in time order, see byteport.scientific.grouping for the labels
+        """
+        from byteport.scientific import grouping as grouping_module
+
+        return grouping_module.groups(data_frame, grouping)
+
+    def group_and_describe(self, data_frame, grouping='DAILY', subset_analysis='pandas_describe'):
+        """
+
+        Split the series into sub-sets of _hours_, _days_, _weeks_ or _months_ and return one vector with
+        parameters describing each subset. The subset can then be clustered etc.
+
+        All groups are described in one pass, see byteport.scientific.grouping.
+
+        :param data_frame:
+        :param grouping: One of 'DAILY', 'HOURLY', 'WEEKLY' or 'MONTHLY'
+        :param subset_analysis: 'pandas_describe' or 'pandas_mean_std'
+        :return:
+        """
+        from byteport.scientific import grouping as grouping_module
+
+        return grouping_module.group_and_describe(data_frame, grouping, subset_analysis)
+
+    def arrange_by_distance(self, descriptions, averaging_strategy='median', judge_strategy='euclidean'):
+        """
+
+        Rank the groups described by group_and_describe() by their distance to the typical group, the most
+        normal group first and the most unusual last.
+
+        All distances are computed in one operation, see byteport.scientific.distance.
+
+        :param descriptions: DataFrame from group_and_describe()
+        :param averaging_strategy: 'median' or 'cov'
+        :param judge_strategy: 'euclidean', 'relative', 'mahalanobis' or 'cosine'
+        :return: DataFrame with the distance, rank and descriptors of each group, closest first
+        """
+        from byteport.scientific import distance as distance_module
+
+        return distance_module.arrange_by_distance(descriptions, averaging_strategy, judge_strategy)
+
+    def distance_to_typical(self, namespace, device_uids, field_name, from_time, to_time, series=None, processes=None,
+                            **parameters):
+        """
+
+        Local version of the distance_to_typical analysis of the API, for one or more devices. The series are
+        loaded unless given, then analysed in parallel, see byteport.scientific.typical.
+
+        :param namespace:
+        :param device_uids: List of device UIDs
+        :param field_name:
+        :param from_time:
+        :param to_time:
+        :param series: [optional] Dictionary of device UID -> Series already loaded, ie. cached from an earlier run
+        :param processes: [optional] Worker processes, by default one per CPU
+        :param parameters: grouping, order, diff_before_analysis, include_descriptions and exclude_descriptors as
+                           in the API, see byteport.scientific.typical.distance_to_typical()
+        :return: Dictionary of device UID -> result, with 'distances', 'T_med' and 'meta' as the API response
+        """
+        from byteport.scientific import typical as typical_module
+
+        series = series or dict()
+
+        series_by_guid = dict()
+        for device_uid in device_uids:
+            guid = '%s.%s.%s' % (namespace, device_uid, field_name)
+            if device_uid in series:
+                series_by_guid[guid] = series[device_uid]
+            else:
+                series_by_guid[guid] = self.load_to_series(namespace, device_uid, field_name, from_time, to_time)
+
+        results = typical_module.distance_to_typical_many(series_by_guid, processes, from_time=from_time,
+                                                          to_time=to_time, **parameters)
+
+        return dict((device_uid, results['%s.%s.%s' % (namespace, device_uid, field_name)])
+                    for device_uid in device_uids)
+
+    def apply_operation(self, series, operation=None, scale=1):
+        """
+
+        Apply the operation and scale of the time series API to a series already loaded, instead of loading
+        it again with them. See byteport.scientific.operations, also for combining operations.
+
+        :param series:
+        :param operation: [optional] 'diff', 'smooth_diff' or 'cum_sum'
+        :param scale: [optional] Scale by this factor
+        :return: Series
+        """
+        from byteport.scientific import operations as operations_module
+
+        return operations_module.apply_operation(series, operation, scale)
+
+    def daily_statistics(self, series, statistics=None):
+        """
+
+        Daily activity and statistics of a series, as the time series statistics API. Keep the returned object
+        and pass it again with only the new samples to update it, see byteport.scientific.activity.
+
+        :param series: Series, or a StoredSeries which is read a chunk at a time
+        :param statistics: [optional] DailyStatistics to add the series to
+        :return: DailyStatistics, use statistics(build_calendar=True) for the API response layout
+        """
+        from byteport.scientific import activity as activity_module
+
+        from byteport.scientific import series_store as series_store_module
+
+        if statistics is None:
+            statistics = activity_module.DailyStatistics()
+
+        if isinstance(series, series_store_module.StoredSeries):
+            for (times, values) in series.chunks():
+                statistics.add(times.view('datetime64[ns]'), values)
+        else:
+            statistics.add_series(series)
+        return statistics
+
+    def group_and_describe_stored(self, stored, grouping='DAILY', subset_analysis='pandas_describe', from_time=None,
+                                  to_time=None, chunk_size=None):
+        """
+
+        As group_and_describe() for a StoredSeries, read a chunk at a time so the data does not have to fit in
+        memory. Only the descriptions of all groups are kept, see byteport.scientific.series_store.
+
+        :param stored: A StoredSeries
+        :param grouping: One of 'DAILY', 'HOURLY', 'WEEKLY' or 'MONTHLY'
+        :param subset_analysis: 'pandas_describe' or 'pandas_mean_std'
+        :param from_time: [optional]
+        :param to_time: [optional]
+        :param chunk_size: [optional] Samples read at a time
+        :return:
+        """
+        from byteport.scientific import series_store as series_store_module
+
+        return series_store_module.group_and_describe_stored(stored, grouping, subset_analysis, from_time, to_time,
+                                                             chunk_size or series_store_module.DEFAULT_CHUNK_SIZE)
+
+    def downsample(self, series, threshold=2000, method='lttb'):
+        """
+
+        Reduce a series to about threshold points for plotting, see byteport.scientific.downsampling.
+
+        :param series: Series, or a StoredSeries which is read a chunk at a time
+        :param threshold: [optional] Number of points to keep
+        :param method: [optional] 'lttb' (Largest-Triangle-Three-Buckets) or 'min_max' (envelope)
+        :return: Series
+        """
+        from byteport.scientific import downsampling as downsampling_module
+        from byteport.scientific import series_store as series_store_module
+
+        if not isinstance(series, series_store_module.StoredSeries):
+            return downsampling_module.downsample(series, threshold, method)
+
+        times = series.times()
+        if not len(times):
+            return series.to_series()
+
+        downsampler = downsampling_module.Downsampler(times[0].view('datetime64[ns]'),
+                                                      times[-1].view('datetime64[ns]'), threshold, method)
+        for (times, values) in series.chunks():
+            downsampler.add(times, values)
+        return downsampler.result()
+
+    def load_downsampled(self, namespace, device_uid, field_name, from_time, to_time, threshold=2000, method='lttb',
+                         chunk=datetime.timedelta(days=1)):
+        """
+
+        Load a range a chunk at a time and keep only about threshold points for plotting, the range does not
+        have to fit in memory. See byteport.scientific.downsampling.
+
+        :param threshold: [optional] Number of points to keep
+        :param method: [optional] 'lttb' or 'min_max'
+        :param chunk: [optional] timedelta loaded per request
+        :return: Series
+        """
+        from byteport.scientific import downsampling as downsampling_module
+
+        downsampler = downsampling_module.Downsampler(from_time, to_time, threshold, method)
+        for (times, values) in self.load_chunks(namespace, device_uid, field_name, from_time, to_time, chunk):
+            downsampler.add(times, values)
+        return downsampler.result()
+
+    def export_timeseries(self, namespace, device_uid, field_name, from_time, to_time, path, file_format=None,
+                          chunk=datetime.timedelta(days=1)):
+        """
+
+        Export a range to a Parquet, Feather or HDF5 file a chunk of time at a time, the range does not have to
+        fit in memory. Needs pyarrow (Parquet, Feather) or PyTables (HDF5), see byteport.scientific.export.
+
+        :param path: File to write
+        :param file_format: [optional] 'parquet', 'feather' or 'hdf5', by default from the extension of the path
+        :param chunk: [optional] timedelta loaded per request
+        :return: Number of samples written
+        """
+        from byteport.scientific import export as export_module
+
+        meta = {'from': from_time.strftime(ISO8601), 'to': to_time.strftime(ISO8601)}
+        return export_module.export_responses(self.load_responses(namespace, device_uid, field_name, from_time,
+                                                                  to_time, chunk),
+                                              path, file_format, meta)
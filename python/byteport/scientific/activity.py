@@ -0,0 +1,233 @@
+"""
+Daily statistics of a time series, kept up to date as samples arrive.
+
+The /api/v1/timeseries/statistics/ service recomputes the daily activity of a field from all of its
+history on every request. DailyStatistics instead keeps partial aggregates per day, count, mean, sum of
+squared deviations (for the variance), min and max, and updates them with each batch of new samples.
+Aggregates are mergeable: statistics kept for separate batches, processes or devices combine into the
+statistics of all of them (Chan et al. pairwise update of mean and variance), so history is never
+scanned again.
+
+statistics() returns the layout of the response body of the API:
+
+    daily_activity      list of [day, values stored, values in percent of the most active day]
+    calendar            {year: {'YYYY-MM': [week, ...]}}, each week is 7 [weekday, daily_activity element]
+                        pairs from Monday (0) to Sunday (6), null for days outside the month or without values
+    values_in_way_past  values with timestamps before way_past, not in the daily statistics
+    values_in_future    values with timestamps later than the time they were added, neither
+
+Days are calendar days of the timestamps, timezone aware timestamps count by their local time. Naive
+timestamps are taken as UTC when compared with the clock. NaN values are not counted.
+
+Example:
+
+    statistics = DailyStatistics()
+    statistics.add_series(history)
+    ...
+    statistics.add(timestamps, values)   # As new samples arrive
+    response = statistics.statistics(build_calendar=True)
+"""
+import time
+import datetime
+
+import numpy
+import pandas
+
+# Values before this are counted as values_in_way_past, ie. sent by devices with unset clocks
+WAY_PAST = datetime.datetime(2000, 1, 1)
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+class DailyStatistics:
+    '''
+    Mergeable per day aggregates, see the module documentation.
+    '''
+
+    def __init__(self, way_past=WAY_PAST, clock=time.time):
+        '''
+        :param way_past:    [optional] datetime, earlier values are not in the daily statistics
+        :param clock:       [optional] Function returning the current time in seconds, later values are not in
+                            the daily statistics
+        '''
+        self.way_past = numpy.datetime64(way_past, 'ns')
+        self.clock = clock
+
+        # Days in order, and the aggregates of each
+        self.days = numpy.empty(0, dtype='datetime64[D]')
+        self.counts = numpy.empty(0, dtype=numpy.int64)
+        self.means = numpy.empty(0)
+        self.squares = numpy.empty(0)
+        self.mins = numpy.empty(0)
+        self.maxs = numpy.empty(0)
+
+        self.values_in_way_past = 0
+        self.values_in_future = 0
+
+    def add(self, timestamps, values):
+        '''
+        Adds a batch of samples.
+
+        :param timestamps:  datetime64 array, DatetimeIndex or anything numpy converts to datetime64
+        :param values:      Numeric values, as many as timestamps
+        '''
+        if isinstance(timestamps, pandas.DatetimeIndex) and timestamps.tz is not None:
+            # Compared with the clock in UTC, grouped into days by local time
+            instants = numpy.asarray(timestamps.tz_convert('UTC').tz_localize(None), dtype='datetime64[ns]')
+            timestamps = timestamps.tz_localize(None)
+        else:
+            instants = None
+        timestamps = numpy.asarray(timestamps, dtype='datetime64[ns]')
+        if instants is None:
+            instants = timestamps
+        values = numpy.asarray(values, dtype=numpy.float64)
+
+        if len(timestamps) != len(values):
+            raise Exception("Got %s timestamps for %s values" % (len(timestamps), len(values)))
+
+        stored = ~numpy.isnan(values)
+        way_past = stored & (timestamps < self.way_past)
+        future = stored & (instants > numpy.datetime64(int(self.clock() * 1e9), 'ns'))
+        self.values_in_way_past += int(way_past.sum())
+        self.values_in_future += int(future.sum())
+
+        keep = stored & ~way_past & ~future
+        timestamps = timestamps[keep]
+        values = values[keep]
+        if not len(values):
+            return
+
+        (days, codes) = numpy.unique(timestamps.astype('datetime64[D]'), return_inverse=True)
+
+        counts = numpy.bincount(codes)
+        means = numpy.bincount(codes, weights=values) / counts
+        deviations = values - means[codes]
+        squares = numpy.bincount(codes, weights=deviations * deviations)
+
+        order = numpy.argsort(codes, kind='mergesort')
+        starts = numpy.cumsum(counts) - counts
+        mins = numpy.minimum.reduceat(values[order], starts)
+        maxs = numpy.maximum.reduceat(values[order], starts)
+
+        self.merge_aggregates(days, counts, means, squares, mins, maxs)
+
+    def add_series(self, series):
+        '''
+        Adds the samples of a Series with a DatetimeIndex.
+        '''
+        self.add(series.index, series.values)
+
+    def merge(self, other):
+        '''
+        Adds the statistics of another DailyStatistics, ie. of another batch or process.
+        '''
+        self.merge_aggregates(other.days, other.counts, other.means, other.squares, other.mins, other.maxs)
+        self.values_in_way_past += other.values_in_way_past
+        self.values_in_future += other.values_in_future
+
+    def merge_aggregates(self, days, counts, means, squares, mins, maxs):
+        all_days = numpy.union1d(self.days, days)
+
+        if len(all_days) == len(self.days):
+            positions = numpy.searchsorted(self.days, days)
+        else:
+            # New days, make room for them
+            old = numpy.searchsorted(all_days, self.days)
+            size = len(all_days)
+
+            self.counts = self.placed(self.counts, old, size, 0)
+            self.means = self.placed(self.means, old, size, 0.0)
+            self.squares = self.placed(self.squares, old, size, 0.0)
+            self.mins = self.placed(self.mins, old, size, numpy.inf)
+            self.maxs = self.placed(self.maxs, old, size, -numpy.inf)
+            self.days = all_days
+
+            positions = numpy.searchsorted(all_days, days)
+
+        own_counts = self.counts[positions]
+        total_counts = own_counts + counts
+        deltas = means - self.means[positions]
+
+        self.means[positions] += deltas * counts / total_counts
+        self.squares[positions] += squares + deltas * deltas * own_counts * counts / total_counts
+        self.counts[positions] = total_counts
+        self.mins[positions] = numpy.minimum(self.mins[positions], mins)
+        self.maxs[positions] = numpy.maximum(self.maxs[positions], maxs)
+
+    @staticmethod
+    def placed(values, positions, size, fill):
+        result = numpy.full(size, fill, dtype=values.dtype)
+        result[positions] = values
+        return result
+
+    def describe(self):
+        '''
+        :return: DataFrame with the count, mean, std, min and max of each day in columns by day, as
+                 byteport.scientific.grouping.group_and_describe() with DAILY grouping
+        '''
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            stds = numpy.sqrt(self.squares / (self.counts - 1))
+        stds[self.counts < 2] = numpy.nan
+
+        return pandas.DataFrame(numpy.vstack([self.counts.astype(numpy.float64), self.means, stds, self.mins,
+                                              self.maxs]),
+                                index=['count', 'mean', 'std', 'min', 'max'],
+                                columns=[u'%s' % day for day in self.days])
+
+    def daily_activity(self):
+        '''
+        :return: List of [day, values stored, values in percent of the most active day] as the API
+        '''
+        if not len(self.counts):
+            return list()
+
+        percents = self.counts * 100 // self.counts.max()
+        return [[u'%s' % day, int(count), int(percent)]
+                for (day, count, percent) in zip(self.days, self.counts, percents)]
+
+    def calendar(self, daily_activity=None):
+        '''
+        :return: The daily activity by year, month and week as the API, see the module documentation
+        '''
+        if daily_activity is None:
+            daily_activity = self.daily_activity()
+
+        by_day = dict((element[0], element) for element in daily_activity)
+
+        calendar = dict()
+        for month in sorted(set(day[:7] for day in by_day)):
+            first = datetime.datetime.strptime(month, '%Y-%m').date()
+            next_month = (first + datetime.timedelta(days=31)).replace(day=1)
+
+            weeks = list()
+            day = first - datetime.timedelta(days=first.weekday())
+            while day < next_month:
+                week = list()
+                for weekday in range(7):
+                    element = by_day.get(day.strftime(DAY_FORMAT)) if day.month == first.month else None
+                    week.append([weekday, element])
+                    day += datetime.timedelta(days=1)
+                weeks.append(week)
+
+            calendar.setdefault(first.year, dict())[month] = weeks
+
+        return calendar
+
+    def statistics(self, build_calendar=False, meta=None):
+        '''
+        :param build_calendar:  [optional] Include the calendar
+        :param meta:            [optional] Dictionary returned as 'meta', the API has uid, name and namespace_name
+        :return:                Dictionary as the response body of the statistics API
+        '''
+        daily_activity = self.daily_activity()
+
+        result = {
+            'values_in_way_past': self.values_in_way_past,
+            'values_in_future': self.values_in_future,
+            'meta': meta or dict(),
+            'daily_activity': daily_activity,
+        }
+        if build_calendar:
+            result['calendar'] = self.calendar(daily_activity)
+
+        return result
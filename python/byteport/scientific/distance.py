@@ -0,0 +1,146 @@
+"""
+Ranking of described groups by their distance to the typical group.
+
+Given the descriptions made by group_and_describe(), a column of descriptors (count, mean, std, ...) per
+group, the typical vector has the typical value of each descriptor over all groups. Each group is then
+compared with the typical vector, the groups closest to it are the most normal and the ones furthest
+away the most unusual.
+
+The descriptions are used as a matrix with a row per group, so the distances of all groups are computed
+by one broadcast operation instead of a loop over the columns. The metrics are
+
+    euclidean       length of the difference to the typical vector
+    relative        length of the relative difference, each descriptor divided by its typical value so
+                    descriptors of different magnitude weigh the same
+    mahalanobis     length of the difference scaled by the covariance of the descriptors over all groups,
+                    descriptors that vary a lot between groups and correlated descriptors weigh less
+    cosine          1 - cosine of the angle to the typical vector, ignores the magnitude
+
+Missing descriptors (ie. std of a group with a single value) are left out of the euclidean, relative and
+cosine distances. The mahalanobis distance of such a group is NaN. Groups with NaN distance rank last.
+
+Example:
+
+    descriptions = group_and_describe(series, grouping=DAILY)
+    ranked = arrange_by_distance(descriptions, judge_strategy=MAHALANOBIS)
+    most_unusual_days = ranked.index[-5:]
+"""
+import logging
+
+import numpy
+import pandas
+
+EUCLIDEAN = 'euclidean'
+RELATIVE = 'relative'
+MAHALANOBIS = 'mahalanobis'
+COSINE = 'cosine'
+
+METRICS = [EUCLIDEAN, RELATIVE, MAHALANOBIS, COSINE]
+
+MEDIAN = 'median'
+COV = 'cov'
+
+AVERAGING_STRATEGIES = [MEDIAN, COV]
+
+# Descriptors varying more than this (coefficient of variation) between groups are not used by the 'cov'
+# averaging strategy
+COV_LIMIT = 0.2
+
+
+def typical_vector(descriptions, averaging_strategy=MEDIAN, cov_limit=COV_LIMIT):
+    '''
+    :param descriptions:        DataFrame with a row per descriptor and a column per group
+    :param averaging_strategy:  'median' for the median of every descriptor, 'cov' for the mean of the
+                                descriptors with a coefficient of variation below cov_limit
+    :return:                    Series with the typical value of each descriptor used
+    '''
+    values = descriptions.values.astype(numpy.float64)
+
+    if averaging_strategy == MEDIAN:
+        return pandas.Series(numpy.nanmedian(values, axis=1), index=descriptions.index)
+
+    if averaging_strategy == COV:
+        means = numpy.nanmean(values, axis=1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            covs = numpy.abs(numpy.nanstd(values, axis=1, ddof=1) / means)
+
+        usable = covs < cov_limit
+        for (descriptor, cov) in zip(descriptions.index, covs):
+            logging.debug(u'%s descriptor (%s), COV=%s' % ('Usable' if cov < cov_limit else 'Unusable', descriptor, cov))
+
+        return pandas.Series(means[usable], index=descriptions.index[usable])
+
+    raise Exception("Unsupported averaging strategy, '%s'" % averaging_strategy)
+
+
+def distances(vectors, typical, metric=EUCLIDEAN):
+    '''
+    :param vectors: Array with a row per group and a column per descriptor
+    :param typical: Array with the typical value of each descriptor
+    :param metric:  One of 'euclidean', 'relative', 'mahalanobis' or 'cosine'
+    :return:        Array with the distance of each group
+    '''
+    vectors = numpy.asarray(vectors, dtype=numpy.float64)
+    typical = numpy.asarray(typical, dtype=numpy.float64)
+
+    if metric in ('euclidian', EUCLIDEAN):
+        differences = vectors - typical
+        return numpy.sqrt(numpy.nansum(differences * differences, axis=1))
+
+    if metric == RELATIVE:
+        # Descriptors with a typical value of 0 have no relative difference and are left out
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            differences = vectors / numpy.where(typical == 0, numpy.nan, typical) - 1.0
+        return numpy.sqrt(numpy.nansum(differences * differences, axis=1))
+
+    if metric == MAHALANOBIS:
+        differences = vectors - typical
+        complete = ~numpy.isnan(differences).any(axis=1)
+
+        # Pseudo inverse, descriptors that are constant over the groups (ie. count) make the covariance singular
+        covariance = numpy.atleast_2d(numpy.cov(vectors[complete], rowvar=False))
+        inverse = numpy.linalg.pinv(covariance)
+
+        with numpy.errstate(invalid='ignore'):
+            return numpy.sqrt(numpy.maximum(numpy.einsum('ij,jk,ik->i', differences, inverse, differences), 0.0))
+
+    if metric == COSINE:
+        present = ~numpy.isnan(vectors)
+        filled = numpy.where(present, vectors, 0.0)
+        masked_typical = numpy.where(present, typical, 0.0)
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            cosines = (filled * masked_typical).sum(axis=1) / \
+                numpy.sqrt((filled * filled).sum(axis=1) * (masked_typical * masked_typical).sum(axis=1))
+        return 1.0 - cosines
+
+    raise Exception("Unsupported judge strategy, '%s'" % metric)
+
+
+def arrange_by_distance(descriptions, averaging_strategy=MEDIAN, judge_strategy=EUCLIDEAN, cov_limit=COV_LIMIT):
+    '''
+    Ranks the groups by their distance to the typical group, see the module documentation.
+
+    Input looks like this for example, grouped by hours
+
+           2014-04-09 20  2014-04-09 21  2014-04-09 22  2014-04-09 23
+    count       5.000000       6.000000       6.000000            1.0
+    mean        2.800000      16.166667       1.500000           12.0
+    std        71.461178      75.369534      58.353235            NaN
+    ...
+
+    :param descriptions:        DataFrame with a row per descriptor and a column per group
+    :param averaging_strategy:  How the typical vector is made, see typical_vector()
+    :param judge_strategy:      Distance metric, see distances()
+    :return:                    DataFrame with a row per group closest first, the columns are the distance,
+                                the rank (1 for the closest group) and the descriptors used
+    '''
+    typical = typical_vector(descriptions, averaging_strategy, cov_limit)
+    vectors = descriptions.loc[typical.index].T
+
+    ranked = vectors.copy()
+    ranked.insert(0, 'distance', distances(vectors.values, typical.values, judge_strategy))
+    ranked = ranked.sort_values('distance', kind='mergesort', na_position='last')
+    ranked.insert(1, 'rank', numpy.arange(1, len(ranked) + 1))
+
+    return ranked
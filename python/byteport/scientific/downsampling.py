@@ -0,0 +1,303 @@
+"""
+Downsampling of long series to the points worth plotting.
+
+A plot is a few thousand pixels wide, so plotting millions of samples is slow and shows nothing more than
+a few thousand well chosen ones. Two methods reduce a series to about threshold points in linear time:
+
+    lttb        Largest-Triangle-Three-Buckets (Steinarsson, 2013). The first and last samples are kept,
+                the rest are split into threshold - 2 buckets and from each bucket the sample forming the
+                largest triangle with the sample kept from the bucket before and the average of the bucket
+                after is kept. Keeps the shape of the series as seen by the eye.
+    min_max     The series is split into threshold / 2 buckets of equal time and the smallest and largest
+                sample of each are kept, in order of time. An envelope of the series, peaks and gaps are
+                never lost.
+
+lttb() and min_max() downsample a series in memory. A Downsampler is given the series a chunk at a time,
+ie. the chunks of a StoredSeries or of ByteportPandas.load_chunks(), and keeps only the samples of the
+buckets not yet complete. As the number of samples is not known in advance its LTTB buckets are of equal
+time over the range instead of equal count, empty buckets give no point.
+
+NaN values are left out. The area of the triangles is computed with the time in seconds.
+
+Example:
+
+    plot_series = lttb(series, 2000)
+    envelope = min_max(series, 2000)
+
+    downsampler = Downsampler(from_time, to_time, 2000)
+    for (times, values) in stored.chunks():
+        downsampler.add(times, values)
+    plot_series = downsampler.result()
+"""
+import numpy
+import pandas
+
+from byteport.scientific.series_store import as_nanoseconds
+
+LTTB = 'lttb'
+MIN_MAX = 'min_max'
+
+METHODS = [LTTB, MIN_MAX]
+
+
+def largest_triangles(x, y, starts, ends, a_x, a_y, next_x, next_y):
+    '''
+    The LTTB selection of one sample from each bucket.
+
+    :param x:               Times as float
+    :param y:               Values
+    :param starts:          Position of the first sample of each bucket, buckets are not empty
+    :param ends:            Position after the last sample of each bucket
+    :param a_x:             The point selected before the first bucket
+    :param a_y:
+    :param next_x:          The point after the last bucket
+    :param next_y:
+    :return:                Position of the sample selected from each bucket
+    '''
+    counts = ends - starts
+
+    # Average of the bucket after each bucket, all buckets are averaged in one go
+    after_x = numpy.append(numpy.add.reduceat(x[starts[0]:ends[-1]], starts - starts[0]) / counts, next_x)[1:]
+    after_y = numpy.append(numpy.add.reduceat(y[starts[0]:ends[-1]], starts - starts[0]) / counts, next_y)[1:]
+
+    positions = numpy.empty(len(starts), dtype=numpy.int64)
+    for bucket in range(len(starts)):
+        start = starts[bucket]
+        end = ends[bucket]
+
+        # Twice the area, which is as good for finding the largest
+        areas = numpy.abs((a_x - after_x[bucket]) * (y[start:end] - a_y) -
+                          (a_x - x[start:end]) * (after_y[bucket] - a_y))
+        position = start + int(areas.argmax())
+
+        positions[bucket] = position
+        a_x = x[position]
+        a_y = y[position]
+
+    return positions
+
+
+def extreme_positions(values, codes):
+    '''
+    :param values:  Values, without NaN
+    :param codes:   Bucket of each value, in order
+    :return:        Positions of the first smallest and the first largest value of each bucket, in order
+    '''
+    starts = numpy.flatnonzero(numpy.diff(codes)) + 1
+    starts = numpy.append(0, starts)
+    bucket_numbers = numpy.repeat(numpy.arange(len(starts)), numpy.diff(numpy.append(starts, len(codes))))
+
+    positions = list()
+    for reduce in (numpy.minimum, numpy.maximum):
+        extremes = reduce.reduceat(values, starts)
+        candidates = numpy.flatnonzero(values == extremes[bucket_numbers])
+        first = numpy.append(True, bucket_numbers[candidates][1:] != bucket_numbers[candidates][:-1])
+        positions.append(candidates[first])
+
+    return numpy.unique(numpy.concatenate(positions))
+
+
+def lttb(series, threshold):
+    '''
+    Largest-Triangle-Three-Buckets, see the module documentation.
+
+    :param series:      Series with a DatetimeIndex, in order of time
+    :param threshold:   Number of points to keep, at least 3
+    :return:            Series of threshold points, the series without NaN if it has no more points
+    '''
+    if threshold < 3:
+        raise Exception("threshold must be at least 3, was %s" % threshold)
+
+    series = series.dropna()
+    count = len(series)
+    if count <= threshold:
+        return series
+
+    x = (series.index.asi8 - series.index.asi8[0]) / 1e9
+    y = series.values.astype(numpy.float64)
+
+    # threshold - 2 buckets of equal count between the first and the last sample
+    every = (count - 2) / float(threshold - 2)
+    edges = (numpy.arange(threshold - 1) * every).astype(numpy.int64) + 1
+    edges[-1] = count - 1
+
+    positions = largest_triangles(x, y, edges[:-1], edges[1:], x[0], y[0], x[-1], y[-1])
+    return series.iloc[numpy.concatenate(([0], positions, [count - 1]))]
+
+
+def min_max(series, threshold):
+    '''
+    Smallest and largest sample of threshold / 2 buckets of equal time, see the module documentation.
+
+    :param series:      Series with a DatetimeIndex, in order of time
+    :param threshold:   Largest number of points to keep, at least 2
+    :return:            Series of the kept samples, the series without NaN if it has no more points
+    '''
+    if threshold < 2:
+        raise Exception("threshold must be at least 2, was %s" % threshold)
+
+    series = series.dropna()
+    if len(series) <= threshold:
+        return series
+
+    codes = time_buckets(series.index.asi8, series.index.asi8[0], series.index.asi8[-1], threshold // 2)
+    return series.iloc[extreme_positions(series.values.astype(numpy.float64), codes)]
+
+
+def time_buckets(times, start, end, buckets):
+    '''
+    :param times:   int64 nanoseconds
+    :param start:   int64 nanoseconds, start of the first bucket
+    :param end:     int64 nanoseconds, end of the last bucket
+    :return:        Bucket of each time from 0 to buckets - 1, times outside the range are in the first or last
+    '''
+    width = max(end - start, 1) / float(buckets)
+    return numpy.clip(((times - start) / width).astype(numpy.int64), 0, buckets - 1)
+
+
+def downsample(series, threshold, method=LTTB):
+    '''
+    :param method:  [optional] 'lttb' or 'min_max'
+    '''
+    if method == LTTB:
+        return lttb(series, threshold)
+    if method == MIN_MAX:
+        return min_max(series, threshold)
+    raise Exception("Unsupported downsampling method, '%s'" % method)
+
+
+class Downsampler:
+    '''
+    Downsampling of a series given a chunk at a time, see the module documentation.
+    '''
+
+    def __init__(self, from_time, to_time, threshold, method=LTTB):
+        '''
+        :param from_time:   datetime (UTC if naive), start of the range the buckets are spread over
+        :param to_time:     datetime, end of the range
+        :param threshold:   Largest number of points to keep
+        :param method:      [optional] 'lttb' or 'min_max'
+        '''
+        if method not in METHODS:
+            raise Exception("Unsupported downsampling method, '%s'" % method)
+        if threshold < (3 if method == LTTB else 2):
+            raise Exception("threshold must be at least %s, was %s" % (3 if method == LTTB else 2, threshold))
+
+        self.method = method
+        self.start = as_nanoseconds(from_time)
+        self.end = as_nanoseconds(to_time)
+        self.buckets = threshold - 2 if method == LTTB else threshold // 2
+
+        # Samples of the buckets not yet complete
+        self.pending_times = numpy.empty(0, dtype=numpy.int64)
+        self.pending_values = numpy.empty(0)
+
+        # The samples kept, and for LTTB the last one kept
+        self.kept_times = list()
+        self.kept_values = list()
+        self.anchor = None
+
+    def seconds(self, times):
+        return (times - self.start) / 1e9
+
+    def add(self, times, values):
+        '''
+        :param times:   int64 nanoseconds since the epoch or datetime64, later than the samples added before
+        :param values:  Values, as many as times
+        '''
+        times = numpy.asarray(times)
+        if times.dtype.kind == 'M':
+            times = times.astype('datetime64[ns]').view(numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+
+        if len(times) != len(values):
+            raise Exception("Got %s timestamps for %s values" % (len(times), len(values)))
+
+        stored = ~numpy.isnan(values)
+        times = times[stored].astype(numpy.int64)
+        values = values[stored]
+        if not len(times):
+            return
+
+        if self.method == LTTB and self.anchor is None:
+            # The first sample is always kept
+            self.keep(times[:1], values[:1])
+            self.anchor = (self.seconds(times[0]), values[0])
+            times = times[1:]
+            values = values[1:]
+
+        self.pending_times = numpy.concatenate((self.pending_times, times))
+        self.pending_values = numpy.concatenate((self.pending_values, values))
+        self.process(False)
+
+    def add_series(self, series):
+        '''
+        Adds the samples of a Series with a DatetimeIndex.
+        '''
+        index = series.index
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        self.add(index.asi8, series.values)
+
+    def keep(self, times, values):
+        self.kept_times.append(times)
+        self.kept_values.append(values)
+
+    def process(self, final):
+        times = self.pending_times
+        values = self.pending_values
+        last = None
+
+        if final and self.method == LTTB and len(times):
+            # The last sample is always kept, it is the point after the last bucket
+            last = (times[-1:], values[-1:])
+            times = times[:-1]
+            values = values[:-1]
+
+        if len(times):
+            codes = time_buckets(times, self.start, self.end, self.buckets)
+            starts = numpy.append(0, numpy.flatnonzero(numpy.diff(codes)) + 1)
+            ends = numpy.append(starts[1:], len(codes))
+
+            # The last bucket can get more samples, and for LTTB the bucket before it needs its average
+            done = len(starts) if final else max(len(starts) - (2 if self.method == LTTB else 1), 0)
+        else:
+            done = 0
+
+        if done:
+            end = ends[done - 1]
+            if self.method == MIN_MAX:
+                kept = extreme_positions(values[:end], codes[:end])
+            else:
+                x = self.seconds(times)
+                if done < len(starts):
+                    (next_x, next_y) = (x[starts[done]:ends[done]].mean(), values[starts[done]:ends[done]].mean())
+                else:
+                    (next_x, next_y) = (self.seconds(last[0][0]), last[1][0])
+                kept = largest_triangles(x, values, starts[:done], ends[:done], self.anchor[0], self.anchor[1],
+                                         next_x, next_y)
+                self.anchor = (x[kept[-1]], values[kept[-1]])
+            self.keep(times[kept], values[kept])
+
+            self.pending_times = times[end:]
+            self.pending_values = values[end:]
+
+        if last is not None:
+            self.keep(*last)
+            self.pending_times = self.pending_times[:0]
+            self.pending_values = self.pending_values[:0]
+
+    def result(self):
+        '''
+        Downsamples the samples not yet complete, no more can be added after this.
+
+        :return: Series of the kept samples, the index is in UTC
+        '''
+        self.process(True)
+        if not self.kept_times:
+            return pandas.Series([], pandas.DatetimeIndex([]))
+
+        times = numpy.concatenate(self.kept_times)
+        values = numpy.concatenate(self.kept_values)
+        return pandas.Series(values, pandas.DatetimeIndex(times.view('datetime64[ns]')))
+
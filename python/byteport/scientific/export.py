@@ -0,0 +1,290 @@
+"""
+Export of time series to columnar files, for tools that read Parquet, Feather or HDF5.
+
+Each sample is a row of four columns:
+
+    time    timestamp in nanoseconds, UTC
+    value   float64, NaN for values that are not numbers
+    ref     the reference of the sample, 'r' in the ts_data of the API
+    meta    the meta data of the sample, 'm' in the ts_data of the API, as JSON
+
+The meta data of the series, the 'meta' of the API response (ie. path) and the range exported, is stored
+as JSON with the file: in the schema metadata as 'byteport' (Parquet, Feather) or as the attribute
+'byteport' of the table (HDF5).
+
+Files are written a chunk at a time as the data is loaded, see ByteportPandas.load_responses(), so an
+export is never all in memory:
+
+    parquet     pyarrow, a row group per chunk
+    feather     pyarrow, Feather version 2 (the Arrow IPC file format), a record batch per chunk. Read
+                with pyarrow.ipc.open_file(pyarrow.memory_map(path)), or pyarrow.feather from 0.17 on.
+    hdf5        PyTables, a pandas table under the key 'ts' appended to per chunk. The meta data of
+                a sample can be at most META_SIZE characters of JSON.
+
+The libraries are optional and imported when a file is written. The format is given, or taken from the
+extension of the file.
+
+Example:
+
+    analyser.export_timeseries('test', '6000', 'temp', from_time, to_time, '/data/temp.parquet')
+    export_series(pandas_series, '/data/temp.h5')
+
+    pandas.read_parquet('/data/temp.parquet')
+"""
+import os
+import json
+import logging
+import itertools
+
+import numpy
+import pandas
+
+from byteport.scientific.series_store import StoredSeries, DEFAULT_CHUNK_SIZE
+
+PARQUET = 'parquet'
+FEATHER = 'feather'
+HDF5 = 'hdf5'
+
+EXTENSIONS = {
+    '.parquet': PARQUET,
+    '.feather': FEATHER,
+    '.arrow': FEATHER,
+    '.h5': HDF5,
+    '.hdf5': HDF5,
+}
+
+COLUMNS = ['time', 'value', 'ref', 'meta']
+
+# Key of the table in HDF5 files
+HDF5_KEY = 'ts'
+
+# Characters reserved in HDF5 tables for the ref (a UUID) and the meta data of a sample
+REF_SIZE = 36
+META_SIZE = 256
+
+
+# pyarrow and PyTables are optional dependencies, imported when a file of their format is written
+def load_pyarrow():
+    global pyarrow
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Could not import pyarrow. Parquet and Feather export is not supported without it, "
+                        "please do: pip install pyarrow")
+
+
+def load_tables():
+    try:
+        import tables
+    except ImportError:
+        raise Exception("Could not import PyTables. HDF5 export is not supported without it, "
+                        "please do: pip install tables")
+
+
+def ts_data_frame(rows, after=None):
+    '''
+    :param rows:    The ts_data of a response of load_timeseries_data()
+    :param after:   [optional] Only rows later than this datetime64, ie. the last row of the chunk before
+    :return:        DataFrame with the columns of the module documentation, rows without a valid time are left out
+    '''
+    frame = pandas.DataFrame({
+        'time': pandas.to_datetime([row.get('t') for row in rows], errors='coerce'),
+        'value': pandas.to_numeric(pandas.Series([row.get('v') for row in rows], dtype=object),
+                                   errors='coerce').astype(numpy.float64),
+        'ref': [row.get('r') or u'' for row in rows],
+        'meta': [json.dumps(row.get('m') or {}, sort_keys=True) for row in rows],
+    }, columns=COLUMNS)
+
+    invalid = frame['time'].isnull()
+    if invalid.any():
+        logging.warn(u'Failed to parse the time of %s rows, ignoring' % invalid.sum())
+        frame = frame[~invalid]
+
+    if after is not None:
+        frame = frame[frame['time'] > after]
+
+    return frame.reset_index(drop=True)
+
+
+def arrays_frame(times, values):
+    '''
+    :return: DataFrame of the samples of a chunk of a StoredSeries or a Series, without ref and meta data
+    '''
+    return pandas.DataFrame({
+        'time': numpy.asarray(times).view('datetime64[ns]'),
+        'value': numpy.asarray(values, dtype=numpy.float64),
+        'ref': u'',
+        'meta': u'{}',
+    }, columns=COLUMNS)
+
+
+def arrow_schema(meta):
+    return pyarrow.schema([
+        pyarrow.field('time', pyarrow.timestamp('ns', tz='UTC')),
+        pyarrow.field('value', pyarrow.float64()),
+        pyarrow.field('ref', pyarrow.string()),
+        pyarrow.field('meta', pyarrow.string()),
+    ], metadata={'byteport': json.dumps(meta)})
+
+
+def arrow_batch(frame, schema):
+    return pyarrow.RecordBatch.from_arrays([
+        pyarrow.array(frame['time'].values, type=schema.field('time').type),
+        pyarrow.array(frame['value'].values, type=pyarrow.float64()),
+        pyarrow.array(frame['ref'].tolist(), type=pyarrow.string()),
+        pyarrow.array(frame['meta'].tolist(), type=pyarrow.string()),
+    ], schema=schema)
+
+
+class ParquetWriter:
+
+    def __init__(self, path, meta):
+        load_pyarrow()
+        self.schema = arrow_schema(meta)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, frame):
+        self.writer.write_table(pyarrow.Table.from_batches([arrow_batch(frame, self.schema)], self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class FeatherWriter:
+
+    def __init__(self, path, meta):
+        load_pyarrow()
+        self.schema = arrow_schema(meta)
+        self.sink = pyarrow.OSFile(path, 'wb')
+        self.writer = pyarrow.RecordBatchFileWriter(self.sink, self.schema)
+
+    def write(self, frame):
+        self.writer.write_batch(arrow_batch(frame, self.schema))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+class HDF5Writer:
+
+    def __init__(self, path, meta):
+        load_tables()
+        self.meta = meta
+        self.store = pandas.HDFStore(path, mode='w', complevel=5, complib='blosc')
+
+    def write(self, frame):
+        self.store.append(HDF5_KEY, frame, format='table', index=False, data_columns=['time'],
+                          min_itemsize={'ref': REF_SIZE, 'meta': META_SIZE})
+
+    def close(self):
+        try:
+            if HDF5_KEY in self.store:
+                self.store.get_storer(HDF5_KEY).attrs.byteport = json.dumps(self.meta)
+        finally:
+            self.store.close()
+
+
+# Format -> writer, a writer is made with (path, meta) and has write(frame) and close()
+WRITERS = {
+    PARQUET: ParquetWriter,
+    FEATHER: FeatherWriter,
+    HDF5: HDF5Writer,
+}
+
+
+def resolve_format(path, file_format=None):
+    '''
+    :return: The format given, or the format of the extension of the path
+    '''
+    if file_format is None:
+        file_format = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if file_format is None:
+            raise Exception("Unknown export format of '%s', give the format or use one of the extensions %s" %
+                            (path, ', '.join(sorted(EXTENSIONS))))
+
+    if file_format not in WRITERS:
+        raise Exception("Unsupported export format, '%s'" % file_format)
+    return file_format
+
+
+def export_frames(frames, path, file_format=None, meta=None):
+    '''
+    Writes DataFrames with the columns of the module documentation to a file, one at a time.
+
+    :param frames:      Iterable of DataFrames, in order of time
+    :param path:        File to write
+    :param file_format: [optional] 'parquet', 'feather' or 'hdf5', by default from the extension of the path
+    :param meta:        [optional] Dictionary stored with the file
+    :return:            Number of rows written
+    '''
+    writer = WRITERS[resolve_format(path, file_format)](path, meta or dict())
+    written = 0
+    try:
+        for frame in frames:
+            if len(frame):
+                writer.write(frame)
+                written += len(frame)
+    finally:
+        writer.close()
+
+    return written
+
+
+def response_frames(responses):
+    '''
+    :param responses:   Responses of load_timeseries_data_range() for consecutive ranges
+    :return:            Generator of the DataFrame of each response, without the samples of the response before
+    '''
+    last_time = None
+    for timeseries_data in responses:
+        frame = ts_data_frame(timeseries_data['data']['ts_data'], last_time)
+        if len(frame):
+            last_time = frame['time'].values[-1]
+        yield frame
+
+
+def export_responses(responses, path, file_format=None, meta=None):
+    '''
+    Writes the samples of responses of load_timeseries_data_range() to a file as they are loaded, see
+    ByteportPandas.load_responses().
+
+    :param meta:    [optional] Dictionary stored with the file, the 'meta' of the first response is added to it
+    :return:        Number of samples written
+    '''
+    file_format = resolve_format(path, file_format)
+    meta = dict(meta or dict())
+
+    # The file is created with the meta data, which comes with the first response
+    responses = iter(responses)
+    first = next(responses, None)
+    if first is None:
+        return export_frames([], path, file_format, meta)
+
+    for (key, value) in (first.get('meta') or dict()).iteritems():
+        meta.setdefault(key, value)
+
+    return export_frames(response_frames(itertools.chain([first], responses)), path, file_format, meta)
+
+
+def export_series(series, path, file_format=None, meta=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Writes a Series, ie. from load_to_series(), or a StoredSeries to a file a chunk at a time.
+
+    :param series:      Series with a DatetimeIndex or a StoredSeries
+    :param chunk_size:  [optional] Samples written at a time
+    :return:            Number of samples written
+    '''
+    if isinstance(series, StoredSeries):
+        chunks = series.chunks(chunk_size)
+    else:
+        index = series.index
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        (times, values) = (index.asi8, series.values)
+        chunks = ((times[offset:offset + chunk_size], values[offset:offset + chunk_size])
+                  for offset in range(0, len(times), chunk_size))
+
+    return export_frames((arrays_frame(times, values) for (times, values) in chunks), path, file_format, meta)
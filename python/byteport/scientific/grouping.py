@@ -0,0 +1,237 @@
+"""
+Grouping of time series by calendar period and describing every group in one pass.
+
+Describing each group with DataFrame.describe() and concatenating the results creates a DataFrame per
+group, for a year of minute data grouped HOURLY that is thousands of small DataFrames. Here the rows are
+numbered by group once, and the statistics of all groups are computed together with NumPy: counts,
+sums and squared deviations with bincount, minimum, maximum and quantiles by indexing the values sorted
+by group and value. The result has the layout of the describe() vectors side by side:
+
+               2014-04-09 20  2014-04-09 21  2014-04-09 22
+    count           5.000000       6.000000       6.000000
+    mean            2.800000      16.166667       1.500000
+    std            71.461178      75.369534      58.353235
+    min           -76.000000     -76.000000     -80.000000
+    25%           -58.000000     -45.000000     -25.750000
+    50%            -2.000000      24.500000      -8.500000
+    75%            69.000000      79.000000      38.750000
+    max            81.000000      95.000000      83.000000
+
+Groups are labeled 'YYYY-MM-DD' (DAILY), 'YYYY-MM-DD H' (HOURLY, hour not zero padded), 'YYYY-Www'
+(WEEKLY, ISO 8601 weeks starting on Monday) and 'YYYY-MM' (MONTHLY), in time order. Timezone aware
+indexes are grouped by their local time.
+
+Example:
+
+    descriptions = group_and_describe(series, grouping=HOURLY)
+"""
+import numpy
+import pandas
+
+DAILY = 'DAILY'
+HOURLY = 'HOURLY'
+WEEKLY = 'WEEKLY'
+MONTHLY = 'MONTHLY'
+
+GROUPINGS = [DAILY, HOURLY, WEEKLY, MONTHLY]
+
+# Rows of the description of each group, as DataFrame.describe()
+DESCRIBE = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+MEAN_STD = ['mean', 'std']
+
+SUBSET_ANALYSES = {
+    'pandas_describe': DESCRIBE,
+    'pandas_mean_std': MEAN_STD,
+}
+
+# NumPy unit of the period of each grouping, weeks are computed from days
+PERIOD_UNITS = {
+    DAILY: 'datetime64[D]',
+    HOURLY: 'datetime64[h]',
+    WEEKLY: 'datetime64[D]',
+    MONTHLY: 'datetime64[M]',
+}
+
+
+def group_codes(index, grouping=DAILY):
+    '''
+    Numbers the rows by the period they belong to.
+
+    :param index:       DatetimeIndex
+    :param grouping:    One of DAILY, HOURLY, WEEKLY or MONTHLY
+    :return:            (codes, labels), codes is an array with the group number of each row and labels the
+                        label of each group. Groups are numbered in time order.
+    '''
+    if grouping not in PERIOD_UNITS:
+        raise Exception("Unsupported grouping, '%s'" % grouping)
+
+    if not isinstance(index, pandas.DatetimeIndex):
+        raise Exception("Grouping needs a DatetimeIndex, got %s" % type(index).__name__)
+
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    periods = period_starts(index.values, grouping)
+
+    if index.is_monotonic_increasing:
+        # The common case, no need to sort to find the groups
+        starts = numpy.ones(len(periods), dtype=bool)
+        starts[1:] = periods[1:] != periods[:-1]
+        codes = numpy.cumsum(starts) - 1
+        keys = periods[starts]
+    else:
+        (keys, codes) = numpy.unique(periods, return_inverse=True)
+
+    return codes, format_labels(keys, grouping)
+
+
+def period_starts(times, grouping=DAILY):
+    '''
+    :param times:       datetime64 array
+    :param grouping:    One of DAILY, HOURLY, WEEKLY or MONTHLY
+    :return:            Start of the period of each time, in the NumPy unit of the grouping
+    '''
+    periods = times.astype(PERIOD_UNITS[grouping])
+
+    if grouping == WEEKLY:
+        # Back to the Monday of the week, 1970-01-01 was a Thursday
+        days = periods.astype(numpy.int64)
+        periods = (days - (days + 3) % 7).astype('datetime64[D]')
+
+    return periods
+
+
+def next_period_start(period, grouping=DAILY):
+    '''
+    :param period:  Start of a period, as returned by period_starts()
+    :return:        Start of the following period
+    '''
+    return period + (7 if grouping == WEEKLY else 1)
+
+
+def format_labels(keys, grouping):
+    if grouping == HOURLY:
+        days = keys.astype('datetime64[D]')
+        hours = (keys - days).astype(numpy.int64)
+        return [u'%s %s' % (day, hour) for (day, hour) in zip(days, hours)]
+
+    if grouping == WEEKLY:
+        return [u'%04d-W%02d' % monday.isocalendar()[0:2] for monday in keys.astype(object)]
+
+    return [u'%s' % key for key in keys]
+
+
+def groups(data, grouping=DAILY):
+    '''
+    :param data:        DataFrame or Series with a DatetimeIndex
+    :param grouping:    One of DAILY, HOURLY, WEEKLY or MONTHLY
+    :return:            List of (label, rows of the group) in time order
+    '''
+    (codes, labels) = group_codes(data.index, grouping)
+
+    order = numpy.argsort(codes, kind='mergesort')
+    bounds = numpy.cumsum(numpy.bincount(codes, minlength=len(labels)))
+
+    result = list()
+    start = 0
+    for (label, end) in zip(labels, bounds):
+        result.append((label, data.iloc[order[start:end]]))
+        start = end
+
+    return result
+
+
+def describe_values(values, codes, group_count, statistics=DESCRIBE):
+    '''
+    Computes the statistics of every group of the values, NaN values are ignored as by describe().
+
+    :param values:      Float array
+    :param codes:       Group number of each value, 0 <= code < group_count
+    :param group_count: Number of groups
+    :param statistics:  Names of the statistics, see DESCRIBE
+    :return:            Array with a row per statistic and a column per group
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    # By group and by value within the group, NaN sort last
+    order = numpy.lexsort((values, codes))
+    sorted_values = values[order]
+    valid = ~numpy.isnan(values)
+
+    sizes = numpy.bincount(codes, minlength=group_count)
+    starts = numpy.cumsum(sizes) - sizes
+    counts = numpy.bincount(codes, weights=valid, minlength=group_count)
+    empty = counts == 0
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        means = numpy.bincount(codes, weights=numpy.where(valid, values, 0.0), minlength=group_count) / counts
+
+        if 'std' in statistics:
+            deviations = numpy.where(valid, values - means[codes], 0.0)
+            squares = numpy.bincount(codes, weights=deviations * deviations, minlength=group_count)
+            stds = numpy.sqrt(squares / (counts - 1))
+            stds[counts < 2] = numpy.nan
+
+    def at_quantile(fraction):
+        # Linear interpolation between the closest values, as DataFrame.quantile()
+        position = fraction * numpy.maximum(counts - 1, 0)
+        lower = numpy.floor(position)
+        upper = numpy.ceil(position)
+        last = max(len(sorted_values) - 1, 0)
+        lower_values = sorted_values[numpy.minimum(starts + lower.astype(numpy.int64), last)]
+        upper_values = sorted_values[numpy.minimum(starts + upper.astype(numpy.int64), last)]
+        with numpy.errstate(invalid='ignore'):
+            result = lower_values + (upper_values - lower_values) * (position - lower)
+        result[empty] = numpy.nan
+        return result
+
+    rows = list()
+    for statistic in statistics:
+        if statistic == 'count':
+            rows.append(counts)
+        elif statistic == 'mean':
+            rows.append(means)
+        elif statistic == 'std':
+            rows.append(stds)
+        elif statistic == 'min':
+            rows.append(at_quantile(0.0))
+        elif statistic == 'max':
+            rows.append(at_quantile(1.0))
+        elif statistic.endswith('%'):
+            rows.append(at_quantile(float(statistic[:-1]) / 100.0))
+        else:
+            raise Exception("Unsupported statistic, '%s'" % statistic)
+
+    return numpy.vstack(rows) if rows else numpy.empty((0, group_count))
+
+
+def group_and_describe(data, grouping=DAILY, subset_analysis='pandas_describe'):
+    '''
+    Splits the data into groups by period and describes each group, see the module documentation.
+
+    :param data:            DataFrame or Series with a DatetimeIndex, non numeric columns are ignored
+    :param grouping:        One of DAILY, HOURLY, WEEKLY or MONTHLY
+    :param subset_analysis: 'pandas_describe' for all of the describe() vector or 'pandas_mean_std' for
+                            mean and std only
+    :return:                DataFrame with a column per group, or per (column, group) if the data has more
+                            than one numeric column
+    '''
+    if subset_analysis not in SUBSET_ANALYSES:
+        raise Exception("Unsupported vectorization method")
+    statistics = SUBSET_ANALYSES[subset_analysis]
+
+    if isinstance(data, pandas.Series):
+        data = data.to_frame()
+    data = data.select_dtypes(include=[numpy.number])
+
+    (codes, labels) = group_codes(data.index, grouping)
+
+    descriptions = [describe_values(data[column].values, codes, len(labels), statistics)
+                    for column in data.columns]
+
+    if len(descriptions) == 1:
+        return pandas.DataFrame(descriptions[0], index=statistics, columns=labels)
+
+    columns = pandas.MultiIndex.from_product([data.columns, labels])
+    return pandas.DataFrame(numpy.hstack(descriptions) if descriptions else numpy.empty((len(statistics), 0)),
+                            index=statistics, columns=columns)
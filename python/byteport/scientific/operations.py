@@ -0,0 +1,193 @@
+"""
+The operations of the time series API, computed locally on data already loaded.
+
+load_timeseries_data() takes operation=diff|smooth_diff|cum_sum and scale, but then the server computes
+them and every derived series is downloaded again. The same operations are implemented here on NumPy
+arrays, so the raw data is loaded once and everything else is derived from it:
+
+    diff            y[n] = (x[n+1] - x[n-1]) / (t[n+1] - t[n-1]), per second, N - 2 samples at t[1] ... t[N-2]
+    smooth_diff     moving average, forward difference (x[n+1] - x[n]) / (t[n+1] - t[n]) and a moving
+                    average again, for plots only. N - 2 * window + 1 samples.
+    cum_sum         y[n] = x[0] + x[1] ... + x[n], N samples
+    scale           y[n] = factor * x[n]
+
+A TimeseriesPipeline records the operations and applies them when the result is asked for. The series
+is converted to arrays once, each operation works on the arrays of the previous one and the result is
+converted back to a Series once. Consecutive scales are applied as one.
+
+Example:
+
+    raw = analyser.load_to_series('test', '6000', 'energy_wh', from_time, to_time)
+    power_kw = TimeseriesPipeline(raw).diff().scale(3600 / 1000.0).series()
+    total = apply_operation(raw, 'cum_sum')
+"""
+import numpy
+import pandas
+
+DIFF = 'diff'
+SMOOTH_DIFF = 'smooth_diff'
+CUM_SUM = 'cum_sum'
+
+OPERATIONS = [DIFF, SMOOTH_DIFF, CUM_SUM]
+
+# Samples in each moving average of smooth_diff
+SMOOTHING_WINDOW = 5
+
+
+def to_arrays(series):
+    '''
+    :param series:  Series with a DatetimeIndex
+    :return:        (times, values), times as int64 nanoseconds since the epoch and values as float64
+    '''
+    if not isinstance(series.index, pandas.DatetimeIndex):
+        raise Exception("Operations need a DatetimeIndex, got %s" % type(series.index).__name__)
+
+    return series.index.asi8, series.values.astype(numpy.float64)
+
+
+def to_series(times, values, like):
+    '''
+    :return: Series of the arrays, with the time zone and name of the series like
+    '''
+    index = pandas.DatetimeIndex(times)
+    if like.index.tz is not None:
+        index = index.tz_localize('UTC').tz_convert(like.index.tz)
+    return pandas.Series(values, index, name=like.name)
+
+
+def seconds(nanoseconds):
+    return nanoseconds / 1e9
+
+
+def moving_average(values, window):
+    '''
+    :return: Average of each window of consecutive values, len(values) - window + 1 of them
+    '''
+    if len(values) < window:
+        return values[:0].astype(numpy.float64)
+
+    sums = numpy.cumsum(values, dtype=numpy.float64)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums[window - 1:] / window
+
+
+def diff(times, values):
+    '''
+    Central difference per second, see the module documentation.
+
+    :return: (times, values) of N - 2 samples
+    '''
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        rates = (values[2:] - values[:-2]) / seconds(times[2:] - times[:-2])
+    return times[1:-1], rates
+
+
+def smooth_diff(times, values, window=SMOOTHING_WINDOW):
+    '''
+    Smoothed forward difference per second, see the module documentation.
+
+    :return: (times, values) of N - 2 * window + 1 samples, times are the centers of the averaged samples
+    '''
+    # Relative to the first sample so the averages of the times keep the precision of nanoseconds
+    origin = times[0] if len(times) else 0
+    smoothed_times = moving_average(times - origin, window)
+    smoothed_values = moving_average(values, window)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        rates = numpy.diff(smoothed_values) / seconds(numpy.diff(smoothed_times))
+
+    # Each difference is the rate at the middle of its interval
+    result_times = moving_average((smoothed_times[:-1] + smoothed_times[1:]) / 2.0, window)
+    return numpy.round(result_times).astype(numpy.int64) + origin, moving_average(rates, window)
+
+
+def cum_sum(times, values):
+    return times, numpy.cumsum(values)
+
+
+def scale(times, values, factor):
+    return times, values * factor
+
+
+class TimeseriesPipeline:
+    '''
+    Operations applied to a series when the result is asked for, see the module documentation.
+    '''
+
+    def __init__(self, series, steps=()):
+        '''
+        :param series:  Series with a DatetimeIndex
+        '''
+        self.source = series
+
+        # List of (function, extra arguments)
+        self.steps = list(steps)
+
+    def then(self, function, *arguments):
+        '''
+        :return: A new pipeline also applying function(times, values, *arguments), this one is not changed
+        '''
+        return TimeseriesPipeline(self.source, self.steps + [(function, arguments)])
+
+    def diff(self):
+        return self.then(diff)
+
+    def smooth_diff(self, window=SMOOTHING_WINDOW):
+        return self.then(smooth_diff, window)
+
+    def cum_sum(self):
+        return self.then(cum_sum)
+
+    def scale(self, factor):
+        if self.steps and self.steps[-1][0] is scale:
+            # Scaled twice, scale once
+            return TimeseriesPipeline(self.source, self.steps[:-1] + [(scale, (self.steps[-1][1][0] * factor,))])
+        return self.then(scale, factor)
+
+    def operation(self, name):
+        '''
+        :param name:    Operation as named by the API, 'diff', 'smooth_diff' or 'cum_sum'. None for no operation.
+        '''
+        if name is None:
+            return self
+        if name == DIFF:
+            return self.diff()
+        if name == SMOOTH_DIFF:
+            return self.smooth_diff()
+        if name == CUM_SUM:
+            return self.cum_sum()
+        raise Exception("Unsupported operation, '%s'" % name)
+
+    def arrays(self):
+        '''
+        :return: (times, values) after all operations, times as int64 nanoseconds since the epoch
+        '''
+        (times, values) = to_arrays(self.source)
+        for (function, arguments) in self.steps:
+            (times, values) = function(times, values, *arguments)
+        return times, values
+
+    def series(self):
+        '''
+        :return: Series after all operations
+        '''
+        if not self.steps:
+            return self.source
+
+        (times, values) = self.arrays()
+        return to_series(times, values, self.source)
+
+
+def apply_operation(series, operation=None, scale=1):
+    '''
+    Applies the operation and scale parameters of load_timeseries_data() to a loaded series.
+
+    :param series:      Series with a DatetimeIndex
+    :param operation:   [optional] 'diff', 'smooth_diff' or 'cum_sum'
+    :param scale:       [optional] Factor, 1 for no scaling
+    :return:            Series
+    '''
+    pipeline = TimeseriesPipeline(series)
+    if scale != 1:
+        pipeline = pipeline.scale(scale)
+    return pipeline.operation(operation).series()
@@ -0,0 +1,268 @@
+"""
+On disk storage of long time series, read through memory maps.
+
+load_to_series() keeps the whole range in memory, first as Python lists and then as a Series, which does
+not work for years of high rate data. A SeriesStore keeps each series as two column files instead:
+
+    <store directory>/<key>/times.i8     timestamps, int64 nanoseconds since the epoch (UTC, as the API)
+    <store directory>/<key>/values.f8    values, float64
+
+The files are appended to as data is loaded, and read as numpy.memmap arrays so only the pages used are
+read into memory, and the OS can drop them again. Timestamps are kept in order, so a time range is found
+by binary search in the memory mapped timestamps. Analyses run chunk by chunk: chunks() gives the data
+in pieces of about chunk_size samples, and with a grouping the pieces are cut between groups so every
+group is whole within one chunk, see TimeseriesAnalyser.group_and_describe_stored().
+
+Appends are made in order of time, samples not later than the last one stored are skipped so loading an
+overlapping range again does not duplicate data. If a process stops halfway through an append, the
+longer of the two files is cut back to the length of the shorter on the next append.
+
+Example:
+
+    store = SeriesStore('/data/byteport')
+    stored = analyser.load_to_store('test', '6000', 'temp', from_time, to_time, store)
+    descriptions = analyser.group_and_describe_stored(stored, 'DAILY')
+"""
+import os
+import logging
+
+import numpy
+import pandas
+
+from byteport.scientific.grouping import group_and_describe, period_starts, next_period_start, SUBSET_ANALYSES
+
+TIMES_FILE = 'times.i8'
+VALUES_FILE = 'values.f8'
+
+# Samples per chunk, 8 MB of timestamps and values
+DEFAULT_CHUNK_SIZE = 512 * 1024
+
+
+class StoredSeries:
+    '''
+    The column files of one series, see the module documentation.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path:    Directory of the series, created if needed
+        '''
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.times_path = os.path.join(path, TIMES_FILE)
+        self.values_path = os.path.join(path, VALUES_FILE)
+
+    def sizes(self):
+        return tuple(os.path.getsize(path) // 8 if os.path.exists(path) else 0
+                     for path in (self.times_path, self.values_path))
+
+    def __len__(self):
+        return min(self.sizes())
+
+    def column(self, path, dtype):
+        count = len(self)
+        if not count:
+            return numpy.empty(0, dtype=dtype)
+        return numpy.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def times(self):
+        '''
+        :return: Read only memory mapped timestamps, int64 nanoseconds since the epoch
+        '''
+        return self.column(self.times_path, numpy.int64)
+
+    def values(self):
+        '''
+        :return: Read only memory mapped values
+        '''
+        return self.column(self.values_path, numpy.float64)
+
+    def last_time(self):
+        '''
+        :return: Timestamp of the last sample as int64 nanoseconds, None if the series is empty
+        '''
+        count = len(self)
+        if not count:
+            return None
+        return int(self.times()[count - 1])
+
+    def append(self, times, values):
+        '''
+        Appends samples in order of time, samples not later than the last sample stored are skipped.
+
+        :param times:   datetime64 array, DatetimeIndex or int64 nanoseconds since the epoch
+        :param values:  Numeric values, as many as times
+        :return:        Number of samples appended
+        '''
+        if isinstance(times, pandas.DatetimeIndex):
+            times = times.tz_convert('UTC').tz_localize(None) if times.tz is not None else times
+            times = times.asi8
+        times = numpy.asarray(times)
+        if times.dtype.kind == 'M':
+            times = times.astype('datetime64[ns]').view(numpy.int64)
+        times = times.astype(numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+
+        if len(times) != len(values):
+            raise Exception("Got %s timestamps for %s values" % (len(times), len(values)))
+        if len(times) > 1 and (numpy.diff(times) < 0).any():
+            raise Exception("Timestamps must be in order")
+
+        (times_count, values_count) = self.sizes()
+        count = min(times_count, values_count)
+        if times_count != values_count:
+            # An append was interrupted, drop the part written to one column only
+            for path in (self.times_path, self.values_path):
+                # The values are written after the times, the first append may not have created them
+                if os.path.exists(path):
+                    with open(path, 'r+b') as column_file:
+                        column_file.truncate(count * 8)
+
+        last_time = self.last_time()
+        if last_time is not None:
+            later = times > last_time
+            times = times[later]
+            values = values[later]
+
+        if not len(times):
+            return 0
+
+        for (path, column) in ((self.times_path, times), (self.values_path, values)):
+            with open(path, 'ab') as column_file:
+                column.tofile(column_file)
+
+        return len(times)
+
+    def append_series(self, series):
+        '''
+        Appends the samples of a Series with a DatetimeIndex.
+        '''
+        return self.append(series.index, series.values)
+
+    def bounds(self, from_time=None, to_time=None):
+        '''
+        :return: (start, end) positions of the samples from from_time up to and including to_time
+        '''
+        times = self.times()
+        start = 0 if from_time is None else int(numpy.searchsorted(times, as_nanoseconds(from_time), 'left'))
+        end = len(times) if to_time is None else int(numpy.searchsorted(times, as_nanoseconds(to_time), 'right'))
+        return start, max(start, end)
+
+    def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE, grouping=None, from_time=None, to_time=None):
+        '''
+        Yields the samples in pieces, see the module documentation.
+
+        :param chunk_size:  [optional] Samples per chunk, chunks cut between groups can be larger or smaller
+        :param grouping:    [optional] DAILY, HOURLY, WEEKLY or MONTHLY to keep every group within one chunk
+        :param from_time:   [optional] datetime, the first sample included
+        :param to_time:     [optional] datetime, the last sample included
+        :return:            Generator of (times, values), memory mapped int64 nanoseconds and values
+        '''
+        if chunk_size < 1:
+            raise Exception("chunk_size must be at least 1, was %s" % chunk_size)
+
+        times = self.times()
+        values = self.values()
+        (start, end) = self.bounds(from_time, to_time)
+
+        while start < end:
+            stop = min(start + chunk_size, end)
+
+            if grouping is not None and stop < end:
+                # Back to the start of the group the next sample is in, or if the chunk is all one group, on
+                # to its end
+                period = period_starts(times[stop:stop + 1].view('datetime64[ns]'), grouping)[0]
+                stop = start + int(numpy.searchsorted(times[start:stop], as_nanoseconds(period)))
+                if stop == start:
+                    following = as_nanoseconds(next_period_start(period, grouping))
+                    stop = start + int(numpy.searchsorted(times[start:end], following))
+
+            yield times[start:stop], values[start:stop]
+            start = stop
+
+    def to_series(self, from_time=None, to_time=None):
+        '''
+        :return: Series of the samples in the range, read into memory
+        '''
+        (start, end) = self.bounds(from_time, to_time)
+        return chunk_series(self.times()[start:end], self.values()[start:end])
+
+
+def as_nanoseconds(timestamp):
+    '''
+    :param timestamp:   datetime (UTC if naive) or datetime64
+    :return:            int64 nanoseconds since the epoch
+    '''
+    timestamp = pandas.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.value
+
+
+def parse_ts_data(rows):
+    '''
+    :param rows:    The ts_data of a response of load_timeseries_data(), rows with 't' and 'v'
+    :return:        (times, values) as int64 nanoseconds and float64, rows that do not parse are left out
+    '''
+    try:
+        times = numpy.array([row['t'] for row in rows], dtype='datetime64[ns]')
+        values = numpy.array([row['v'] for row in rows], dtype=numpy.float64)
+    except (ValueError, TypeError, KeyError):
+        # Parse row by row to leave out the bad ones only
+        parsed = list()
+        for row in rows:
+            try:
+                parsed.append((numpy.datetime64(row['t'], 'ns'), float(row['v'])))
+            except (ValueError, TypeError, KeyError):
+                logging.warn(u'Failed to parse data (%s), ignoring' % row)
+        times = numpy.array([time for (time, value) in parsed], dtype='datetime64[ns]')
+        values = numpy.array([value for (time, value) in parsed], dtype=numpy.float64)
+
+    return times.view(numpy.int64), values
+
+
+def chunk_series(times, values):
+    '''
+    :return: Series of a chunk, read into memory
+    '''
+    return pandas.Series(numpy.array(values), pandas.DatetimeIndex(numpy.array(times).view('datetime64[ns]')))
+
+
+def group_and_describe_stored(stored, grouping='DAILY', subset_analysis='pandas_describe', from_time=None,
+                              to_time=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    group_and_describe() of a StoredSeries, a chunk at a time. Every group is within one chunk, so the
+    result is the same as for the whole series read into memory.
+
+    :return: DataFrame with a column per group
+    '''
+    descriptions = [group_and_describe(chunk_series(times, values), grouping, subset_analysis)
+                    for (times, values) in stored.chunks(chunk_size, grouping, from_time, to_time)]
+
+    if not descriptions:
+        return pandas.DataFrame(index=SUBSET_ANALYSES[subset_analysis])
+    return pandas.concat(descriptions, axis=1)
+
+
+class SeriesStore:
+    '''
+    Directory of StoredSeries by key, ie. 'namespace.uid.field name'.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def series(self, key):
+        '''
+        :return: The StoredSeries of the key, created empty if it does not exist
+        '''
+        if not key or os.sep in key or key.startswith('.'):
+            raise Exception("Invalid series key, '%s'" % key)
+        return StoredSeries(os.path.join(self.path, key))
+
+    def keys(self):
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
@@ -0,0 +1,185 @@
+"""
+Local version of the distance to typical anomaly detection of the Byteport API.
+
+The /api/v1/timeseries/analysis/distance_to_typical/ service computes everything on the fly on the shared
+server, and long ranges or many devices end with 504 timeouts. This runs the same analysis locally on
+series that are already loaded or cached: the series is split into segments by grouping, each segment is
+described and the distance of every segment to the typical segment (the median of each descriptor) is
+computed, see byteport.scientific.grouping and byteport.scientific.distance.
+
+The result has the layout of the response body of the API, so code written for the service can use
+either:
+
+    {
+        "distances": [{"dist": 10.36, "group_name": "2016-03-19"}, ...],
+        "T_med": {"count": 116.5, "mean": -0.48, ...},
+        "meta": {"guid": "test.6000.temp", "grouping": "DAILY", ...}
+    }
+
+Group names are formatted as by the API, ie. '2016 21' for week 21 and '2016 07' for July. Distances that
+can not be computed are null.
+
+Series of several devices are analysed in parallel by a pool of processes, one device per task.
+
+Example:
+
+    results = distance_to_typical_many({'test.6000.temp': series_6000, 'test.6001.temp': series_6001},
+                                       grouping='hourly', order='distance')
+"""
+import logging
+import multiprocessing
+
+import numpy
+
+from byteport.scientific.grouping import group_and_describe, DESCRIBE, WEEKLY, MONTHLY, GROUPINGS
+from byteport.scientific.distance import typical_vector, distances, EUCLIDEAN
+
+DATE = 'date'
+DISTANCE = 'distance'
+
+ORDERS = [DATE, DISTANCE]
+
+# Format of the 'from' and 'to' of the meta data
+META_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def api_group_name(label, grouping):
+    '''
+    :return: The label of a group made by group_and_describe() as named by the API
+    '''
+    if grouping == WEEKLY:
+        return label.replace(u'-W', u' ')
+    if grouping == MONTHLY:
+        return label.replace(u'-', u' ')
+    return label
+
+
+def json_number(value):
+    if numpy.isnan(value):
+        return None
+    return float(value)
+
+
+def distance_to_typical(series, grouping='daily', order=DATE, diff_before_analysis=False, include_descriptions=False,
+                        exclude_descriptors=None, judge_strategy=EUCLIDEAN, guid=None, from_time=None, to_time=None):
+    '''
+    Distance of each segment of the series to the typical segment, see the module documentation.
+
+    :param series:                  Series with a DatetimeIndex
+    :param grouping:                [optional] One of 'daily', 'hourly', 'weekly' or 'monthly', upper case works too
+    :param order:                   [optional] 'date' or 'distance', closest first
+    :param diff_before_analysis:    [optional] Differentiate the series first, for accumulating values
+    :param include_descriptions:    [optional] Include the description of each segment as 'description'
+    :param exclude_descriptors:     [optional] List of descriptors not used for the distance, ie. ['count']
+    :param judge_strategy:          [optional] Distance metric, see byteport.scientific.distance
+    :param guid:                    [optional] Reported in the meta data, 'namespace.uid.field name' in the API
+    :param from_time:               [optional] datetime reported in the meta data, by default the first timestamp
+    :param to_time:                 [optional] datetime reported in the meta data, by default the last timestamp
+    :return:                        Dictionary with 'distances', 'T_med' and 'meta' as the API response
+    '''
+    grouping = grouping.upper()
+    if grouping not in GROUPINGS:
+        raise Exception("Unsupported grouping, '%s'" % grouping)
+    if order not in ORDERS:
+        raise Exception("Unsupported order, '%s'" % order)
+
+    excluded = [descriptor for descriptor in (exclude_descriptors or []) if descriptor]
+    unknown = set(excluded) - set(DESCRIBE)
+    if unknown:
+        raise Exception("Unsupported descriptors, %s" % ', '.join(sorted(unknown)))
+
+    if from_time is None and len(series):
+        from_time = series.index[0]
+    if to_time is None and len(series):
+        to_time = series.index[-1]
+
+    if diff_before_analysis:
+        series = series.diff().iloc[1:]
+
+    descriptions = group_and_describe(series, grouping)
+    typical = typical_vector(descriptions)
+
+    used = [descriptor for descriptor in descriptions.index if descriptor not in excluded]
+    group_distances = distances(descriptions.loc[used].values.T, typical[used].values, judge_strategy)
+
+    if order == DISTANCE:
+        # NaN sorts last
+        positions = numpy.argsort(group_distances, kind='mergesort')
+    else:
+        positions = numpy.arange(len(group_distances))
+
+    labels = descriptions.columns
+    values = descriptions.values
+
+    result_distances = list()
+    for position in positions:
+        entry = {'dist': json_number(group_distances[position]),
+                 'group_name': api_group_name(labels[position], grouping)}
+        if include_descriptions:
+            entry['description'] = dict((descriptor, json_number(value))
+                                        for (descriptor, value) in zip(descriptions.index, values[:, position]))
+        result_distances.append(entry)
+
+    return {
+        'distances': result_distances,
+        'T_med': dict((descriptor, json_number(value)) for (descriptor, value) in typical.iteritems()),
+        'meta': {
+            'from': from_time.strftime(META_TIME_FORMAT) if from_time is not None else None,
+            'to': to_time.strftime(META_TIME_FORMAT) if to_time is not None else None,
+            'include_descriptions': include_descriptions,
+            'order_by_distance': order == DISTANCE,
+            'diff_before_analysis': diff_before_analysis,
+            'guid': guid,
+            'exclude_descriptors': excluded,
+            'grouping': grouping,
+        },
+    }
+
+
+def analyse_device(task):
+    '''
+    Runs distance_to_typical() for one device in a worker process.
+
+    :param task:    (guid, series, parameters)
+    :return:        (guid, result)
+    '''
+    (guid, series, parameters) = task
+    try:
+        return guid, distance_to_typical(series, guid=guid, **parameters)
+    except Exception as e:
+        # The traceback stays in the worker, name the device at least
+        raise Exception("Distance to typical of %s failed: %s" % (guid, e))
+
+
+def distance_to_typical_many(series_by_guid, processes=None, **parameters):
+    '''
+    Runs distance_to_typical() for the series of many devices in parallel.
+
+    :param series_by_guid:  Dictionary of guid -> Series
+    :param processes:       [optional] Worker processes, by default one per CPU. With 1 the series are analysed
+                            in this process.
+    :param parameters:      Parameters of distance_to_typical()
+    :return:                Dictionary of guid -> result of distance_to_typical()
+    '''
+    tasks = [(guid, series, parameters) for (guid, series) in series_by_guid.items()]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+
+    if processes <= 1:
+        return dict(analyse_device(task) for task in tasks)
+
+    logging.debug(u'Analysing %s devices in %s processes' % (len(tasks), processes))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(analyse_device, tasks, chunksize=1)
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return dict(results)
@@ -0,0 +1,155 @@
+"""
+Persistent login sessions for the HTTP client.
+
+Logging in takes two requests, a GET for the csrftoken and the POST of the credentials. Short lived
+processes, ie. analytics jobs using ByteportPandas, would log in on every run. Given a
+ByteportSessionStore the client saves the sessionid and csrftoken cookies after logging in and reuses
+them in later processes until they expire. A request refused with 403 because the session ended on the
+server makes the client log in again and retry the request once.
+
+The sessions of all users and hosts are kept in one JSON file, readable by the owner only since the
+cookies give access to the account. Writes are atomic, a process reading the file never sees it half
+written.
+
+Example:
+
+    store = ByteportSessionStore(os.path.expanduser('~/.byteport/sessions.json'))
+    client = ByteportHttpClient(session_store=store)
+    client.login('username', 'password')   # Makes no requests if a saved session is still valid
+"""
+import os
+import json
+import time
+import logging
+import cookielib
+import threading
+
+from client_base import ByteportClientException
+
+# Cookies making up a logged in session
+SESSION_COOKIES = ('sessionid', 'csrftoken')
+
+
+class ByteportCookieJar(cookielib.CookieJar):
+    '''
+    CookieJar also indexing the cookies by name, so value() does not have to scan the jar.
+    '''
+
+    def __init__(self, policy=None):
+        cookielib.CookieJar.__init__(self, policy)
+
+        # Cookie name -> the cookielib.Cookie set last with that name
+        self.by_name = dict()
+
+    def set_cookie(self, cookie):
+        cookielib.CookieJar.set_cookie(self, cookie)
+        self.by_name[cookie.name] = cookie
+
+    def clear(self, domain=None, path=None, name=None):
+        # Also called for cookies deleted by the server, rare enough to rebuild the index
+        cookielib.CookieJar.clear(self, domain, path, name)
+        self.by_name = dict((cookie.name, cookie) for cookie in self)
+
+    def value(self, name):
+        '''
+        :return: Value of the cookie, None if there is no cookie with the name
+        '''
+        cookie = self.by_name.get(name)
+        if cookie is None:
+            return None
+        return cookie.value
+
+
+class ByteportSessionStore:
+    '''
+    Sessions by (API hostname, username) saved in a file, see the module documentation.
+    '''
+
+    # Seconds a session is reused when the cookies do not expire by themselves
+    DEFAULT_MAX_AGE = 12 * 3600
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        '''
+        :param path:    File the sessions are saved in, the directory is created if needed
+        :param max_age: [optional] Seconds a saved session is reused at most
+        '''
+        if max_age <= 0:
+            raise ByteportClientException("max_age must be positive, was %s" % max_age)
+
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(hostname, username):
+        return '%s %s' % (hostname, username)
+
+    def read(self):
+        try:
+            with open(self.path) as sessions_file:
+                return json.load(sessions_file)
+        except IOError:
+            return dict()
+        except ValueError as e:
+            logging.warn(u'Ignored invalid session file %s: %s' % (self.path, e))
+            return dict()
+
+    def write(self, sessions):
+        temp_path = '%s.%s.tmp' % (self.path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as sessions_file:
+            json.dump(sessions, sessions_file)
+        os.rename(temp_path, self.path)
+
+    def load(self, hostname, username):
+        '''
+        :return: List of the cookielib.Cookies of the saved session, None if there is no valid session
+        '''
+        session = self.read().get(self.key(hostname, username))
+        if session is None or session['expires'] <= time.time():
+            return None
+
+        return [cookielib.Cookie(0, cookie['name'], cookie['value'], None, False, cookie['domain'], False,
+                                 cookie['domain'].startswith('.'), cookie['path'], True, cookie['secure'],
+                                 cookie['expires'], cookie['expires'] is None, None, None, {})
+                for cookie in session['cookies']]
+
+    def save(self, hostname, username, cookies):
+        '''
+        Saves the session cookies among the cookies, ie. all cookies of the client's cookie jar.
+        '''
+        session_cookies = [cookie for cookie in cookies if cookie.name in SESSION_COOKIES]
+
+        expires = time.time() + self.max_age
+        for cookie in session_cookies:
+            if cookie.expires is not None:
+                expires = min(expires, cookie.expires)
+
+        session = {
+            'expires': expires,
+            'cookies': [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain,
+                         'path': cookie.path, 'secure': cookie.secure, 'expires': cookie.expires}
+                        for cookie in session_cookies],
+        }
+
+        with self.lock:
+            sessions = self.read()
+
+            # Drop the expired sessions of other users while at it
+            now = time.time()
+            for (key, other) in sessions.items():
+                if other['expires'] <= now:
+                    del sessions[key]
+
+            sessions[self.key(hostname, username)] = session
+            self.write(sessions)
+
+    def forget(self, hostname, username):
+        with self.lock:
+            sessions = self.read()
+            if sessions.pop(self.key(hostname, username), None) is not None:
+                self.write(sessions)
@@ -40,11 +40,19 @@ mainly to merge bug fixes found in Sourceforge
 
 Minor modifications made by Eugene Dementiev (http://www.dementiev.eu/)
 
+Resolved addresses of proxies and destinations are cached, see setdnscachettl()
+
+Negotiation reads replies into preallocated buffers with as few recv calls as the protocol allows,
+and builds each request in a single buffer sent with one write. With pipeline=True the SOCKS5
+greeting, authentication and connect request are sent at once, saving one or two round trips.
+
 """
 
 import socket
 import struct
 import sys
+import time
+import threading
 
 PROXY_TYPE_SOCKS4 = 1
 PROXY_TYPE_SOCKS5 = 2
@@ -53,6 +61,10 @@ PROXY_TYPE_HTTP = 3
 _defaultproxy = None
 _orgsocket = socket.socket
 
+_dnscachettl = 300
+_dnscache = {}
+_dnscachelock = threading.Lock()
+
 class ProxyError(Exception): pass
 class GeneralProxyError(ProxyError): pass
 class Socks5AuthError(ProxyError): pass
@@ -90,13 +102,42 @@ _socks4errors = ("request granted",
     "request rejected because the client program and identd report different user-ids",
     "unknown error")
 
-def setdefaultproxy(proxytype=None, addr=None, port=None, rdns=True, username=None, password=None):
-    """setdefaultproxy(proxytype, addr[, port[, rdns[, username[, password]]]])
+def setdefaultproxy(proxytype=None, addr=None, port=None, rdns=True, username=None, password=None, pipeline=False):
+    """setdefaultproxy(proxytype, addr[, port[, rdns[, username[, password[, pipeline]]]]])
     Sets a default proxy which all further socksocket objects will use,
     unless explicitly changed.
     """
     global _defaultproxy
-    _defaultproxy = (proxytype, addr, port, rdns, username, password)
+    _defaultproxy = (proxytype, addr, port, rdns, username, password, pipeline)
+
+def setdnscachettl(seconds):
+    """setdnscachettl(seconds)
+    Sets how long resolved addresses are cached, 0 disables the cache.
+    """
+    global _dnscachettl
+    _dnscachettl = seconds
+    cleardnscache()
+
+def cleardnscache():
+    """cleardnscache()
+    Forgets all resolved addresses.
+    """
+    with _dnscachelock:
+        _dnscache.clear()
+
+def gethostbyname(host):
+    """gethostbyname(host) -> address
+    socket.gethostbyname() with the result cached for the DNS cache TTL.
+    """
+    now = time.time()
+    entry = _dnscache.get(host)
+    if entry != None and entry[1] > now:
+        return entry[0]
+    addr = socket.gethostbyname(host)
+    if _dnscachettl > 0:
+        with _dnscachelock:
+            _dnscache[host] = (addr, now + _dnscachettl)
+    return addr
 
 def wrapmodule(module):
     """wrapmodule(module)
@@ -122,7 +163,7 @@ class socksocket(socket.socket):
         if _defaultproxy != None:
             self.__proxy = _defaultproxy
         else:
-            self.__proxy = (None, None, None, None, None, None)
+            self.__proxy = (None, None, None, None, None, None, False)
         self.__proxysockname = None
         self.__proxypeername = None
 
@@ -131,15 +172,22 @@ class socksocket(socket.socket):
         Receive EXACTLY the number of bytes requested from the socket.
         Blocks until the required number of bytes have been received.
         """
-        data = self.recv(count)
-        while len(data) < count:
-            d = self.recv(count-len(data))
-            if not d: raise GeneralProxyError((0, "connection closed unexpectedly"))
-            data = data + d
-        return data
-
-    def setproxy(self, proxytype=None, addr=None, port=None, rdns=True, username=None, password=None):
-        """setproxy(proxytype, addr[, port[, rdns[, username[, password]]]])
+        data = bytearray(count)
+        self.__recvinto(memoryview(data))
+        return bytes(data)
+
+    def __recvinto(self, view):
+        """__recvinto(view)
+        Fill the memoryview EXACTLY from the socket, without intermediate strings.
+        """
+        received = 0
+        while received < len(view):
+            n = self.recv_into(view[received:])
+            if not n: raise GeneralProxyError((0, "connection closed unexpectedly"))
+            received += n
+
+    def setproxy(self, proxytype=None, addr=None, port=None, rdns=True, username=None, password=None, pipeline=False):
+        """setproxy(proxytype, addr[, port[, rdns[, username[, password[, pipeline]]]]])
         Sets the proxy to be used.
         proxytype -    The type of the proxy to be used. Three types
                 are supported: PROXY_TYPE_SOCKS4 (including socks4a),
@@ -154,43 +202,90 @@ class socksocket(socket.socket):
                 The default is no authentication.
         password -    Password to authenticate with to the server.
                 Only relevant when username is also provided.
+        pipeline -    Send the SOCKS5 greeting, authentication and request
+                without waiting for the replies in between. Only offers
+                the one authentication method that will be used, so the
+                server must accept it. The default is False.
         """
-        self.__proxy = (proxytype, addr, port, rdns, username, password)
+        self.__proxy = (proxytype, addr, port, rdns, username, password, pipeline)
 
     def __negotiatesocks5(self, destaddr, destport):
         """__negotiatesocks5(self,destaddr,destport)
         Negotiates a connection through a SOCKS5 server.
         """
-        # First we'll send the authentication packages we support.
-        if (self.__proxy[4]!=None) and (self.__proxy[5]!=None):
+        useauth = (self.__proxy[4]!=None) and (self.__proxy[5]!=None)
+        pipeline = self.__proxy[6]
+        # The authentication packages we support.
+        if useauth and pipeline:
+            # Only USERNAME/PASSWORD, so we know what the server will choose
+            greeting = bytearray((0x05, 0x01, 0x02))
+        elif useauth:
             # The username/password details were supplied to the
             # setproxy method so we support the USERNAME/PASSWORD
             # authentication (in addition to the standard none).
-            self.sendall(struct.pack('BBBB', 0x05, 0x02, 0x00, 0x02))
+            greeting = bytearray((0x05, 0x02, 0x00, 0x02))
         else:
             # No username/password were entered, therefore we
             # only support connections with no authentication.
-            self.sendall(struct.pack('BBB', 0x05, 0x01, 0x00))
+            greeting = bytearray((0x05, 0x01, 0x00))
+        if useauth:
+            auth = bytearray((0x01, len(self.__proxy[4])))
+            auth += self.__proxy[4]
+            auth.append(len(self.__proxy[5]))
+            auth += self.__proxy[5]
+        # The actual connection request
+        req = bytearray((0x05, 0x01, 0x00))
+        # If the given destination address is an IP address, we'll
+        # use the IPv4 address request even if remote resolving was specified.
+        try:
+            ipaddr = socket.inet_aton(destaddr)
+            req.append(0x01)
+            req += ipaddr
+        except socket.error:
+            # Well it's not an IP number,  so it's probably a DNS name.
+            if self.__proxy[3]:
+                # Resolve remotely
+                ipaddr = None
+                req.append(0x03)
+                req.append(len(destaddr))
+                req += destaddr.encode()
+            else:
+                # Resolve locally
+                ipaddr = socket.inet_aton(gethostbyname(destaddr))
+                req.append(0x01)
+                req += ipaddr
+        req += struct.pack(">H", destport)
+        if pipeline:
+            # Everything in one write, the replies are read in order below
+            if useauth:
+                self.sendall(greeting + auth + req)
+            else:
+                self.sendall(greeting + req)
+        else:
+            self.sendall(greeting)
         # We'll receive the server's response to determine which
         # method was selected
-        chosenauth = self.__recvall(2)
-        if chosenauth[0:1] != chr(0x05).encode():
+        chosenauth = bytearray(2)
+        self.__recvinto(memoryview(chosenauth))
+        if chosenauth[0] != 0x05:
             self.close()
             raise GeneralProxyError((1, _generalerrors[1]))
         # Check the chosen authentication method
-        if chosenauth[1:2] == chr(0x00).encode():
+        if chosenauth[1] == 0x00 and not (useauth and pipeline):
             # No authentication is required
             pass
-        elif chosenauth[1:2] == chr(0x02).encode():
+        elif chosenauth[1] == 0x02 and useauth:
             # Okay, we need to perform a basic username/password
             # authentication.
-            self.sendall(chr(0x01).encode() + chr(len(self.__proxy[4])) + self.__proxy[4] + chr(len(self.__proxy[5])) + self.__proxy[5])
-            authstat = self.__recvall(2)
-            if authstat[0:1] != chr(0x01).encode():
+            if not pipeline:
+                self.sendall(auth)
+            authstat = bytearray(2)
+            self.__recvinto(memoryview(authstat))
+            if authstat[0] != 0x01:
                 # Bad response
                 self.close()
                 raise GeneralProxyError((1, _generalerrors[1]))
-            if authstat[1:2] != chr(0x00).encode():
+            if authstat[1] != 0x00:
                 # Authentication failed
                 self.close()
                 raise Socks5AuthError((3, _socks5autherrors[3]))
@@ -198,51 +293,43 @@ class socksocket(socket.socket):
         else:
             # Reaching here is always bad
             self.close()
-            if chosenauth[1] == chr(0xFF).encode():
+            if chosenauth[1] == 0xFF:
                 raise Socks5AuthError((2, _socks5autherrors[2]))
             else:
                 raise GeneralProxyError((1, _generalerrors[1]))
-        # Now we can request the actual connection
-        req = struct.pack('BBB', 0x05, 0x01, 0x00)
-        # If the given destination address is an IP address, we'll
-        # use the IPv4 address request even if remote resolving was specified.
-        try:
-            ipaddr = socket.inet_aton(destaddr)
-            req = req + chr(0x01).encode() + ipaddr
-        except socket.error:
-            # Well it's not an IP number,  so it's probably a DNS name.
-            if self.__proxy[3]:
-                # Resolve remotely
-                ipaddr = None
-                req = req + chr(0x03).encode() + chr(len(destaddr)).encode() + destaddr.encode()
-            else:
-                # Resolve locally
-                ipaddr = socket.inet_aton(socket.gethostbyname(destaddr))
-                req = req + chr(0x01).encode() + ipaddr
-        req = req + struct.pack(">H", destport)
-        self.sendall(req)
-        # Get the response
-        resp = self.__recvall(4)
-        if resp[0:1] != chr(0x05).encode():
+        if not pipeline:
+            self.sendall(req)
+        # Get the response, the version, status, reserved and address type
+        # fields and the first byte of the bound address in one read
+        resp = bytearray(5)
+        self.__recvinto(memoryview(resp))
+        if resp[0] != 0x05:
             self.close()
             raise GeneralProxyError((1, _generalerrors[1]))
-        elif resp[1:2] != chr(0x00).encode():
+        elif resp[1] != 0x00:
             # Connection failed
             self.close()
-            if ord(resp[1:2])<=8:
-                raise Socks5Error((ord(resp[1:2]), _socks5errors[ord(resp[1:2])]))
+            if resp[1]<=8:
+                raise Socks5Error((resp[1], _socks5errors[resp[1]]))
             else:
                 raise Socks5Error((9, _socks5errors[9]))
-        # Get the bound address/port
-        elif resp[3:4] == chr(0x01).encode():
-            boundaddr = self.__recvall(4)
-        elif resp[3:4] == chr(0x03).encode():
-            resp = resp + self.recv(1)
-            boundaddr = self.__recvall(ord(resp[4:5]))
+        # Get the rest of the bound address and the port
+        elif resp[3] == 0x01:
+            rest = bytearray(3 + 2)
+            self.__recvinto(memoryview(rest))
+            boundaddr = bytes(resp[4:5] + rest[:3])
+        elif resp[3] == 0x03:
+            rest = bytearray(resp[4] + 2)
+            self.__recvinto(memoryview(rest))
+            boundaddr = bytes(rest[:-2])
+        elif resp[3] == 0x04:
+            rest = bytearray(15 + 2)
+            self.__recvinto(memoryview(rest))
+            boundaddr = bytes(resp[4:5] + rest[:15])
         else:
             self.close()
             raise GeneralProxyError((1,_generalerrors[1]))
-        boundport = struct.unpack(">H", self.__recvall(2))[0]
+        boundport = struct.unpack(">H", bytes(rest[-2:]))[0]
         self.__proxysockname = (boundaddr, boundport)
         if ipaddr != None:
             self.__proxypeername = (socket.inet_ntoa(ipaddr), destport)
@@ -282,18 +369,20 @@ class socksocket(socket.socket):
                 ipaddr = struct.pack("BBBB", 0x00, 0x00, 0x00, 0x01)
                 rmtrslv = True
             else:
-                ipaddr = socket.inet_aton(socket.gethostbyname(destaddr))
+                ipaddr = socket.inet_aton(gethostbyname(destaddr))
         # Construct the request packet
-        req = struct.pack(">BBH", 0x04, 0x01, destport) + ipaddr
+        req = bytearray(struct.pack(">BBH", 0x04, 0x01, destport))
+        req += ipaddr
         # The username parameter is considered userid for SOCKS4
         if self.__proxy[4] != None:
-            req = req + self.__proxy[4]
-        req = req + chr(0x00).encode()
+            req += self.__proxy[4]
+        req.append(0x00)
         # DNS name if remote resolving is required
         # NOTE: This is actually an extension to the SOCKS4 protocol
         # called SOCKS4A and may not be supported in all cases.
         if rmtrslv:
-            req = req + destaddr + chr(0x00).encode()
+            req += destaddr
+            req.append(0x00)
         self.sendall(req)
         # Get the response from the server
         resp = self.__recvall(8)
@@ -322,17 +411,24 @@ class socksocket(socket.socket):
         """
         # If we need to resolve locally, we do this now
         if not self.__proxy[3]:
-            addr = socket.gethostbyname(destaddr)
+            addr = gethostbyname(destaddr)
         else:
             addr = destaddr
         self.sendall(("CONNECT " + addr + ":" + str(destport) + " HTTP/1.1\r\n" + "Host: " + destaddr + "\r\n\r\n").encode())
-        # We read the response until we get the string "\r\n\r\n"
-        resp = self.recv(1)
-        while resp.find("\r\n\r\n".encode()) == -1:
-            recv = self.recv(1)
-            if not recv:
+        # We read the response until we get the string "\r\n\r\n". Peek
+        # at what has arrived and only consume the headers, anything after
+        # them belongs to the tunnelled connection.
+        resp = bytearray()
+        while True:
+            peeked = self.recv(4096, socket.MSG_PEEK)
+            if not peeked:
                 raise GeneralProxyError((1, _generalerrors[1]))
-            resp = resp + recv
+            end = (bytes(resp[-3:]) + peeked).find("\r\n\r\n".encode())
+            if end != -1:
+                resp += self.__recvall(end + 4 - min(3, len(resp)))
+                break
+            resp += self.__recvall(len(peeked))
+        resp = bytes(resp)
         # We just need the first line to check if the connection
         # was successful
         statusline = resp.splitlines()[0].split(" ".encode(), 2)
@@ -365,21 +461,21 @@ class socksocket(socket.socket):
                 portnum = self.__proxy[2]
             else:
                 portnum = 1080
-            _orgsocket.connect(self, (self.__proxy[1], portnum))
+            _orgsocket.connect(self, (gethostbyname(self.__proxy[1]), portnum))
             self.__negotiatesocks5(destpair[0], destpair[1])
         elif self.__proxy[0] == PROXY_TYPE_SOCKS4:
             if self.__proxy[2] != None:
                 portnum = self.__proxy[2]
             else:
                 portnum = 1080
-            _orgsocket.connect(self,(self.__proxy[1], portnum))
+            _orgsocket.connect(self,(gethostbyname(self.__proxy[1]), portnum))
             self.__negotiatesocks4(destpair[0], destpair[1])
         elif self.__proxy[0] == PROXY_TYPE_HTTP:
             if self.__proxy[2] != None:
                 portnum = self.__proxy[2]
             else:
                 portnum = 8080
-            _orgsocket.connect(self,(self.__proxy[1], portnum))
+            _orgsocket.connect(self,(gethostbyname(self.__proxy[1]), portnum))
             self.__negotiatehttp(destpair[0], destpair[1])
         elif self.__proxy[0] == None:
             _orgsocket.connect(self, (destpair[0], destpair[1]))
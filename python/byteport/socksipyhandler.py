@@ -5,36 +5,81 @@ version: 0.2
 author: e<e@tr0ll.in>
 
 This module provides a Handler which you can use with urllib2 to allow it to tunnel your connection through a socks.sockssocket socket, with out monkey patching the original socket...
+
+Connections are kept alive and reused, so the SOCKS negotiation is made once per connection and not once
+per request. Use keep_alive=False for a new connection per request, and pipeline=True to send the
+SOCKS5 negotiation without waiting for each reply (see socks.socksocket.setproxy). HTTPS is tunnelled
+the same way, pass context=ssl_context to use another than ssl.create_default_context().
 """
 
+import socket
 import urllib2
 import httplib
 import socks
 
-class SocksiPyConnection(httplib.HTTPConnection):
-    def __init__(self, proxytype, proxyaddr, proxyport = None, rdns = True, username = None, password = None, *args, **kwargs):
-        self.proxyargs = (proxytype, proxyaddr, proxyport, rdns, username, password)
+import instrumentation
+from instrumentation import ByteportInstrumentedHTTPConnection, ByteportInstrumentedHTTPSConnection
+from connection_pool import ByteportKeepAliveHandler
+
+def create_connection(proxyargs, host, port, timeout):
+    sock = socks.socksocket()
+    sock.setproxy(*proxyargs)
+    if isinstance(timeout, float):
+        sock.settimeout(timeout)
+    try:
+        sock.connect((host, port))
+    except socks.ProxyError as e:
+        # Failing to negotiate is failing to connect for urllib2
+        sock.close()
+        raise socket.error(*e.args[0])
+    return sock
+
+class SocksiPyConnection(ByteportInstrumentedHTTPConnection):
+    def __init__(self, proxytype, proxyaddr, proxyport = None, rdns = True, username = None, password = None, pipeline = False, *args, **kwargs):
+        self.proxyargs = (proxytype, proxyaddr, proxyport, rdns, username, password, pipeline)
         httplib.HTTPConnection.__init__(self, *args, **kwargs)
 
     def connect(self):
-        self.sock = socks.socksocket()
-        self.sock.setproxy(*self.proxyargs)
-        if isinstance(self.timeout, float):
-            self.sock.settimeout(self.timeout)
-        self.sock.connect((self.host, self.port))
+        self.sock = create_connection(self.proxyargs, self.host, self.port, self.timeout)
+        instrumentation.mark('connect')
+
+class SocksiPyHTTPSConnection(ByteportInstrumentedHTTPSConnection):
+    def __init__(self, proxytype, proxyaddr, proxyport = None, rdns = True, username = None, password = None, pipeline = False, *args, **kwargs):
+        self.proxyargs = (proxytype, proxyaddr, proxyport, rdns, username, password, pipeline)
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+
+    def connect(self):
+        sock = create_connection(self.proxyargs, self.host, self.port, self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+        instrumentation.mark('connect')
 
-class SocksiPyHandler(urllib2.HTTPHandler):
+class SocksiPyHandler(ByteportKeepAliveHandler):
     def __init__(self, *args, **kwargs):
+        self.keep_alive = kwargs.pop('keep_alive', True)
+        pool = kwargs.pop('pool', None)
+        context = kwargs.pop('context', None)
         self.args = args
         self.kw = kwargs
-        urllib2.HTTPHandler.__init__(self)
+        ByteportKeepAliveHandler.__init__(self, self.build, pool, self.build_https, context)
+
+    def build(self, host, port=None, strict=None, timeout=0):
+        return SocksiPyConnection(*self.args, host=host, port=port, strict=strict, timeout=timeout, **self.kw)
+
+    def build_https(self, host, port=None, strict=None, timeout=0):
+        return SocksiPyHTTPSConnection(*self.args, host=host, port=port, strict=strict, timeout=timeout,
+                                       context=self.ssl_context(), **self.kw)
 
     def http_open(self, req):
         req.add_header('User-Agent', 'curl/7.51.0')
-        def build(host, port=None, strict=None, timeout=0):
-            conn = SocksiPyConnection(*self.args, host=host, port=port, strict=strict, timeout=timeout, **self.kw)
-            return conn
-        return self.do_open(build, req)
+        if self.keep_alive:
+            return self.keep_alive_open(self.build, req)
+        return self.do_open(self.build, req)
+
+    def https_open(self, req):
+        req.add_header('User-Agent', 'curl/7.51.0')
+        if self.keep_alive:
+            return self.keep_alive_open(self.build_https, req)
+        return self.do_open(self.build_https, req)
 
 if __name__ == "__main__":
     opener = urllib2.build_opener(SocksiPyHandler(socks.PROXY_TYPE_SOCKS4, 'localhost', 9999))
@@ -4,29 +4,35 @@ import logging
 from client_base import *
 
 
-try:
-    from stompest.config import StompConfig
-    from stompest.protocol import StompSpec
-    from stompest.sync import Stomp
-    from stompest.error import StompConnectionError, StompProtocolError
-except ImportError:
-    print "Could not import Stompest library. The STOMP client will not be supported."
-    print ""
-    print "If you need to use that client, please do:"
-    print "pip install stompest"
+# Stompest is an optional dependency, it is imported when the first client is created
+# so importing this module stays cheap
+def load_stompest():
+    global StompConfig, StompSpec, Stomp, StompConnectionError, StompProtocolError
+
+    try:
+        from stompest.config import StompConfig
+        from stompest.protocol import StompSpec
+        from stompest.sync import Stomp
+        from stompest.error import StompConnectionError, StompProtocolError
+    except ImportError:
+        raise ByteportClientException("Could not import Stompest library. The STOMP client is not supported "
+                                      "without it, please do: pip install stompest")
 
 import time
 
 
 class ByteportStompClient(AbstractByteportClient):
     DEFAULT_BROKER_HOST = 'stomp.byteport.se'
+    DEFAULT_BROKER_PORT = 61613
     STORE_QUEUE_NAME = '/queue/simple_string_dev_message'
 
     SUPPORTED_CHANNEL_TYPES = ['topic', 'queue']
 
     client = None
+    subscription_token = None
 
-    def __init__(self, namespace, login, passcode, broker_host=DEFAULT_BROKER_HOST, device_uid=None, channel_type='topic'):
+    def __init__(self, namespace, login, passcode, broker_host=DEFAULT_BROKER_HOST, device_uid=None, channel_type='topic',
+                 broker_port=DEFAULT_BROKER_PORT, instrumentation=None, aggregator=None):
         '''
         Create a ByteportStompClient. This is a thin wrapper to the underlying STOMP-client that connets to the Byteport Broker
 
@@ -42,16 +48,24 @@ class ByteportStompClient(AbstractByteportClient):
         :param device_uid:      [optional] The device UID to subscribe for messages on
         :param channel_type:    [optional] Defaults to queue.
         :param channel_key:     [optional] Must match the configured key in the Byteport Device Manager
+        :param broker_port:     [optional] Port of the broker
+        :param instrumentation: [optional] A ByteportInstrumentation tracing every message sent
+        :param aggregator:      [optional] A ByteportStreamAggregator keeping rolling statistics of the data stored
+                                and of the data packets received, see streaming.py
 
         '''
 
+        load_stompest()
+
         self.namespace = str(namespace)
         self.device_uid = device_uid
+        self.instrumentation = instrumentation
+        self.aggregator = aggregator
 
         if channel_type not in self.SUPPORTED_CHANNEL_TYPES:
             raise Exception("Unsupported channel type: %s" % channel_type)
 
-        broker_url = 'tcp://%s:61613' % broker_host
+        broker_url = 'tcp://%s:%s' % (broker_host, broker_port)
         self.CONFIG = StompConfig(broker_url, version=StompSpec.VERSION_1_2)
         self.client = Stomp(self.CONFIG)
 
@@ -87,7 +101,18 @@ class ByteportStompClient(AbstractByteportClient):
         self.client.disconnect()
 
     def __send_json_message(self, json):
-        self.client.send(self.STORE_QUEUE_NAME, json)
+        if self.instrumentation is None:
+            self.client.send(self.STORE_QUEUE_NAME, json)
+            return
+
+        trace = self.instrumentation.start('stomp', 'SEND', self.STORE_QUEUE_NAME)
+        trace.bytes_sent = len(json)
+        try:
+            self.client.send(self.STORE_QUEUE_NAME, json)
+        except Exception as e:
+            self.instrumentation.finish(trace, None, e.__class__.__name__)
+            raise
+        self.instrumentation.finish(trace, 'sent')
 
     def __send_message(self, uid, data_string, timestamp=None):
 
@@ -111,13 +136,28 @@ class ByteportStompClient(AbstractByteportClient):
         self.__send_json_message(json.dumps([message]))
 
     def store(self, data=None, device_uid=None, timestamp=None):
-        if type(data) != dict:
-            raise ByteportClientException("Data must be of type dict")
+        delimited_data = self.build_delimited_data_string(data)
 
-        for key in data.keys():
-            self.verify_field_name(key)
+        self.__send_message(device_uid, delimited_data, timestamp)
 
-        delimited_data = ';'.join("%s=%s" % (key, self.utf8_encode_value(val)) for (key, val) in data.iteritems())
+        if self.aggregator is not None:
+            self.aggregator.observe(device_uid or self.device_uid, data, timestamp)
 
-        self.__send_message(device_uid, delimited_data, timestamp)
+    def receive(self, timeout=None):
+        '''
+        Receives and acknowledges the next frame of the subscription. Data packets are added to the aggregator.
+
+        :param timeout: [optional] Seconds to wait for a frame, by default until one arrives
+        :return:        The stompest frame, None if none arrived within the timeout
+        '''
+        if not self.client.canRead(timeout):
+            return None
+
+        frame = self.client.receiveFrame()
+        self.client.ack(frame)
+
+        if self.aggregator is not None:
+            self.aggregator.observe_packets(frame.body)
+
+        return frame
 
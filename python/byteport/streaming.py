@@ -0,0 +1,353 @@
+"""
+Rolling statistics of the data stored by the clients, for live dashboards without querying the API.
+
+Give a ByteportStreamAggregator to the HTTP, STOMP or MQTT client, to ByteportClient or to the client of a
+ByteportGateway (aggregator=...) and every numeric field stored is also added to the aggregator, once it
+was sent: when the request or publish succeeded, when a rate limited store is sent, when the gateway
+flushes and when the MQTT offline queue is drained. Data that failed to be sent is not counted. Consumers
+of the broker get the same from the packets they receive, ByteportMQTTClient.on_message() and
+ByteportStompClient.receive() add the JSON packet lists to the aggregator of the client.
+
+For each (device UID, field name) the last samples are kept in a NumPy ring buffer and the statistics of
+each window, ie. the last 60, 300 and 3600 seconds, are updated with every sample in constant time:
+
+    count, mean, std    sliding Welford update, a sample is added when stored and removed when it leaves
+    min, max            monotonic queues of the positions of the candidates, also NumPy ring buffers
+    rate                (last value - first value) / (last time - first time) over the window
+
+Samples leave a window when they are older than the window, measured from the newest sample (or from the
+time given to stats()), or when the ring buffer is full and they are overwritten. A window for which the
+ring buffer is too small reports capacity_reached, its statistics then cover the last capacity samples.
+Samples older than the newest sample of the series are not added, they are counted as late.
+
+Memory is allocated when a series is first seen and does not grow after that. Per series it is
+capacity * (16 + 8 * number of windows) bytes for the buffers, 40 kB with the defaults, plus about 1 kB
+for the objects. At most max_series series are kept, samples of further series are counted as rejected.
+
+Example:
+
+    aggregator = ByteportStreamAggregator(windows=(60, 900))
+    client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', 'barDev1', aggregator=aggregator)
+    client.store({'temp': 20.5})
+    ...
+    aggregator.stats('barDev1', 'temp')[60]['mean']
+"""
+import json
+import time
+import calendar
+import datetime
+import logging
+import threading
+
+from client_base import *
+from i8_packets import parse_data_string
+
+
+# NumPy is an optional dependency, it is imported when the first aggregator is created
+# so importing this module stays cheap
+def load_numpy():
+    global numpy
+
+    try:
+        import numpy
+    except ImportError:
+        raise ByteportClientException("Could not import NumPy. The stream aggregator is not supported "
+                                      "without it, please do: pip install numpy")
+
+
+def to_seconds(timestamp, clock=time.time):
+    '''
+    :param timestamp:   None for the current time, UNIX time as number or string, or a datetime (UTC if naive)
+    :return:            UNIX time as float
+    '''
+    if timestamp is None:
+        return clock()
+    if isinstance(timestamp, datetime.datetime):
+        return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+    return float(timestamp)
+
+
+class ByteportMonotonicQueue(object):
+    '''
+    Ring buffer positions of the samples that can still become the minimum (or maximum) of a window, the
+    current one first. Each position is added and removed once, so updates are constant time on average.
+    '''
+    __slots__ = ('positions', 'smallest', 'head', 'size')
+
+    def __init__(self, capacity, smallest):
+        self.positions = numpy.empty(capacity, dtype=numpy.int32)
+        self.smallest = smallest
+        self.head = 0
+        self.size = 0
+
+    def push(self, position, value, values):
+        positions = self.positions
+        capacity = len(positions)
+
+        # Samples that can no longer be the extreme, the new one is more extreme and stays longer
+        while self.size:
+            tail = positions[(self.head + self.size - 1) % capacity]
+            if (values[tail] >= value) if self.smallest else (values[tail] <= value):
+                self.size -= 1
+            else:
+                break
+
+        positions[(self.head + self.size) % capacity] = position
+        self.size += 1
+
+    def evict(self, position):
+        if self.size and self.positions[self.head] == position:
+            self.head = (self.head + 1) % len(self.positions)
+            self.size -= 1
+
+    def first(self):
+        return self.positions[self.head]
+
+
+class ByteportRollingWindow(object):
+    '''
+    Statistics of the samples of the last seconds of a series, see the module documentation.
+    '''
+    __slots__ = ('seconds', 'start', 'count', 'mean', 'squares', 'minimums', 'maximums')
+
+    def __init__(self, seconds, capacity):
+        self.seconds = seconds
+
+        # Sequence number of the oldest sample in the window, the next sample when the window is empty
+        self.start = 0
+        self.count = 0
+
+        self.mean = 0.0
+        # Sum of squared deviations from the mean
+        self.squares = 0.0
+
+        self.minimums = ByteportMonotonicQueue(capacity, True)
+        self.maximums = ByteportMonotonicQueue(capacity, False)
+
+    def push(self, position, value, values):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (value - self.mean)
+
+        self.minimums.push(position, value, values)
+        self.maximums.push(position, value, values)
+
+    def pop(self, position, value):
+        self.start += 1
+        self.count -= 1
+
+        if self.count:
+            delta = value - self.mean
+            self.mean -= delta / self.count
+            self.squares = max(self.squares - delta * (value - self.mean), 0.0)
+        else:
+            # Start over without the rounding errors of the removed samples
+            self.mean = 0.0
+            self.squares = 0.0
+
+        self.minimums.evict(position)
+        self.maximums.evict(position)
+
+
+class ByteportRollingSeries(object):
+    '''
+    Ring buffer of the last samples of a (device UID, field name) and its windows.
+    '''
+
+    def __init__(self, windows, capacity):
+        self.capacity = capacity
+        self.times = numpy.zeros(capacity)
+        self.values = numpy.zeros(capacity)
+        self.windows = [ByteportRollingWindow(seconds, capacity) for seconds in windows]
+
+        # Samples added, also the sequence number of the next sample
+        self.received = 0
+        self.late = 0
+        self.last_time = None
+
+    def add(self, timestamp, value):
+        '''
+        :return: False if the sample was older than the newest sample and not added
+        '''
+        if self.last_time is not None and timestamp < self.last_time:
+            self.late += 1
+            return False
+
+        position = self.received % self.capacity
+
+        if self.received >= self.capacity:
+            # The oldest sample is overwritten, the windows still holding it let go of it first
+            oldest = self.received - self.capacity
+            for window in self.windows:
+                if window.count and window.start == oldest:
+                    window.pop(position, self.values[position])
+
+        self.times[position] = timestamp
+        self.values[position] = value
+        self.received += 1
+        self.last_time = timestamp
+
+        for window in self.windows:
+            window.push(position, value, self.values)
+            self.expire(window, timestamp)
+
+        return True
+
+    def expire(self, window, now):
+        limit = now - window.seconds
+        while window.count:
+            position = window.start % self.capacity
+            if self.times[position] > limit:
+                break
+            window.pop(position, self.values[position])
+
+    def window_stats(self, window, now=None):
+        if now is not None and self.last_time is not None and now > self.last_time:
+            self.expire(window, now)
+
+        stats = {'count': window.count, 'mean': None, 'std': None, 'min': None, 'max': None, 'rate': None,
+                 'capacity_reached': window.count == self.capacity}
+
+        if not window.count:
+            return stats
+
+        stats['mean'] = float(window.mean)
+        stats['min'] = float(self.values[window.minimums.first()])
+        stats['max'] = float(self.values[window.maximums.first()])
+
+        if window.count >= 2:
+            stats['std'] = float((window.squares / (window.count - 1)) ** 0.5)
+
+            first = window.start % self.capacity
+            last = (self.received - 1) % self.capacity
+            elapsed = self.times[last] - self.times[first]
+            if elapsed > 0:
+                stats['rate'] = float((self.values[last] - self.values[first]) / elapsed)
+
+        return stats
+
+    def stats(self, now=None):
+        return dict((window.seconds, self.window_stats(window, now)) for window in self.windows)
+
+
+class ByteportStreamAggregator:
+    '''
+    Rolling statistics per (device UID, field name) of the stored data, see the module documentation.
+    Thread safe, the brokers call on_message from their network threads.
+    '''
+
+    # Seconds of each window
+    DEFAULT_WINDOWS = (60, 300, 3600)
+
+    # Samples kept per series
+    DEFAULT_CAPACITY = 1024
+
+    MAX_SERIES = 10000
+
+    def __init__(self, windows=DEFAULT_WINDOWS, capacity=DEFAULT_CAPACITY, max_series=MAX_SERIES, clock=time.time):
+        '''
+        :param windows:     [optional] Seconds of each window
+        :param capacity:    [optional] Samples kept per series, bounds the memory and the samples per window
+        :param max_series:  [optional] Largest number of series kept
+        :param clock:       [optional] Function returning the current time in seconds, the time of samples
+                            stored without a timestamp
+        '''
+        load_numpy()
+
+        if not windows or min(windows) <= 0:
+            raise ByteportClientException("Windows must be positive numbers of seconds, got %s" % (windows,))
+        if capacity < 2:
+            raise ByteportClientException("capacity must be at least 2, was %s" % capacity)
+
+        self.windows = sorted(windows)
+        self.capacity = capacity
+        self.max_series = max_series
+        self.clock = clock
+
+        # (device UID, field name) -> ByteportRollingSeries
+        self.series = dict()
+        self.lock = threading.Lock()
+
+        self.rejected = 0
+
+    def memory_per_series(self):
+        '''
+        :return: Bytes of the buffers of each series
+        '''
+        return self.capacity * (16 + 8 * len(self.windows))
+
+    def observe(self, device_uid, data, timestamp=None):
+        '''
+        Adds the numeric values of a store to the statistics, other values and fields starting with _ are
+        ignored.
+
+        :param device_uid:  UID of the device
+        :param data:        Dictionary with field names and values, as given to store()
+        :param timestamp:   [optional] Any timestamp accepted by auto_timestamp(), by default the current time
+        :return:            Number of values added
+        '''
+        seconds = to_seconds(timestamp, self.clock)
+        added = 0
+
+        with self.lock:
+            for (field_name, value) in data.iteritems():
+                if field_name.startswith('_'):
+                    continue
+
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if value != value:
+                    # NaN
+                    continue
+
+                series = self.series.get((device_uid, field_name))
+                if series is None:
+                    if len(self.series) >= self.max_series:
+                        self.rejected += 1
+                        continue
+                    series = self.series[(device_uid, field_name)] = ByteportRollingSeries(self.windows,
+                                                                                           self.capacity)
+
+                if series.add(seconds, value):
+                    added += 1
+
+        return added
+
+    def observe_packets(self, message):
+        '''
+        Adds the data of a JSON list of packets as sent to the brokers, see
+        build_simple_string_device_message_packet(). Messages of other formats are ignored.
+
+        :return: Number of values added
+        '''
+        try:
+            packets = json.loads(message)
+            added = 0
+            for packet in packets:
+                added += self.observe(packet['uid'], parse_data_string(packet['data']), packet.get('timestamp'))
+            return added
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.debug(u'Ignored message not made of data packets: %s' % e)
+            return 0
+
+    def stats(self, device_uid, field_name, now=None):
+        '''
+        :param now:     [optional] UNIX time the windows end at, by default the time of the newest sample
+        :return:        Dictionary of window seconds -> dictionary with count, mean, std, min, max, rate (per
+                        second) and capacity_reached. None if nothing was stored for the field.
+        '''
+        with self.lock:
+            series = self.series.get((device_uid, field_name))
+            if series is None:
+                return None
+            return series.stats(now)
+
+    def keys(self):
+        '''
+        :return: List of the (device UID, field name) of all series
+        '''
+        with self.lock:
+            return list(self.series)
@@ -1,7 +1,63 @@
+import os
+import sys
+import ssl
+import zlib
+import socket
 import unittest
 import datetime
+import json
+import shutil
+import tempfile
+import threading
+import time
+from cStringIO import StringIO
 
-from http_clients import ByteportHttpGetClient, ByteportHttpPostClient
+from http_clients import ByteportHttpClient, ByteportHttpGetClient
+from unified_client import ByteportClient
+from mock_server import ByteportMockServer, ByteportMockStompBroker, ByteportMockMQTTBroker, ByteportMockSocksProxy, \
+    create_certificate
+from stomp_client import ByteportStompClient
+from streaming import ByteportStreamAggregator
+import backfill
+from backfill import ByteportBackfill
+from instrumentation import ByteportInstrumentation
+import profiler
+from profiler import ByteportSamplingProfiler
+from mqtt_client import ByteportMQTTClient, load_paho
+from persistent_queue import ByteportPersistentQueue
+from rate_limiting import ByteportRateLimiter, ByteportTokenBucket
+from gateway import ByteportGateway
+import socks
+from connection_pool import ByteportConnectionPool
+from session_store import ByteportSessionStore
+from socksipyhandler import SocksiPyHandler
+import i8_packets
+from i8_packets import ByteportI8Reassembler, ByteportI8Ingest
+from client_base import ByteportClientException, ByteportConnectException, ByteportClientInvalidDataTypeException, \
+    ByteportClientForbiddenException, ByteportClientDeviceNotFoundException, ByteportLoginFailedException, \
+    ByteportServerException
+
+# The scientific package imports the clients as byteport.*, as when installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pandas
+    from byteport.scientific import grouping, distance, typical, operations, activity, series_store, downsampling, \
+        export
+except ImportError:
+    pandas = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import tables
+except ImportError:
+    tables = None
 
 
 class TestHttpClients(unittest.TestCase):
@@ -16,10 +72,11 @@ class TestHttpClients(unittest.TestCase):
 
     def test_should_handle_all_supported_timetamps_correctly(self):
         client = ByteportHttpGetClient(
-            byteport_api_store_url=self.byteport_api_store_url,
+            byteport_api_hostname=self.hostname,
             namespace_name=self.namespace,
             api_key=self.key,
-            default_device_uid=self.device_uid
+            default_device_uid=self.device_uid,
+            initial_heartbeat=False
         )
 
         # integer input
@@ -57,3 +114,2005 @@ class TestHttpClients(unittest.TestCase):
         expected_result = '1430438400.012345'
         result = client.auto_timestamp(datetime_input)
         self.assertEqual(expected_result, result)
+
+
+class RecordingMQTTPublisher:
+    # Stands in for the paho client so publishes can be inspected without a broker
+    def __init__(self):
+        self.published = list()
+        self.failures = 0
+
+    def publish(self, topic, payload, qos):
+        if self.failures:
+            # MQTT_ERR_NO_CONN
+            self.failures -= 1
+            return 4, None
+
+        self.published.append((topic, payload, qos))
+        return 0, len(self.published)
+
+
+class Message:
+    # A received paho message
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class UnconnectedMQTTClient(ByteportMQTTClient):
+    # Skips the broker connection made by ByteportMQTTClient.__init__
+    def __init__(self, qos=ByteportMQTTClient.QOS_LEVEL, max_packets_per_publish=100, offline_queue=None):
+        load_paho()
+        self.namespace = 'test'
+        self.device_uid = '6000'
+        self.qos = self.verify_qos(qos)
+        self.max_packets_per_publish = max_packets_per_publish
+        self.offline_queue = offline_queue
+        self.drain_rate = 1000
+        self.drain_lock = threading.Lock()
+        self.drain_thread = None
+        self.draining = False
+        self.connected = True
+        self.mqtt_client = RecordingMQTTPublisher()
+
+
+class TestMQTTClient(unittest.TestCase):
+
+    def create_client(self, **kwargs):
+        return UnconnectedMQTTClient(**kwargs)
+
+    def test_should_publish_with_client_qos_unless_overridden(self):
+        client = self.create_client(qos=1)
+
+        client.store('temp=10')
+        client.store('temp=11', qos=2)
+
+        self.assertEqual([1, 2], [qos for (topic, payload, qos) in client.mqtt_client.published])
+
+    def test_should_reject_unsupported_qos(self):
+        client = self.create_client()
+        self.assertRaises(ByteportClientException, client.store, 'temp=10', qos=3)
+
+    def test_should_use_supplied_high_resolution_timestamp(self):
+        client = self.create_client()
+
+        client.store('temp=10', timestamp=1430438400.012345)
+
+        packets = json.loads(client.mqtt_client.published[0][1])
+        self.assertEqual('1430438400.012345', packets[0]['timestamp'])
+
+    def test_should_batch_packets_in_json_lists(self):
+        client = self.create_client(max_packets_per_publish=2)
+
+        results = client.store_batch(['temp=1', ('temp=2', 2), 'temp=3'], device_uid='6001')
+
+        self.assertEqual([0, 0], results)
+        self.assertEqual(2, len(client.mqtt_client.published))
+
+        first = json.loads(client.mqtt_client.published[0][1])
+        second = json.loads(client.mqtt_client.published[1][1])
+        self.assertEqual(['temp=1', 'temp=2'], [p['data'] for p in first])
+        self.assertEqual('2', first[1]['timestamp'])
+        self.assertEqual(['6001'], list(set(p['uid'] for p in first + second)))
+        self.assertEqual(['temp=3'], [p['data'] for p in second])
+
+
+class TestPersistentQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_keep_messages_in_order_across_instances(self):
+        queue = ByteportPersistentQueue(self.directory)
+        queue.put('first', 1)
+        queue.put('second')
+
+        reopened = ByteportPersistentQueue(self.directory)
+        self.assertEqual(2, len(reopened))
+        self.assertEqual(('first', 1), reopened.peek())
+        reopened.pop()
+        self.assertEqual(('second', 0), reopened.peek())
+        reopened.pop()
+        self.assertEqual(None, reopened.peek())
+
+    def test_should_drop_oldest_message_when_full(self):
+        queue = ByteportPersistentQueue(self.directory, max_messages=2)
+        for payload in ['a', 'b', 'c']:
+            queue.put(payload)
+
+        self.assertEqual(2, len(queue))
+        self.assertEqual(('b', 0), queue.peek())
+
+
+class TestMQTTOfflineQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_queue_while_disconnected_and_drain_in_order_on_connect(self):
+        client = UnconnectedMQTTClient(offline_queue=ByteportPersistentQueue(self.directory))
+        client.connected = False
+
+        client.store('temp=1')
+        client.store('temp=2')
+
+        self.assertEqual([], client.mqtt_client.published)
+        self.assertEqual(2, len(client.offline_queue))
+
+        client.on_connect(None, None, None, 0)
+        client.drain_thread.join(5)
+
+        published = [json.loads(payload)[0]['data'] for (topic, payload, qos) in client.mqtt_client.published]
+        self.assertEqual(['temp=1', 'temp=2'], published)
+        self.assertEqual(0, len(client.offline_queue))
+
+        client.store('temp=3')
+        self.assertEqual(3, len(client.mqtt_client.published))
+
+    def published_data(self, client):
+        return [json.loads(payload)[0]['data'] for (topic, payload, qos) in client.mqtt_client.published]
+
+    def test_should_keep_order_when_publish_fails_while_connected(self):
+        client = UnconnectedMQTTClient(offline_queue=ByteportPersistentQueue(self.directory))
+        client.mqtt_client.failures = 1
+
+        client.store('temp=1')
+        client.store('temp=2')
+        client.drain_thread.join(5)
+        client.store('temp=3')
+
+        self.assertEqual(['temp=1', 'temp=2', 'temp=3'], self.published_data(client))
+        self.assertEqual(0, len(client.offline_queue))
+
+    def test_should_retry_drain_that_fails_while_connected(self):
+        client = UnconnectedMQTTClient(offline_queue=ByteportPersistentQueue(self.directory))
+        client.DRAIN_RETRY_INTERVAL = 0.05
+        client.connected = False
+        client.store('temp=1')
+        client.store('temp=2')
+
+        client.mqtt_client.failures = 2
+        client.on_connect(None, None, None, 0)
+        client.store('temp=3')
+        client.drain_thread.join(5)
+
+        self.assertEqual(['temp=1', 'temp=2', 'temp=3'], self.published_data(client))
+        self.assertEqual(0, len(client.offline_queue))
+        self.assertFalse(client.draining)
+
+
+class RecordingHttpClient(ByteportHttpClient):
+    # Records the requests instead of sending them
+    def __init__(self, **kwargs):
+        ByteportHttpClient.__init__(self, 'test', 'TEST', '6000', initial_heartbeat=False, **kwargs)
+        self.requests = list()
+        self.failures = 0
+
+    def make_request(self, url, post_data=None, body=None):
+        if self.failures:
+            self.failures -= 1
+            raise ByteportConnectException("Connection refused")
+        self.requests.append((url, post_data))
+
+
+class FailingStompClient:
+    def __init__(self):
+        self.attempts = 0
+
+    def store(self, data=None, device_uid=None, timestamp=None):
+        self.attempts += 1
+        raise IOError("Connection refused")
+
+
+class TestUnifiedClient(unittest.TestCase):
+
+    def test_should_use_cheapest_transport(self):
+        mqtt_client = UnconnectedMQTTClient()
+        http_client = RecordingHttpClient()
+        client = ByteportClient(http_client=http_client, mqtt_client=mqtt_client)
+
+        self.assertEqual('mqtt', client.store({'temp': 10}, timestamp=2))
+
+        packets = json.loads(mqtt_client.mqtt_client.published[0][1])
+        self.assertEqual('temp=10', packets[0]['data'])
+        self.assertEqual('2', packets[0]['timestamp'])
+        self.assertEqual([], http_client.requests)
+
+    def test_should_use_configured_transport(self):
+        http_client = RecordingHttpClient()
+        client = ByteportClient(http_client=http_client, mqtt_client=UnconnectedMQTTClient(), transport='http')
+
+        self.assertEqual('http', client.store({'temp': 10}, device_uid='6001', timestamp=2))
+
+        (url, post_data) = http_client.requests[0]
+        self.assertTrue(url.endswith('/api/v1/timeseries/test/6001/'))
+        self.assertEqual('2', post_data['_ts'])
+
+    def test_should_fall_back_to_http_and_skip_failing_broker(self):
+        stomp_client = FailingStompClient()
+        http_client = RecordingHttpClient()
+        client = ByteportClient(http_client=http_client, stomp_client=stomp_client)
+
+        self.assertEqual('http', client.store({'temp': 10}))
+        self.assertEqual('http', client.store({'temp': 11}))
+
+        self.assertEqual(1, stomp_client.attempts)
+        self.assertEqual(2, len(http_client.requests))
+
+    def test_should_fall_back_to_http_when_mqtt_is_disconnected(self):
+        mqtt_client = UnconnectedMQTTClient()
+        mqtt_client.connected = False
+        client = ByteportClient(http_client=RecordingHttpClient(), mqtt_client=mqtt_client)
+
+        self.assertEqual('http', client.store({'temp': 10}))
+
+    def test_should_raise_when_no_transport_works(self):
+        client = ByteportClient(stomp_client=FailingStompClient())
+        self.assertRaises(IOError, client.store, {'temp': 10})
+
+    def test_should_not_fall_back_on_invalid_data(self):
+        http_client = RecordingHttpClient()
+        client = ByteportClient(http_client=http_client, mqtt_client=UnconnectedMQTTClient())
+
+        self.assertRaises(ByteportClientInvalidDataTypeException, client.store, {'bad': '\xff'})
+        self.assertEqual([], http_client.requests)
+
+
+class TestHttpClientsVsMockServer(unittest.TestCase):
+
+    namespace = 'test'
+    device_uid = '6000'
+    key = 'TEST'
+
+    def setUp(self):
+        self.server = ByteportMockServer(api_keys={self.namespace: self.key}, users={'admin': 'admin'}).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def create_client(self, client_class=ByteportHttpClient, **kwargs):
+        return client_class(namespace_name=self.namespace, api_key=self.key, default_device_uid=self.device_uid,
+                            byteport_api_hostname=self.server.hostname, **kwargs)
+
+    def test_should_store_heartbeat_and_data_using_POST_and_GET(self):
+        client = self.create_client()
+        client.store({'temp': 20}, timestamp=10)
+        self.create_client(ByteportHttpGetClient).store({'temp': 21}, timestamp=11)
+
+        self.assertEqual(['20', '21'], self.server.values(self.namespace, self.device_uid, 'temp'))
+        # The initial heartbeat and the store
+        self.assertEqual(2, self.server.request_counts[('POST', '/api/v1/timeseries/test/6000/')])
+
+    def test_should_raise_for_invalid_key_and_missing_device(self):
+        client = ByteportHttpClient(self.namespace, 'WRONG', self.device_uid,
+                                    byteport_api_hostname=self.server.hostname, initial_heartbeat=False)
+        self.assertRaises(ByteportClientForbiddenException, client.store, {'temp': 20})
+        self.assertRaises(ByteportClientDeviceNotFoundException, self.create_client().store, {'temp': 20}, '')
+
+    def test_should_store_packets(self):
+        client = self.create_client(initial_heartbeat=False)
+        packets = [client.build_simple_string_device_message_packet(self.namespace, '6001', 'temp=%s' % v, v)
+                   for v in range(3)]
+
+        client.store_packets(packets, self.key)
+
+        self.assertEqual(['0', '1', '2'], self.server.values(self.namespace, '6001', 'temp'))
+
+    def test_should_login_and_load_timeseries_data(self):
+        client = self.create_client(initial_heartbeat=False)
+        client.store({'temp': 20}, timestamp=datetime.datetime(2016, 1, 1, 12))
+
+        self.assertRaises(ByteportLoginFailedException, client.login, 'admin', 'wrong')
+        client.login('admin', 'admin')
+
+        result = client.load_timeseries_data_range(self.namespace, self.device_uid, 'temp',
+                                                   datetime.datetime(2016, 1, 1), datetime.datetime(2016, 1, 2))
+        self.assertEqual([{'t': '2016-01-01T12:00:00.000000', 'v': 20}],
+                         [{'t': row['t'], 'v': row['v']} for row in result['data']['ts_data']])
+
+        client.logout()
+        self.assertRaises(ByteportClientForbiddenException, client.load_timeseries_data, self.namespace,
+                          self.device_uid, 'temp', timedelta_days=1)
+
+    def test_should_inject_errors(self):
+        self.server.error_rate = 1.0
+        self.assertRaises(ByteportServerException, self.create_client)
+
+
+class TestClientsVsMockBrokers(unittest.TestCase):
+
+    def test_should_publish_to_stomp_broker(self):
+        broker = ByteportMockStompBroker().start()
+        try:
+            client = ByteportStompClient('test', 'user', 'pass', broker_host='127.0.0.1', broker_port=broker.port,
+                                         device_uid='6000')
+            client.store({'temp': 10}, timestamp=2)
+            client.disconnect()
+
+            self.assertTrue(broker.wait_for_messages(1))
+            self.assertEqual('temp=10', json.loads(broker.last_message)[0]['data'])
+        finally:
+            broker.stop()
+
+    def test_should_publish_to_mqtt_broker_with_all_qos_levels(self):
+        broker = ByteportMockMQTTBroker().start()
+        try:
+            client = ByteportMQTTClient('test', '6000', 'user', 'pass', broker_host='127.0.0.1',
+                                        broker_port=broker.port)
+            client.mqtt_client.loop_start()
+            deadline = time.time() + 5
+            while not client.connected and time.time() < deadline:
+                time.sleep(0.01)
+
+            for qos in ByteportMQTTClient.SUPPORTED_QOS_LEVELS:
+                client.store('temp=%s' % qos, qos=qos)
+            client.store_batch(['temp=3', 'temp=4'])
+
+            self.assertTrue(broker.wait_for_messages(4))
+            self.assertEqual(5, broker.packets)
+
+            client.disconnect()
+            client.mqtt_client.loop_stop()
+        finally:
+            broker.stop()
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ByteportMockServer().start()
+        self.instrumentation = ByteportInstrumentation()
+        self.events = list()
+        self.instrumentation.add_hook(lambda event, trace: self.events.append((event, trace)))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def counter(self, name, **labels):
+        for item in self.instrumentation.metrics.as_dict()['counters'].get(name, []):
+            if all(item['labels'].get(key) == value for (key, value) in labels.items()):
+                return item['value']
+        return None
+
+    def test_should_trace_http_requests_with_timing_breakdown(self):
+        client = ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=self.server.hostname,
+                                    instrumentation=self.instrumentation)
+        client.store({'temp': 20}, device_uid='6001')
+        self.assertEqual({'test': 'hello'}, json.loads(client.make_request(
+            'http://%s/api/v1/echo/?test=hello' % self.server.hostname).read()))
+
+        self.assertEqual(['start', 'end'] * 3, [event for (event, trace) in self.events])
+
+        trace = self.events[1][1]
+        self.assertEqual('/api/v1/timeseries/%s/%s/', trace.endpoint)
+        self.assertTrue(trace.bytes_sent > 0)
+        durations = trace.durations()
+        for phase in ['connect', 'send', 'first_byte', 'total']:
+            self.assertTrue(durations[phase] >= 0)
+        self.assertTrue(durations['connect'] <= durations['send'] <= durations['first_byte'] <= durations['total'])
+
+        self.assertEqual(2, self.counter('byteport_requests_total', endpoint='/api/v1/timeseries/%s/%s/', status='200'))
+        self.assertEqual(17, self.counter('byteport_bytes_received_total', endpoint='/api/v1/echo/'))
+
+    def test_should_count_errors_and_export_prometheus_text(self):
+        client = ByteportHttpClient('test', 'WRONG', '6000', byteport_api_hostname=self.server.hostname,
+                                    initial_heartbeat=False, instrumentation=self.instrumentation)
+        self.assertRaises(ByteportClientForbiddenException, client.store, {'temp': 20})
+
+        self.assertEqual(1, self.counter('byteport_request_errors_total'))
+
+        text = self.instrumentation.metrics.to_prometheus()
+        self.assertTrue('# TYPE byteport_requests_total counter' in text)
+        self.assertTrue('byteport_requests_total{endpoint="/api/v1/timeseries/%s/%s/",status="403",transport="http"} 1'
+                        in text)
+        self.assertTrue('byteport_request_duration_seconds_count{endpoint="/api/v1/timeseries/%s/%s/",'
+                        'transport="http"} 1' in text)
+
+    def test_should_trace_mqtt_publishes(self):
+        client = UnconnectedMQTTClient()
+        client.instrumentation = self.instrumentation
+
+        client.store('temp=10')
+
+        self.assertEqual(1, self.counter('byteport_requests_total', transport='mqtt', status='0'))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def run_in_thread(self, target):
+        stop = threading.Event()
+
+        def loop():
+            while not stop.is_set():
+                target()
+
+        thread = threading.Thread(target=loop)
+        thread.start()
+        return stop, thread
+
+    def category_of_thread(self, target):
+        profiler = ByteportSamplingProfiler()
+        (stop, thread) = self.run_in_thread(target)
+        try:
+            categories = set()
+            for _ in range(20):
+                time.sleep(0.005)
+                categories.add(profiler.categorize(sys._current_frames()[thread.ident]))
+            return categories
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_should_categorize_samples(self):
+        client = UnconnectedMQTTClient()
+        data = ''.join('%s' % n for n in range(10000))
+
+        self.assertEqual(set([profiler.SLEEP]), self.category_of_thread(lambda: time.sleep(0.05)))
+        self.assertTrue(profiler.COMPRESSION in self.category_of_thread(lambda: zlib.compress(data, 9)))
+        self.assertTrue(profiler.VALIDATION in self.category_of_thread(lambda: client.verify_field_name('temp_1')))
+
+    def test_should_sample_threads_and_write_report(self):
+        output = tempfile.mktemp()
+        sampler = ByteportSamplingProfiler(interval=0.001, output=output).start()
+        (stop, thread) = self.run_in_thread(lambda: time.sleep(0.01))
+        time.sleep(0.2)
+        stop.set()
+        thread.join()
+        sampler.stop()
+
+        self.assertTrue(sampler.samples > 0)
+        self.assertTrue(sampler.category_samples[profiler.SLEEP] > 0)
+
+        sampler.dump()
+        with open(output) as report_file:
+            report = report_file.read()
+        os.remove(output)
+
+        for category in profiler.CATEGORIES:
+            self.assertTrue(category in report)
+
+        # Without an output file the report goes to stderr, the root logger may not show INFO
+        sampler.output = None
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            sampler.dump()
+            self.assertTrue(sys.stderr.getvalue().startswith('Byteport sampling profile of process'))
+        finally:
+            sys.stderr = stderr
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiting(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def client(self, **kwargs):
+        return RecordingHttpClient(rate_limiter=ByteportRateLimiter(clock=self.clock, **kwargs))
+
+    def test_token_bucket_should_refill_up_to_burst(self):
+        bucket = ByteportTokenBucket(2, 4, self.clock)
+        for _ in range(4):
+            self.assertEqual(0, bucket.delay())
+            bucket.take()
+        self.assertAlmostEqual(0.5, bucket.delay())
+
+        self.clock.now += 10
+        self.assertTrue(bucket.is_full())
+        self.assertEqual(4, bucket.tokens)
+
+    def test_should_drop_stores_above_the_global_rate(self):
+        client = self.client(rate=1, burst=2, overflow=ByteportRateLimiter.DROP)
+
+        self.assertEqual([True, True, False], [client.store({'n': n}) for n in range(3)])
+        self.assertEqual(1, client.rate_limiter.dropped)
+
+        self.clock.now += 1
+        self.assertTrue(client.store({'n': 3}))
+        self.assertEqual(['0', '1', '3'], [post_data['n'] for (url, post_data) in client.requests])
+
+    def test_should_limit_each_device_separately(self):
+        client = self.client(device_rate=1, device_burst=1, overflow=ByteportRateLimiter.DROP)
+
+        self.assertTrue(client.store({'n': 1}, device_uid='a'))
+        self.assertTrue(client.store({'n': 1}, device_uid='b'))
+        self.assertFalse(client.store({'n': 2}, device_uid='a'))
+
+    def test_should_coalesce_pending_stores_of_a_device(self):
+        client = self.client(device_rate=1, device_burst=1, overflow=ByteportRateLimiter.COALESCE)
+
+        self.assertTrue(client.store({'temp': 1, 'status': 'ok'}, device_uid='a'))
+        self.assertFalse(client.store({'temp': 2}, device_uid='a', timestamp=1400000000))
+        self.assertFalse(client.store({'temp': 3, 'door': 'open'}, device_uid='a'))
+        self.assertEqual(1, len(client.rate_limiter))
+        self.assertEqual(1, client.rate_limiter.coalesced)
+
+        self.clock.now += 1
+        client.rate_limiter.flush()
+
+        self.assertEqual(2, len(client.requests))
+        (url, post_data) = client.requests[-1]
+        self.assertTrue(url.endswith('/a/'))
+        self.assertEqual({'temp': '3', 'door': 'open', '_ts': '1400000000', '_key': 'TEST'}, post_data)
+        self.assertEqual(0, len(client.rate_limiter))
+
+    def test_should_keep_coalesced_store_pending_when_flush_fails(self):
+        client = self.client(device_rate=1, device_burst=1, overflow=ByteportRateLimiter.COALESCE)
+        # Only flush() sends the pending stores
+        client.rate_limiter.start_flushing = lambda: None
+
+        client.store({'temp': 1}, device_uid='a')
+        client.store({'temp': 2, 'status': 'ok'}, device_uid='a', timestamp=1400000000)
+        client.failures = 1
+        self.clock.now += 1
+        self.assertRaises(ByteportConnectException, client.rate_limiter.flush)
+        self.assertEqual(1, len(client.rate_limiter))
+
+        client.store({'temp': 3}, device_uid='a')
+        self.clock.now += 1
+        client.rate_limiter.flush()
+
+        self.assertEqual([{'temp': '1', '_key': 'TEST'},
+                          {'temp': '3', 'status': 'ok', '_ts': '1400000000', '_key': 'TEST'}],
+                         [post_data for (url, post_data) in client.requests])
+        self.assertEqual(0, len(client.rate_limiter))
+
+        # Invalid data would never be sent, it is dropped
+        client.store({'temp': 4}, device_uid='a')
+        client.store({'name': '\xff\xfe'}, device_uid='a')
+        self.clock.now += 1
+        self.assertRaises(ByteportClientInvalidDataTypeException, client.rate_limiter.flush)
+        self.assertEqual(0, len(client.rate_limiter))
+
+    def test_should_send_coalesced_store_again_after_failure(self):
+        client = RecordingHttpClient(rate_limiter=ByteportRateLimiter(device_rate=20, device_burst=1,
+                                                                      overflow=ByteportRateLimiter.COALESCE))
+        client.store({'temp': 1})
+        client.failures = 1
+        client.store({'temp': 2})
+
+        deadline = time.time() + 5
+        while len(client.requests) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(['1', '2'], [post_data['temp'] for (url, post_data) in client.requests])
+        self.assertEqual(0, client.failures)
+
+    def test_should_forget_least_recently_used_device_buckets(self):
+        client = self.client(device_rate=1, device_burst=1, overflow=ByteportRateLimiter.DROP)
+        client.rate_limiter.MAX_DEVICE_BUCKETS = 3
+
+        for device_uid in ['a', 'b', 'c', 'a', 'd']:
+            client.store({'temp': 1}, device_uid=device_uid)
+
+        self.assertEqual(['c', 'a', 'd'], list(client.rate_limiter.device_buckets))
+        self.assertEqual(1, client.rate_limiter.dropped)
+
+    def test_should_send_coalesced_stores_in_the_background(self):
+        client = RecordingHttpClient(rate_limiter=ByteportRateLimiter(rate=20, burst=1,
+                                                                      overflow=ByteportRateLimiter.COALESCE))
+        client.store({'temp': 1})
+        client.store({'temp': 2})
+
+        deadline = time.time() + 5
+        while len(client.requests) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(['1', '2'], [post_data['temp'] for (url, post_data) in client.requests])
+
+
+class TestGateway(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ByteportMockServer().start()
+        self.client = ByteportHttpClient('test', 'TEST', byteport_api_hostname=self.server.hostname,
+                                         initial_heartbeat=False)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def store_samples(self, gateway):
+        for n in range(3):
+            for uid in ['s1', 's2', 's3']:
+                gateway.store(uid, {'temp': n, 'uid': uid}, timestamp=1400000000 + n)
+
+    def test_should_flush_all_devices_using_packets(self):
+        gateway = ByteportGateway(self.client, legacy_key='TEST', max_packets_per_request=4)
+        self.store_samples(gateway)
+        self.assertEqual(9, gateway.pending_count)
+        self.assertEqual(0, self.server.total_requests)
+
+        self.assertEqual(9, gateway.flush())
+
+        self.assertEqual(0, gateway.pending_count)
+        # Whole devices per request, 3 + 3 + 3 packets
+        self.assertEqual(3, self.server.request_counts[('POST', '/api/legacy/packets/timeseries/')])
+        for uid in ['s1', 's2', 's3']:
+            self.assertEqual(['0', '1', '2'], self.server.values('test', uid, 'temp'))
+
+    def test_should_flush_using_stores_without_legacy_key(self):
+        gateway = ByteportGateway(self.client, max_pending=9)
+        self.store_samples(gateway)
+
+        # The ninth sample triggered the flush
+        self.assertEqual(0, gateway.pending_count)
+        self.assertEqual(9, self.server.total_requests)
+        self.assertEqual(['0', '1', '2'], self.server.values('test', 's2', 'temp'))
+
+    def test_should_flush_with_store_now_of_client(self):
+        client = ByteportHttpGetClient('test', 'TEST', '6000', byteport_api_hostname=self.server.hostname,
+                                       initial_heartbeat=False)
+        gateway = ByteportGateway(client)
+        self.store_samples(gateway)
+        self.assertEqual(9, gateway.flush())
+
+        self.assertEqual([('GET', '/api/v1/timeseries/test/%s/' % uid) for uid in ['s1', 's2', 's3']],
+                         sorted(self.server.request_counts))
+        self.assertEqual(3, self.server.request_counts[('GET', '/api/v1/timeseries/test/s2/')])
+        self.assertEqual(['0', '1', '2'], self.server.values('test', 's2', 'temp'))
+
+    def test_should_keep_last_values_and_contact(self):
+        gateway = ByteportGateway(self.client, legacy_key='TEST')
+        self.store_samples(gateway)
+        gateway.device('s4')
+
+        self.assertEqual(4, len(gateway))
+        self.assertEqual({'temp': '2', 'uid': 's1'}, gateway.last_values('s1'))
+        self.assertEqual(['s4'], gateway.silent_devices(60))
+
+        gateway.forget('s1')
+        self.assertEqual(6, gateway.pending_count)
+        self.assertRaises(ByteportClientException, gateway.store, 'not valid!', {'temp': 1})
+
+    def test_should_flush_through_rate_limiter_and_keep_unsent_samples(self):
+        client = RecordingHttpClient(rate_limiter=ByteportRateLimiter(rate=1000))
+        gateway = ByteportGateway(client)
+        self.store_samples(gateway)
+
+        make_request = client.make_request
+
+        def fail_fifth_request(url, post_data=None, body=None):
+            if len(client.requests) == 4:
+                raise ByteportConnectException("Connection refused")
+            make_request(url, post_data, body)
+
+        client.make_request = fail_fifth_request
+        self.assertRaises(ByteportConnectException, gateway.flush)
+        self.assertEqual(5, gateway.pending_count)
+
+        client.make_request = make_request
+        self.assertEqual(5, gateway.flush())
+        self.assertEqual(0, gateway.pending_count)
+
+        # Every request waited for a token, the failed one too
+        self.assertEqual(10, client.rate_limiter.sent)
+        for uid in ['s1', 's2', 's3']:
+            self.assertEqual(['0', '1', '2'], [post_data['temp'] for (url, post_data) in client.requests
+                                               if url.endswith('/%s/' % uid)])
+
+    def test_should_keep_samples_pending_when_flush_fails(self):
+        gateway = ByteportGateway(self.client, legacy_key='WRONG')
+        self.store_samples(gateway)
+
+        self.assertRaises(ByteportClientForbiddenException, gateway.flush)
+        self.assertEqual(9, gateway.pending_count)
+
+
+class TestI8Packets(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.messages = list()
+        self.reassembler = ByteportI8Reassembler(lambda *message: self.messages.append(message), clock=self.clock)
+
+    def test_should_decode_packet_layout_of_c_gateway(self):
+        # version 1, req_ack, packet_id 7, total_size 300, offset 160, data_size 3
+        datagram = '\x09\x07' + '\x2c\x01\x00\x00' + '\xa0\x00\x00\x00' + '\x03' + 'abc' + '\0' * 77
+        self.assertEqual(i8_packets.PACKET_SIZE, len(datagram))
+
+        packet = i8_packets.decode_packet(datagram)
+        self.assertEqual((1, True, False, 7, 300, 160, 3, 'abc'),
+                         (packet.version, packet.req_ack, packet.is_ack, packet.packet_id, packet.total_size,
+                          packet.offset, packet.data_size, packet.data.tobytes()))
+        self.assertEqual(datagram, i8_packets.encode_packet(7, 'abc', 300, 160, req_ack=True))
+
+        self.assertRaises(i8_packets.ByteportI8PacketException, i8_packets.decode_packet, datagram[:5])
+        self.assertRaises(i8_packets.ByteportI8PacketException, i8_packets.decode_packet,
+                          i8_packets.encode_packet(7, 'abc', 2))
+
+    def test_should_reassemble_fragments_in_any_order(self):
+        message = ';'.join('field_%s=%s' % (n, n) for n in range(40)) + '\0'
+        packets = i8_packets.fragment_message(message, 3)
+        self.assertEqual(len(message) // 80 + 1, len(packets))
+
+        for packet in reversed(packets[1:]):
+            self.reassembler.feed(1, packet)
+        self.reassembler.feed(1, packets[-1])
+        self.assertEqual([], self.messages)
+
+        self.reassembler.feed(1, bytearray(packets[0]))
+        self.assertEqual([('0000000000000001', message[:-1], 1000.0)], self.messages)
+        self.assertEqual(1, self.reassembler.duplicates)
+        self.assertEqual(0, len(self.reassembler.partial))
+
+    def test_should_keep_messages_of_sources_apart_and_ack(self):
+        first = i8_packets.fragment_message('a' * 100, 1, req_ack=True)
+        second = i8_packets.fragment_message('b' * 100, 1)
+
+        ack = self.reassembler.feed(1, first[0])
+        self.assertEqual(1, i8_packets.decode_packet(ack).packet_id)
+        self.assertTrue(i8_packets.decode_packet(ack).is_ack)
+        self.assertEqual(None, self.reassembler.feed(2, second[0]))
+
+        self.reassembler.feed(2, second[1])
+        self.reassembler.feed(1, first[1])
+        self.assertEqual([('0000000000000002', 'b' * 100), ('0000000000000001', 'a' * 100)],
+                         [message[:2] for message in self.messages])
+
+        self.assertEqual(None, self.reassembler.feed(1, ack))
+        self.assertEqual(1, self.reassembler.acks_received)
+
+    def test_should_reject_overlapping_fragments(self):
+        message = 'a' * 100 + 'b' * 60
+        encode = i8_packets.encode_packet
+
+        self.reassembler.feed(1, encode(1, message[:80], 160, 0))
+        self.assertEqual(None, self.reassembler.feed(1, encode(1, message[40:120], 160, 40, req_ack=True)))
+        self.assertEqual(1, self.reassembler.rejected)
+
+        # 120 bytes of fragments have arrived, but bytes 120-160 have not
+        self.reassembler.feed(1, encode(1, message[40:80], 160, 40))
+        self.assertEqual(1, self.reassembler.duplicates)
+        self.assertEqual([], self.messages)
+
+        self.reassembler.feed(1, encode(1, message[80:], 160, 80))
+        self.assertEqual([message], [delivered[1] for delivered in self.messages])
+
+    def test_should_ack_only_accepted_packets(self):
+        failures = [Exception('Byteport is down')]
+
+        def deliver(*message):
+            if failures:
+                raise failures.pop()
+            self.messages.append(message)
+
+        reassembler = ByteportI8Reassembler(deliver, max_message_size=100, clock=self.clock)
+        packets = i8_packets.fragment_message('temp=1;pad=%s' % ('x' * 80), 3, req_ack=True)
+
+        self.assertNotEqual(None, reassembler.feed(1, packets[0]))
+        self.assertEqual(None, reassembler.feed(1, packets[1]))
+        self.assertEqual((1, 0, []), (reassembler.failed, reassembler.completed, self.messages))
+
+        # The node sends the fragment again as it got no ACK
+        self.assertNotEqual(None, reassembler.feed(1, packets[1]))
+        self.assertEqual((1, 1), (reassembler.failed, reassembler.completed))
+        self.assertEqual(['temp=1;pad=%s' % ('x' * 80)], [message[1] for message in self.messages])
+
+        self.assertEqual(None, reassembler.feed(1, i8_packets.fragment_message('x' * 200, 4, req_ack=True)[0]))
+        self.assertEqual(1, reassembler.rejected)
+
+    def test_should_drop_incomplete_messages_after_timeout(self):
+        self.reassembler.feed(1, i8_packets.fragment_message('a' * 100, 1)[0])
+        self.clock.now += 31
+        self.reassembler.feed(1, i8_packets.fragment_message('temp=1', 2)[0])
+
+        self.assertEqual(1, self.reassembler.expired)
+        self.assertEqual(0, len(self.reassembler.partial))
+        self.assertEqual([('0000000000000001', 'temp=1', 1031.0)], self.messages)
+
+    def test_should_ingest_messages_to_byteport(self):
+        server = ByteportMockServer().start()
+        try:
+            client = ByteportHttpClient('test', 'TEST', byteport_api_hostname=server.hostname,
+                                        initial_heartbeat=False)
+            for (legacy_key, uid) in [(None, i8_packets.TEST_MODE_ADDR), ('TEST', 2)]:
+                ingest = ByteportI8Ingest(client, legacy_key, batch_size=2)
+                reassembler = ByteportI8Reassembler(ingest)
+                for n in range(3):
+                    for packet in i8_packets.fragment_message('temp=%s;pad=%s' % (n, 'x' * 100), n):
+                        reassembler.feed(uid, packet)
+                ingest.flush()
+
+            self.assertEqual(['0', '1', '2'], server.values('test', '0102030405060708', 'temp'))
+            self.assertEqual(['0', '1', '2'], server.values('test', '0000000000000002', 'temp'))
+            self.assertEqual(2, server.request_counts[('POST', '/api/legacy/packets/timeseries/')])
+        finally:
+            server.stop()
+
+
+class TestSocksConnectionReuse(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ByteportMockServer().start()
+        self.proxy = ByteportMockSocksProxy().start()
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.server.stop()
+
+    def client(self, **kwargs):
+        return ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=self.server.hostname,
+                                  proxy_addr='127.0.0.1', proxy_port=self.proxy.port, **kwargs)
+
+    def test_should_negotiate_once_for_many_requests(self):
+        client = self.client()
+        for n in range(5):
+            client.store({'temp': n})
+
+        # Including the initial heartbeat
+        self.assertEqual(6, self.server.total_requests)
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(1, self.proxy.negotiations)
+        self.assertEqual(['0', '1', '2', '3', '4'], self.server.values('test', '6000', 'temp'))
+
+    def test_should_login_through_proxy(self):
+        client = self.client(initial_heartbeat=False)
+        client.login('admin', 'admin')
+        self.assertEqual(1, self.proxy.negotiations)
+
+    def test_should_authenticate_to_proxy(self):
+        self.proxy.stop()
+        self.proxy = ByteportMockSocksProxy(username='user', password='secret').start()
+
+        self.client(proxy_username='user', proxy_password='secret')
+        self.assertRaises(ByteportConnectException, self.client, proxy_username='user', proxy_password='wrong')
+        self.assertEqual(1, self.proxy.negotiations)
+
+    def test_should_reconnect_when_idle_connection_was_closed(self):
+        client = self.client()
+
+        # Close the idle connection behind the back of the pool, as a server timing it out would
+        handler = [handler for handler in client.opener.handlers if isinstance(handler, SocksiPyHandler)][0]
+        for connections in handler.pool.idle.values():
+            for (connection, idle_since) in connections:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+
+        client.store({'temp': 1})
+        self.assertEqual(['1'], self.server.values('test', '6000', 'temp'))
+        self.assertEqual(2, self.proxy.negotiations)
+
+    def test_connection_pool_should_expire_idle_connections(self):
+        pool = ByteportConnectionPool(max_idle_time=60, max_idle_per_host=2)
+
+        class Connection:
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        connections = [Connection() for _ in range(3)]
+        for connection in connections:
+            pool.put(('http', 'a'), connection)
+        self.assertTrue(connections[0].closed)
+        self.assertEqual(2, len(pool))
+
+        self.assertTrue(pool.get(('http', 'a')) is connections[2])
+        pool.idle[('http', 'a')][0] = (connections[1], time.time() - 61)
+        self.assertEqual(None, pool.get(('http', 'a')))
+        self.assertTrue(connections[1].closed)
+
+    def test_should_cache_resolved_addresses(self):
+        socks.cleardnscache()
+        self.assertEqual('127.0.0.1', socks.gethostbyname('localhost'))
+        self.assertTrue('localhost' in socks._dnscache)
+
+
+class TestSocksNegotiation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ByteportMockServer().start()
+        self.proxy = None
+
+    def tearDown(self):
+        if self.proxy is not None:
+            self.proxy.stop()
+        self.server.stop()
+
+    def echo_through_proxy(self, proxy_type, **kwargs):
+        sock = socks.socksocket()
+        sock.settimeout(5)
+        sock.setproxy(proxy_type, '127.0.0.1', self.proxy.port, **kwargs)
+        try:
+            sock.connect(('127.0.0.1', self.server.port))
+            # Nothing of the negotiation may be left in the socket
+            sock.sendall('GET /api/v1/echo/ HTTP/1.0\r\n\r\n')
+            response = ''
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    return response.split(' ', 1)[0]
+                response += data
+        finally:
+            sock.close()
+
+    def test_should_negotiate_socks5(self):
+        self.proxy = ByteportMockSocksProxy().start()
+        self.assertEqual('HTTP/1.1', self.echo_through_proxy(socks.PROXY_TYPE_SOCKS5))
+        self.assertEqual(2, self.proxy.round_trips)
+
+    def test_should_pipeline_socks5_negotiation(self):
+        self.proxy = ByteportMockSocksProxy().start()
+        self.assertEqual('HTTP/1.1', self.echo_through_proxy(socks.PROXY_TYPE_SOCKS5, pipeline=True))
+        self.assertEqual(1, self.proxy.round_trips)
+
+    def test_should_pipeline_socks5_authentication(self):
+        self.proxy = ByteportMockSocksProxy(username='user', password='secret').start()
+        self.assertEqual('HTTP/1.1', self.echo_through_proxy(socks.PROXY_TYPE_SOCKS5, username='user',
+                                                             password='secret', pipeline=True))
+        self.assertEqual(1, self.proxy.round_trips)
+
+        self.assertRaises(socks.Socks5AuthError, self.echo_through_proxy, socks.PROXY_TYPE_SOCKS5,
+                          username='user', password='wrong', pipeline=True)
+        self.assertEqual(1, self.proxy.negotiations)
+
+    def test_should_negotiate_socks4_and_http(self):
+        self.proxy = ByteportMockSocksProxy().start()
+        self.assertEqual('HTTP/1.1', self.echo_through_proxy(socks.PROXY_TYPE_SOCKS4))
+        self.assertEqual('HTTP/1.1', self.echo_through_proxy(socks.PROXY_TYPE_HTTP))
+        self.assertEqual(2, self.proxy.negotiations)
+
+
+class TestHttps(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        try:
+            cls.certfile = create_certificate(os.path.join(cls.directory, 'localhost.pem'))
+        except OSError:
+            shutil.rmtree(cls.directory)
+            raise unittest.SkipTest("openssl is not installed")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.server = ByteportMockServer(certfile=self.certfile).start()
+        self.context = ssl.create_default_context(cafile=self.certfile)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, **kwargs):
+        return ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=self.server.hostname,
+                                  protocol=self.server.protocol, **kwargs)
+
+    def test_should_store_over_one_tls_connection(self):
+        client = self.client(ssl_context=self.context)
+        for n in range(3):
+            client.store({'temp': n})
+
+        self.assertEqual(['0', '1', '2'], self.server.values('test', '6000', 'temp'))
+        self.assertEqual(1, self.server.handshakes)
+
+    def test_should_reject_untrusted_certificate(self):
+        self.assertRaises(ByteportConnectException, self.client)
+
+    def test_should_tunnel_tls_through_proxy(self):
+        proxy = ByteportMockSocksProxy().start()
+        try:
+            client = self.client(ssl_context=self.context, proxy_addr='127.0.0.1', proxy_port=proxy.port)
+            client.store({'temp': 1})
+        finally:
+            proxy.stop()
+
+        self.assertEqual(['1'], self.server.values('test', '6000', 'temp'))
+        self.assertEqual(1, proxy.negotiations)
+        self.assertEqual(1, self.server.handshakes)
+
+    def test_should_reject_unsupported_protocol(self):
+        self.assertRaises(ByteportClientException, ByteportHttpClient, 'test', 'TEST', '6000',
+                          byteport_api_hostname=self.server.hostname, protocol='ftp')
+
+
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = ByteportMockServer().start()
+        self.store = ByteportSessionStore(os.path.join(self.directory, 'sessions.json'))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def client(self, **kwargs):
+        return ByteportHttpClient(byteport_api_hostname=self.server.hostname, session_store=self.store, **kwargs)
+
+    def login_requests(self):
+        return self.server.request_counts.get(('GET', '/api/v1/login/'), 0) + \
+            self.server.request_counts.get(('POST', '/api/v1/login/'), 0)
+
+    def test_should_reuse_saved_session(self):
+        self.client().login('admin', 'admin')
+        self.assertEqual(2, self.login_requests())
+        self.assertEqual(0600, os.stat(self.store.path).st_mode & 0777)
+
+        # As another process would
+        client = self.client()
+        client.login('admin', 'admin')
+        client.load_timeseries_data('test', '6000', 'temp')
+        self.assertEqual(2, self.login_requests())
+
+    def test_should_login_again_when_session_has_ended(self):
+        instrumentation = ByteportInstrumentation()
+        traces = list()
+        instrumentation.add_hook(lambda event, trace: event == 'end' and traces.append(trace))
+
+        client = self.client(instrumentation=instrumentation)
+        client.login('admin', 'admin')
+        old_session = client.cookiejar.value('sessionid')
+        self.server.sessions.clear()
+
+        client.load_timeseries_data('test', '6000', 'temp')
+
+        self.assertEqual(4, self.login_requests())
+        self.assertNotEqual(old_session, client.cookiejar.value('sessionid'))
+        self.assertEqual(1, traces[-1].retries)
+        self.assertEqual(200, traces[-1].status)
+
+        # The new session was saved
+        self.client().login('admin', 'admin')
+        self.assertEqual(4, self.login_requests())
+
+    def test_should_not_reuse_expired_session(self):
+        store = ByteportSessionStore(self.store.path, max_age=60)
+        self.client().login('admin', 'admin')
+        self.assertTrue(store.load(self.server.hostname, 'admin') is not None)
+
+        sessions = store.read()
+        for session in sessions.values():
+            session['expires'] = time.time() - 1
+        store.write(sessions)
+        self.assertEqual(None, store.load(self.server.hostname, 'admin'))
+
+    def test_should_forget_session_on_logout(self):
+        client = self.client()
+        client.login('admin', 'admin')
+        client.logout()
+        self.assertEqual(None, self.store.load(self.server.hostname, 'admin'))
+
+    def test_should_not_login_again_for_forbidden_store(self):
+        client = self.client(initial_heartbeat=False)
+        client.login('admin', 'admin')
+
+        store_client = ByteportHttpClient('test', 'WRONG', '6000', byteport_api_hostname=self.server.hostname,
+                                          initial_heartbeat=False, session_store=self.store)
+        store_client.login('admin', 'admin')
+        self.assertRaises(ByteportClientForbiddenException, store_client.store, {'temp': 1})
+        self.assertEqual(2, self.login_requests())
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestGrouping(unittest.TestCase):
+
+    def series(self, periods=3000, freq='7T', start='2014-04-09 20:13'):
+        index = pandas.date_range(start, periods=periods, freq=freq)
+        values = numpy.random.RandomState(1).normal(10, 50, periods).round()
+        return pandas.Series(values, index, name='v')
+
+    def describe_per_group(self, series, labels):
+        # The previous implementation, a describe() per group
+        frames = list()
+        for (label, group) in zip(labels, grouping.groups(series, self.grouping)):
+            description = group[1].to_frame().describe()
+            description.columns = [label]
+            frames.append(description)
+        return pandas.concat(frames, axis=1)
+
+    def assert_same_as_describe(self, series, grouping_name, labels_start):
+        self.grouping = grouping_name
+        descriptions = grouping.group_and_describe(series, grouping_name)
+
+        expected = self.describe_per_group(series, descriptions.columns)
+        self.assertEqual(list(expected.index), list(descriptions.index))
+        self.assertEqual(labels_start, list(descriptions.columns[:len(labels_start)]))
+        numpy.testing.assert_allclose(expected.values, descriptions.values, rtol=1e-9)
+
+    def test_should_describe_daily_groups(self):
+        self.assert_same_as_describe(self.series(), grouping.DAILY, [u'2014-04-09', u'2014-04-10'])
+
+    def test_should_describe_hourly_groups(self):
+        self.assert_same_as_describe(self.series(), grouping.HOURLY, [u'2014-04-09 20', u'2014-04-09 21'])
+
+    def test_should_describe_weekly_and_monthly_groups(self):
+        series = self.series(periods=2000, freq='97T')
+        self.assert_same_as_describe(series, grouping.WEEKLY, [u'2014-W15', u'2014-W16'])
+        self.assert_same_as_describe(series, grouping.MONTHLY, [u'2014-04', u'2014-05'])
+
+    def test_should_ignore_missing_values_and_order(self):
+        series = self.series(periods=500)
+        series.iloc[::3] = numpy.nan
+        series.iloc[:40] = numpy.nan
+        shuffled = series.iloc[numpy.random.RandomState(2).permutation(len(series))]
+
+        descriptions = grouping.group_and_describe(shuffled, grouping.HOURLY)
+        self.assertEqual(0, descriptions[u'2014-04-09 20']['count'])
+        self.assertTrue(numpy.isnan(descriptions[u'2014-04-09 20']['mean']))
+
+        self.grouping = grouping.HOURLY
+        expected = self.describe_per_group(series, descriptions.columns)
+        numpy.testing.assert_allclose(expected.values[:, 1:], descriptions.values[:, 1:], rtol=1e-9)
+
+    def test_should_describe_mean_and_std_of_each_column(self):
+        series = self.series(periods=100, freq='H')
+        frame = pandas.DataFrame({'a': series, 'b': series * 2, 'name': 'x'})
+
+        descriptions = grouping.group_and_describe(frame, grouping.DAILY, 'pandas_mean_std')
+        self.assertEqual(['mean', 'std'], list(descriptions.index))
+        self.assertEqual((u'b', u'2014-04-10'), descriptions.columns[len(descriptions.columns) / 2 + 1])
+        numpy.testing.assert_allclose(descriptions['a'].values * 2, descriptions['b'].values)
+
+    def test_should_reject_unsupported_grouping(self):
+        self.assertRaises(Exception, grouping.group_and_describe, self.series(periods=10), 'YEARLY')
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestDistance(unittest.TestCase):
+
+    def descriptions(self, days=60):
+        index = pandas.date_range('2014-09-01', periods=days * 24, freq='H')
+        values = numpy.random.RandomState(3).normal(3700, 40, len(index))
+        values[24 * 10:24 * 11] -= 400
+        return grouping.group_and_describe(pandas.Series(values, index), grouping.DAILY)
+
+    def test_should_rank_as_distance_to_median_per_group(self):
+        descriptions = self.descriptions()
+        descriptions.loc['std', u'2014-09-05'] = numpy.nan
+
+        ranked = distance.arrange_by_distance(descriptions)
+
+        # The previous implementation, missing descriptors left out of the sum
+        typical = descriptions.median(axis=1)
+        expected = dict((label, numpy.sqrt(((descriptions[label] - typical) ** 2).sum()))
+                        for label in descriptions.columns)
+
+        self.assertEqual(sorted(expected, key=expected.get), list(ranked.index))
+        numpy.testing.assert_allclose([expected[label] for label in ranked.index], ranked['distance'].values)
+        self.assertEqual(range(1, 61), list(ranked['rank']))
+        self.assertEqual(u'2014-09-11', ranked.index[-1])
+        self.assertEqual(list(descriptions.index), list(ranked.columns[2:]))
+
+    def test_should_compute_mahalanobis_cosine_and_relative_distances(self):
+        descriptions = self.descriptions().drop('count')
+        vectors = descriptions.values.T
+        typical = numpy.median(vectors, axis=0)
+        differences = vectors - typical
+
+        inverse = numpy.linalg.inv(numpy.cov(vectors, rowvar=False))
+        expected = [numpy.sqrt(d.dot(inverse).dot(d)) for d in differences]
+        numpy.testing.assert_allclose(expected, distance.distances(vectors, typical, distance.MAHALANOBIS))
+
+        expected = [1 - v.dot(typical) / numpy.linalg.norm(v) / numpy.linalg.norm(typical) for v in vectors]
+        numpy.testing.assert_allclose(expected, distance.distances(vectors, typical, distance.COSINE), atol=1e-12)
+
+        expected = [numpy.linalg.norm(v / typical - 1) for v in vectors]
+        numpy.testing.assert_allclose(expected, distance.distances(vectors, typical, distance.RELATIVE))
+
+    def test_should_rank_incomplete_groups_last_by_mahalanobis(self):
+        descriptions = self.descriptions()
+        descriptions.loc['std', u'2014-09-02'] = numpy.nan
+
+        ranked = distance.arrange_by_distance(descriptions, judge_strategy=distance.MAHALANOBIS)
+        self.assertEqual(u'2014-09-02', ranked.index[-1])
+        self.assertTrue(numpy.isnan(ranked['distance'].iloc[-1]))
+        self.assertEqual(u'2014-09-11', ranked.index[-2])
+
+    def test_should_average_descriptors_with_low_variation(self):
+        descriptions = self.descriptions()
+        descriptions.loc['mean', u'2014-09-03'] = 10000.0
+
+        typical = distance.typical_vector(descriptions, distance.COV)
+        self.assertNotIn('mean', typical.index)
+        self.assertIn('50%', typical.index)
+        self.assertAlmostEqual(descriptions.loc['50%'].mean(), typical['50%'])
+
+    def test_should_reject_unsupported_strategies(self):
+        descriptions = self.descriptions(days=3)
+        self.assertRaises(Exception, distance.arrange_by_distance, descriptions, 'mode')
+        self.assertRaises(Exception, distance.arrange_by_distance, descriptions, judge_strategy='manhattan')
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestDistanceToTypical(unittest.TestCase):
+
+    def series(self, seed=4, days=14):
+        index = pandas.date_range('2016-03-01', periods=days * 24, freq='H')
+        values = numpy.random.RandomState(seed).normal(20, 5, len(index))
+        values[24 * 5:24 * 6] += 30
+        return pandas.Series(values, index)
+
+    def test_should_respond_as_the_api(self):
+        series = self.series()
+        result = typical.distance_to_typical(series, guid='test.6000.temp')
+
+        self.assertEqual(['T_med', 'distances', 'meta'], sorted(result))
+        self.assertEqual(sorted(grouping.DESCRIBE), sorted(result['T_med']))
+        self.assertEqual({'dist', 'group_name'}, set(result['distances'][0]))
+        self.assertEqual([u'2016-03-01', u'2016-03-02'], [entry['group_name'] for entry in result['distances'][:2]])
+        self.assertEqual({'from': '2016-03-01T00:00:00', 'to': '2016-03-14T23:00:00', 'include_descriptions': False,
+                          'order_by_distance': False, 'diff_before_analysis': False, 'guid': 'test.6000.temp',
+                          'exclude_descriptors': [], 'grouping': 'DAILY'}, result['meta'])
+
+        ranked = distance.arrange_by_distance(grouping.group_and_describe(series, grouping.DAILY))
+        self.assertAlmostEqual(ranked['distance'][u'2016-03-06'], result['distances'][5]['dist'])
+
+        # Serializable as the response body
+        json.dumps(result)
+
+    def test_should_order_by_distance_and_exclude_descriptors(self):
+        result = typical.distance_to_typical(self.series(), 'weekly', order='distance', include_descriptions=True,
+                                             exclude_descriptors=['count', ''])
+
+        self.assertEqual({u'2016 09', u'2016 10', u'2016 11'}, set(entry['group_name'] for entry in result['distances']))
+        self.assertEqual(['count'], result['meta']['exclude_descriptors'])
+        counts = dict((entry['group_name'], entry['description']['count']) for entry in result['distances'])
+        self.assertEqual({u'2016 09': 144.0, u'2016 10': 168.0, u'2016 11': 24.0}, counts)
+
+        dists = [entry['dist'] for entry in result['distances']]
+        self.assertEqual(sorted(dists), dists)
+
+        self.assertRaises(Exception, typical.distance_to_typical, self.series(), exclude_descriptors=['median'])
+        self.assertRaises(Exception, typical.distance_to_typical, self.series(), order='size')
+
+    def test_should_differentiate_before_analysis(self):
+        accumulated = self.series().clip(lower=0).cumsum()
+        result = typical.distance_to_typical(accumulated, diff_before_analysis=True, order='distance')
+        self.assertEqual(u'2016-03-06', result['distances'][-1]['group_name'])
+
+    def test_should_analyse_devices_in_parallel(self):
+        series_by_guid = dict(('test.%s.temp' % uid, self.series(seed=uid)) for uid in range(6000, 6004))
+
+        parallel = typical.distance_to_typical_many(series_by_guid, processes=2, grouping='hourly')
+        serial = typical.distance_to_typical_many(series_by_guid, processes=1, grouping='hourly')
+
+        self.assertEqual(sorted(series_by_guid), sorted(parallel))
+        self.assertEqual(serial, parallel)
+        self.assertEqual('test.6001.temp', parallel['test.6001.temp']['meta']['guid'])
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestOperations(unittest.TestCase):
+
+    def series(self, points=200):
+        random = numpy.random.RandomState(5)
+        offsets = numpy.cumsum(random.randint(50, 70, points)) * 1000000000
+        index = pandas.DatetimeIndex(numpy.datetime64('2016-03-01T00:00:00') + offsets.astype('timedelta64[ns]'))
+        return pandas.Series(random.normal(100, 10, points).cumsum(), index, name='energy')
+
+    def test_should_diff_as_the_api(self):
+        series = self.series()
+        result = operations.apply_operation(series, 'diff')
+
+        x = series.values
+        t = [timestamp.value / 1e9 for timestamp in series.index]
+        expected = [(x[n + 1] - x[n - 1]) / (t[n + 1] - t[n - 1]) for n in range(1, len(x) - 1)]
+
+        self.assertEqual(len(series) - 2, len(result))
+        self.assertTrue((series.index[1:-1] == result.index).all())
+        numpy.testing.assert_allclose(expected, result.values)
+        self.assertEqual('energy', result.name)
+
+    def test_should_cum_sum_and_scale(self):
+        series = self.series()
+        numpy.testing.assert_allclose(series.cumsum().values * 2, operations.apply_operation(series, 'cum_sum', 2).values)
+        self.assertIs(series, operations.apply_operation(series))
+        self.assertRaises(Exception, operations.apply_operation, series, 'integrate')
+
+    def test_should_smooth_diff(self):
+        index = pandas.date_range('2016-03-01', periods=100, freq='T', tz='Europe/Stockholm')
+        series = pandas.Series(numpy.arange(100) * 30.0, index)
+
+        result = operations.apply_operation(series, 'smooth_diff')
+        self.assertEqual(100 - 2 * operations.SMOOTHING_WINDOW + 1, len(result))
+        numpy.testing.assert_allclose(0.5, result.values)
+        self.assertEqual(index[4] + pandas.Timedelta(seconds=30), result.index[0])
+
+    def test_should_apply_pipeline_lazily(self):
+        series = self.series()
+        pipeline = operations.TimeseriesPipeline(series).scale(2).scale(1.5)
+        self.assertEqual(1, len(pipeline.steps))
+
+        derived = pipeline.cum_sum().diff()
+        self.assertEqual(1, len(pipeline.steps))
+        numpy.testing.assert_allclose(
+            operations.apply_operation(series.cumsum() * 3, 'diff').values, derived.series().values)
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestDailyStatistics(unittest.TestCase):
+
+    def series(self, start='2015-12-01', days=10):
+        index = pandas.date_range(start, periods=days * 1440, freq='T')
+        values = numpy.random.RandomState(6).normal(20, 5, len(index))
+        series = pandas.Series(values, index)
+        return series.drop(series.index[7:8])
+
+    def test_should_update_incrementally_as_describe(self):
+        series = self.series()
+
+        statistics = activity.DailyStatistics()
+        for start in range(0, len(series), 997):
+            statistics.add_series(series.iloc[start:start + 997])
+
+        expected = grouping.group_and_describe(series, grouping.DAILY).loc[['count', 'mean', 'std', 'min', 'max']]
+        described = statistics.describe()
+        self.assertEqual(list(expected.columns), list(described.columns))
+        numpy.testing.assert_allclose(expected.values, described.values, rtol=1e-9)
+
+    def test_should_merge_statistics(self):
+        series = self.series()
+        shuffled = series.iloc[numpy.random.RandomState(7).permutation(len(series))]
+
+        parts = [activity.DailyStatistics() for _ in range(3)]
+        for (i, part) in enumerate(parts):
+            part.add_series(shuffled.iloc[i::3])
+        merged = activity.DailyStatistics()
+        for part in parts:
+            merged.merge(part)
+
+        whole = activity.DailyStatistics()
+        whole.add_series(series)
+        numpy.testing.assert_allclose(whole.describe().values, merged.describe().values, rtol=1e-9)
+
+    def test_should_respond_as_the_api(self):
+        statistics = activity.DailyStatistics(clock=lambda: 1449100000.0)  # 2015-12-02 23:46:40 UTC
+        statistics.add_series(self.series(days=3))
+        statistics.add(numpy.array(['1999-12-31T23:00', '1970-01-01'], dtype='datetime64[ns]'), [1.0, numpy.nan])
+
+        response = statistics.statistics(build_calendar=True, meta={'uid': 'mrsandman'})
+        self.assertEqual(1, response['values_in_way_past'])
+        # After 23:46 on the second day
+        self.assertEqual(13 + 1440, response['values_in_future'])
+        self.assertEqual([[u'2015-12-01', 1439, 100], [u'2015-12-02', 1427, 99]], response['daily_activity'])
+        self.assertEqual({'uid': 'mrsandman'}, response['meta'])
+
+        weeks = response['calendar'][2015]['2015-12']
+        self.assertEqual(5, len(weeks))
+        self.assertEqual([[0, None], [1, [u'2015-12-01', 1439, 100]], [2, [u'2015-12-02', 1427, 99]], [3, None]],
+                         weeks[0][:4])
+        self.assertEqual([[3, None], [4, None], [5, None], [6, None]], weeks[-1][3:])
+        self.assertEqual(7, len(weeks[2]))
+        json.dumps(response)
+
+
+@unittest.skipUnless(numpy is not None, "numpy is not installed")
+class TestStreamAggregator(unittest.TestCase):
+
+    def expected_stats(self, samples, seconds, capacity):
+        # Brute force over the samples a window holds
+        now = samples[-1][0]
+        window = [(t, v) for (t, v) in samples[-capacity:] if t > now - seconds]
+        values = numpy.array([v for (t, v) in window])
+        stats = {'count': len(window), 'mean': values.mean(), 'min': values.min(), 'max': values.max()}
+        if len(window) >= 2:
+            stats['std'] = values.std(ddof=1)
+            stats['rate'] = (window[-1][1] - window[0][1]) / (window[-1][0] - window[0][0])
+        return stats
+
+    def test_should_keep_rolling_statistics_of_each_window(self):
+        aggregator = ByteportStreamAggregator(windows=(10, 60, 600), capacity=100)
+        random = numpy.random.RandomState(8)
+
+        samples = list()
+        t = 1000.0
+        for i in range(1500):
+            # Bursts and gaps, so windows are limited by time as well as by capacity
+            t += random.choice([0.1, 1.0, 7.0, 40.0])
+            value = float(random.normal(20, 5))
+            samples.append((t, value))
+            aggregator.observe('6000', {'temp': value, '_key': 'TEST'}, t)
+
+            if i % 97 == 0 or i == 1499:
+                stats = aggregator.stats('6000', 'temp')
+                for seconds in (10, 60, 600):
+                    expected = self.expected_stats(samples, seconds, 100)
+                    for (name, value) in expected.items():
+                        self.assertAlmostEqual(value, stats[seconds][name], places=6)
+
+        self.assertEqual([('6000', 'temp')], aggregator.keys())
+        self.assertEqual(100 * (16 + 8 * 3), aggregator.memory_per_series())
+
+    def test_should_expire_windows_by_time_of_reading(self):
+        aggregator = ByteportStreamAggregator(windows=(60,))
+        for t in range(0, 100, 10):
+            aggregator.observe('6000', {'energy': t * 2}, t)
+
+        self.assertEqual(2.0, aggregator.stats('6000', 'energy')[60]['rate'])
+        self.assertEqual(6, aggregator.stats('6000', 'energy')[60]['count'])
+        self.assertEqual(1, aggregator.stats('6000', 'energy', now=145)[60]['count'])
+        self.assertEqual(0, aggregator.stats('6000', 'energy', now=500)[60]['count'])
+        self.assertIsNone(aggregator.stats('6000', 'energy')[60]['mean'])
+        self.assertIsNone(aggregator.stats('6001', 'energy'))
+
+    def test_should_skip_late_and_non_numeric_values_and_bound_series(self):
+        aggregator = ByteportStreamAggregator(max_series=2)
+
+        self.assertEqual(2, aggregator.observe('6000', {'temp': '10', 'hum': 40, 'name': 'mom'}, 100))
+        self.assertEqual(0, aggregator.observe('6000', {'temp': 11}, 99))
+        self.assertEqual(0, aggregator.observe('6001', {'temp': 11}, 101))
+        self.assertEqual(1, aggregator.rejected)
+        self.assertEqual(1, aggregator.series[('6000', 'temp')].late)
+
+    def test_should_observe_stores_and_received_packets(self):
+        aggregator = ByteportStreamAggregator(clock=lambda: 2000.0)
+
+        http_client = RecordingHttpClient(aggregator=aggregator)
+        http_client.store({'temp': 10})
+        http_client.store({'temp': 20}, device_uid='6001', timestamp=datetime.datetime(1970, 1, 1, 0, 33, 21))
+
+        mqtt_client = UnconnectedMQTTClient()
+        mqtt_client.aggregator = aggregator
+        mqtt_client.store('temp=30', timestamp=2002)
+        mqtt_client.on_message(None, None, Message('simple_string_dev_message', json.dumps(
+            [{'namespace': 'test', 'uid': '6001', 'timestamp': '2003.5', 'data': 'temp=40;name=x'}])))
+        mqtt_client.on_message(None, None, Message('device_messages', 'reboot'))
+
+        # Falls back to HTTP, counted once
+        client = ByteportClient(http_client=RecordingHttpClient(), stomp_client=FailingStompClient(),
+                                aggregator=aggregator)
+        client.store({'temp': 50}, timestamp=2004)
+
+        self.assertEqual({'count': 3, 'mean': 30.0, 'min': 10.0, 'max': 50.0, 'rate': 10.0},
+                         dict((name, value) for (name, value) in aggregator.stats('6000', 'temp')[60].items()
+                              if name in ('count', 'mean', 'min', 'max', 'rate')))
+        self.assertEqual(2, aggregator.stats('6001', 'temp')[60]['count'])
+        self.assertEqual(30.0, aggregator.stats('6001', 'temp')[60]['mean'])
+        self.assertIsNone(aggregator.stats('6001', 'name'))
+
+    def test_should_observe_only_data_that_was_sent(self):
+        aggregator = ByteportStreamAggregator(clock=lambda: 2000.0)
+        server = ByteportMockServer().start()
+        client = ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=server.hostname,
+                                    initial_heartbeat=False, aggregator=aggregator)
+        gateway = ByteportGateway(client)
+        try:
+            client.store({'temp': 10}, timestamp=1990)
+            gateway.store('6001', {'temp': 20}, 1991)
+            self.assertIsNone(aggregator.stats('6001', 'temp'))
+            gateway.flush()
+        finally:
+            server.stop()
+
+        # Nothing listens on the port any more
+        self.assertRaises(Exception, client.store, {'temp': 30}, timestamp=1992)
+        gateway.store('6001', {'temp': 40}, 1993)
+        self.assertRaises(Exception, gateway.flush)
+
+        dead_client = ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=server.hostname,
+                                         initial_heartbeat=False)
+        client = ByteportClient(http_client=dead_client, stomp_client=FailingStompClient(), aggregator=aggregator)
+        self.assertRaises(Exception, client.store, {'temp': 50}, timestamp=1994)
+
+        self.assertEqual(1, aggregator.stats('6000', 'temp')[60]['count'])
+        self.assertEqual(1, aggregator.stats('6001', 'temp')[60]['count'])
+        self.assertEqual(20.0, aggregator.stats('6001', 'temp')[60]['mean'])
+
+        # Data put in the MQTT offline queue is added when it is drained
+        directory = tempfile.mkdtemp()
+        try:
+            mqtt_client = UnconnectedMQTTClient(offline_queue=ByteportPersistentQueue(directory))
+            mqtt_client.aggregator = aggregator
+            mqtt_client.connected = False
+            mqtt_client.store('temp=60', timestamp=1995, device_uid='6002')
+            self.assertIsNone(aggregator.stats('6002', 'temp'))
+
+            mqtt_client.on_connect(None, None, None, 0)
+            mqtt_client.drain_thread.join(5)
+            self.assertEqual(60.0, aggregator.stats('6002', 'temp')[60]['mean'])
+
+            # Nor does the unified client observe what is queued, dropped or coalesced
+            facade_aggregator = ByteportStreamAggregator(clock=lambda: 2000.0)
+            mqtt_client.aggregator = None
+            mqtt_client.connected = False
+            client = ByteportClient(mqtt_client=mqtt_client, aggregator=facade_aggregator)
+            self.assertEqual('mqtt', client.store({'temp': 70}, device_uid='6003', timestamp=1996))
+            self.assertEqual(1, len(mqtt_client.offline_queue))
+
+            http_client = RecordingHttpClient(rate_limiter=ByteportRateLimiter(
+                rate=1, burst=1, overflow=ByteportRateLimiter.DROP, clock=lambda: 2000.0))
+            client = ByteportClient(http_client=http_client, aggregator=facade_aggregator)
+            client.store({'temp': 80}, device_uid='6003', timestamp=1997)
+            client.store({'temp': 90}, device_uid='6003', timestamp=1998)
+            self.assertEqual(1, http_client.rate_limiter.dropped)
+
+            self.assertEqual(1, facade_aggregator.stats('6003', 'temp')[60]['count'])
+            self.assertEqual(80.0, facade_aggregator.stats('6003', 'temp')[60]['mean'])
+        finally:
+            shutil.rmtree(directory)
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestSeriesStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = series_store.SeriesStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def series(self, start='2016-03-01 05:00', periods=5000, freq='7T'):
+        index = pandas.date_range(start, periods=periods, freq=freq)
+        return pandas.Series(numpy.random.RandomState(9).normal(20, 5, periods), index)
+
+    def test_should_append_and_read_memory_mapped(self):
+        series = self.series()
+        stored = self.store.series('test.6000.temp')
+
+        self.assertEqual(3000, stored.append_series(series.iloc[:3000]))
+        self.assertEqual(2000, stored.append_series(series.iloc[2500:]))
+        self.assertEqual(0, stored.append_series(series.iloc[:10]))
+
+        self.assertEqual(5000, len(stored))
+        self.assertIsInstance(stored.values(), numpy.memmap)
+        self.assertEqual(list(series.index), list(stored.to_series().index))
+        self.assertEqual(series.tolist(), stored.to_series().tolist())
+
+        between = stored.to_series(datetime.datetime(2016, 3, 2), datetime.datetime(2016, 3, 2, 1))
+        self.assertEqual(series[datetime.datetime(2016, 3, 2):datetime.datetime(2016, 3, 2, 1)].tolist(),
+                         between.tolist())
+        self.assertEqual(['test.6000.temp'], self.store.keys())
+
+    def test_should_recover_from_interrupted_append(self):
+        stored = self.store.series('test.6000.temp')
+        stored.append_series(self.series(periods=10))
+        with open(stored.times_path, 'ab') as times_file:
+            times_file.write('\0' * 8)
+
+        self.assertEqual(10, len(stored))
+        self.assertEqual(5, stored.append_series(self.series(start='2016-04-01', periods=5)))
+        self.assertEqual((15, 15), stored.sizes())
+
+    def test_should_recover_from_interrupted_first_append(self):
+        stored = self.store.series('test.6000.temp')
+        numpy.arange(3, dtype=numpy.int64).tofile(stored.times_path)
+        self.assertFalse(os.path.exists(stored.values_path))
+
+        self.assertEqual(0, len(stored))
+        self.assertEqual(5, stored.append_series(self.series(periods=5)))
+        self.assertEqual((5, 5), stored.sizes())
+        self.assertEqual(5, stored.append_series(self.series(start='2016-04-01', periods=5)))
+
+    def test_should_keep_groups_within_chunks(self):
+        series = self.series(periods=20000, freq='3T')
+        stored = self.store.series('test.6000.temp')
+        stored.append_series(series)
+
+        for grouping_name in (grouping.HOURLY, grouping.DAILY, grouping.WEEKLY):
+            chunked = series_store.group_and_describe_stored(stored, grouping_name, chunk_size=700)
+            expected = grouping.group_and_describe(series, grouping_name)
+
+            self.assertEqual(list(expected.columns), list(chunked.columns))
+            numpy.testing.assert_allclose(expected.values, chunked.values, rtol=1e-9)
+
+        chunks = list(stored.chunks(chunk_size=700, grouping=grouping.DAILY))
+        self.assertEqual(20000, sum(len(times) for (times, values) in chunks))
+        # 480 samples a day, each chunk is one whole day
+        self.assertEqual(42, len(chunks))
+        for (times, values) in chunks:
+            days = times.view('datetime64[ns]').astype('datetime64[D]')
+            self.assertEqual(days[0], days[-1])
+
+        statistics = activity.DailyStatistics()
+        for (times, values) in stored.chunks(chunk_size=700):
+            statistics.add(times.view('datetime64[ns]'), values)
+        self.assertEqual(20000, sum(count for (day, count, percent) in statistics.daily_activity()))
+
+    def test_should_load_into_store_in_chunks(self):
+        server = ByteportMockServer().start()
+        try:
+            for n in range(3000):
+                server.store('test', '6000', 1456808400 + n * 60, {'temp': '%s' % (n % 100)})
+
+            from byteport.scientific import TimeseriesAnalyser
+            analyser = TimeseriesAnalyser('admin', 'admin', byteport_api_hostname=server.hostname)
+            from_time = datetime.datetime(2016, 3, 1, 5)
+            stored = analyser.load_to_store('test', '6000', 'temp', from_time,
+                                            from_time + datetime.timedelta(minutes=2000), self.store,
+                                            chunk=datetime.timedelta(hours=5))
+            self.assertEqual(2001, len(stored))
+
+            requests = server.total_requests
+            analyser.load_to_store('test', '6000', 'temp', from_time, from_time + datetime.timedelta(minutes=3000),
+                                   self.store, chunk=datetime.timedelta(hours=5))
+            self.assertEqual(3000, len(stored))
+            self.assertEqual(requests + 4, server.total_requests)
+
+            self.assertEqual([float(n % 100) for n in range(3000)], stored.to_series().tolist())
+            self.assertEqual(pandas.Timestamp('2016-03-01 05:00'), stored.to_series().index[0])
+        finally:
+            server.stop()
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestDownsampling(unittest.TestCase):
+
+    def series(self, periods=10000):
+        index = pandas.date_range('2016-03-01', periods=periods, freq='T')
+        random = numpy.random.RandomState(3)
+        return pandas.Series(numpy.cumsum(random.normal(0, 1, periods)), index)
+
+    def reference_lttb(self, series, threshold):
+        # The published algorithm, a bucket at a time
+        x = (series.index.asi8 - series.index.asi8[0]) / 1e9
+        y = series.values
+        every = (len(series) - 2) / float(threshold - 2)
+        kept = [0]
+        for bucket in range(threshold - 2):
+            start = int(bucket * every) + 1
+            end = int((bucket + 1) * every) + 1
+            after_end = min(int((bucket + 2) * every) + 1, len(series))
+            if bucket == threshold - 3:
+                (after_x, after_y) = (x[-1], y[-1])
+            else:
+                (after_x, after_y) = (x[end:after_end].mean(), y[end:after_end].mean())
+            (a_x, a_y) = (x[kept[-1]], y[kept[-1]])
+            areas = [abs((a_x - after_x) * (y[n] - a_y) - (a_x - x[n]) * (after_y - a_y)) for n in range(start, end)]
+            kept.append(start + int(numpy.argmax(areas)))
+        return kept + [len(series) - 1]
+
+    def test_should_select_as_lttb(self):
+        series = self.series()
+        downsampled = downsampling.lttb(series, 300)
+
+        self.assertEqual(300, len(downsampled))
+        self.assertEqual(series.index[0], downsampled.index[0])
+        self.assertEqual(series.index[-1], downsampled.index[-1])
+        self.assertEqual(list(series.index[self.reference_lttb(series, 300)]), list(downsampled.index))
+
+        self.assertEqual(10000, len(downsampling.lttb(series, 20000)))
+
+    def test_should_keep_peaks_in_min_max(self):
+        series = self.series()
+        series.iloc[4321] = 1000
+        series.iloc[1234] = numpy.nan
+        downsampled = downsampling.min_max(series, 200)
+
+        self.assertTrue(len(downsampled) <= 200)
+        self.assertTrue(downsampled.index.is_monotonic_increasing)
+        self.assertEqual(1000, downsampled.max())
+        self.assertEqual(series.min(), downsampled.min())
+        self.assertFalse(downsampled.isnull().any())
+
+    def test_should_downsample_chunks_as_in_memory(self):
+        series = self.series()
+        times = series.index.asi8
+        values = series.values
+
+        for method in downsampling.METHODS:
+            downsampler = downsampling.Downsampler(series.index[0], series.index[-1], 200, method)
+            downsampler.add_series(series)
+            whole = downsampler.result()
+
+            downsampler = downsampling.Downsampler(series.index[0], series.index[-1], 200, method)
+            for offset in range(0, len(series), 77):
+                downsampler.add(times[offset:offset + 77], values[offset:offset + 77])
+            chunked = downsampler.result()
+
+            self.assertEqual(list(whole.index), list(chunked.index))
+            self.assertTrue(len(chunked) <= 200)
+            if method == downsampling.LTTB:
+                self.assertEqual(series.index[0], chunked.index[0])
+                self.assertEqual(series.index[-1], chunked.index[-1])
+
+        self.assertEqual(list(downsampling.min_max(series, 200).index), list(chunked.index))
+
+    def test_should_load_downsampled(self):
+        server = ByteportMockServer().start()
+        try:
+            for n in range(3000):
+                server.store('test', '6000', 1456808400 + n * 60, {'temp': '%s' % ((n * 7) % 100)})
+
+            from byteport.scientific import TimeseriesAnalyser
+            analyser = TimeseriesAnalyser('admin', 'admin', byteport_api_hostname=server.hostname)
+            from_time = datetime.datetime(2016, 3, 1, 5)
+            to_time = from_time + datetime.timedelta(minutes=2999)
+
+            downsampled = analyser.load_downsampled('test', '6000', 'temp', from_time, to_time, 100,
+                                                    chunk=datetime.timedelta(hours=5))
+            series = analyser.load_to_series('test', '6000', 'temp', from_time, to_time)
+            downsampler = downsampling.Downsampler(from_time, to_time, 100)
+            downsampler.add_series(series)
+
+            self.assertEqual(list(downsampler.result().index), list(downsampled.index))
+            self.assertEqual(100, len(downsampled))
+        finally:
+            server.stop()
+
+
+class RecordingWriter:
+
+    files = dict()
+
+    def __init__(self, path, meta):
+        self.frames = list()
+        RecordingWriter.files[path] = (meta, self.frames)
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+    def close(self):
+        pass
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        export.WRITERS['recording'] = RecordingWriter
+        RecordingWriter.files.clear()
+
+    def tearDown(self):
+        del export.WRITERS['recording']
+        shutil.rmtree(self.directory)
+
+    def export_from_server(self, path, file_format=None):
+        server = ByteportMockServer().start()
+        try:
+            for n in range(3000):
+                server.store('test', '6000', 1456808400 + n * 60, {'temp': '%s' % (n % 100)})
+            server.store('test', '6000', 1456808400 + 3000 * 60, {'temp': 'broken'})
+
+            from byteport.scientific import TimeseriesAnalyser
+            analyser = TimeseriesAnalyser('admin', 'admin', byteport_api_hostname=server.hostname)
+            from_time = datetime.datetime(2016, 3, 1, 5)
+            written = analyser.export_timeseries('test', '6000', 'temp', from_time,
+                                                 from_time + datetime.timedelta(minutes=3000), path, file_format,
+                                                 chunk=datetime.timedelta(hours=5))
+            return written, analyser.load_to_series('test', '6000', 'temp', from_time,
+                                                    from_time + datetime.timedelta(minutes=3000))
+        finally:
+            server.stop()
+
+    def check_frame(self, frame, series):
+        self.assertEqual(export.COLUMNS, list(frame.columns))
+        self.assertEqual(3001, len(frame))
+        self.assertEqual(list(series.index), list(frame['time'].iloc[:3000]))
+        self.assertEqual(series.tolist(), frame['value'].iloc[:3000].tolist())
+        self.assertTrue(numpy.isnan(frame['value'].iloc[3000]))
+        self.assertEqual(3001, len(set(frame['ref'])))
+        self.assertEqual('1', json.loads(frame['meta'].iloc[0])['vlen'])
+
+    def test_should_parse_ts_data(self):
+        rows = [{'t': '2016-03-01T05:00:00.000000', 'v': 1.5, 'r': 'a', 'm': {'vlen': '3'}},
+                {'t': 'never', 'v': 2},
+                {'t': '2016-03-01T05:01:00.000000', 'v': 'text'},
+                {'t': '2016-03-01T05:02:00.000000', 'v': '3'}]
+        frame = export.ts_data_frame(rows)
+
+        self.assertEqual(3, len(frame))
+        self.assertEqual([u'a', u'', u''], frame['ref'].tolist())
+        self.assertEqual(u'{"vlen": "3"}', frame['meta'].iloc[0])
+        self.assertEqual(1.5, frame['value'].iloc[0])
+        self.assertTrue(numpy.isnan(frame['value'].iloc[1]))
+        self.assertEqual(3.0, frame['value'].iloc[2])
+
+        later = export.ts_data_frame(rows, numpy.datetime64('2016-03-01T05:01:00'))
+        self.assertEqual([pandas.Timestamp('2016-03-01 05:02')], list(later['time']))
+
+    def test_should_resolve_format(self):
+        self.assertEqual(export.PARQUET, export.resolve_format('/data/temp.parquet'))
+        self.assertEqual(export.HDF5, export.resolve_format('/data/temp.H5'))
+        self.assertEqual(export.FEATHER, export.resolve_format('/data/temp.bin', 'feather'))
+        self.assertRaises(Exception, export.resolve_format, '/data/temp.csv')
+        self.assertRaises(Exception, export.resolve_format, '/data/temp.parquet', 'csv')
+
+    def test_should_export_chunk_by_chunk(self):
+        (written, series) = self.export_from_server('export', 'recording')
+
+        (meta, frames) = RecordingWriter.files['export']
+        self.assertEqual(3001, written)
+        self.assertEqual(10, len(frames))
+        self.assertEqual('test.6000.temp', meta['path'])
+        self.assertEqual('2016-03-01T05:00:00.000000', meta['from'])
+        self.check_frame(pandas.concat(frames, ignore_index=True), series)
+
+    def test_should_export_series(self):
+        series = pandas.Series([1.0, 2.0, numpy.nan], pandas.date_range('2016-03-01', periods=3, freq='T',
+                                                                        tz='Europe/Stockholm'))
+        self.assertEqual(3, export.export_series(series, 'series', 'recording', chunk_size=2))
+
+        (meta, frames) = RecordingWriter.files['series']
+        self.assertEqual(2, len(frames))
+        frame = pandas.concat(frames, ignore_index=True)
+        self.assertEqual(pandas.Timestamp('2016-02-29 23:00'), frame['time'].iloc[0])
+        self.assertEqual([u'{}'] * 3, frame['meta'].tolist())
+
+    @unittest.skipIf(pyarrow is not None, "pyarrow is installed")
+    def test_should_explain_missing_library(self):
+        try:
+            export.export_series(pandas.Series([1.0], pandas.date_range('2016-03-01', periods=1)),
+                                 os.path.join(self.directory, 'temp.parquet'))
+            self.fail("Exported without pyarrow")
+        except Exception as e:
+            self.assertIn('pip install pyarrow', str(e))
+
+    @unittest.skipUnless(pyarrow is not None, "pyarrow is not installed")
+    def test_should_export_parquet_and_feather(self):
+        import pyarrow.ipc
+
+        read_feather = lambda path: pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+        for (name, read) in (('temp.parquet', pyarrow.parquet.read_table), ('temp.feather', read_feather)):
+            path = os.path.join(self.directory, name)
+            (written, series) = self.export_from_server(path)
+
+            table = read(path)
+            frame = table.to_pandas()
+            frame['time'] = frame['time'].dt.tz_convert('UTC').dt.tz_localize(None)
+            self.check_frame(frame, series)
+            self.assertEqual('test.6000.temp', json.loads(table.schema.metadata[b'byteport'])['path'])
+
+    @unittest.skipUnless(tables is not None, "PyTables is not installed")
+    def test_should_export_hdf5(self):
+        path = os.path.join(self.directory, 'temp.h5')
+        (written, series) = self.export_from_server(path)
+
+        self.check_frame(pandas.read_hdf(path, export.HDF5_KEY), series)
+        store = pandas.HDFStore(path, mode='r')
+        try:
+            self.assertEqual('test.6000.temp', json.loads(store.get_storer(export.HDF5_KEY).attrs.byteport)['path'])
+        finally:
+            store.close()
+
+
+@unittest.skipUnless(pandas is not None, "pandas is not installed")
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = ByteportMockServer().start()
+        self.client = ByteportHttpClient('test', 'TEST', '6000', byteport_api_hostname=self.server.hostname,
+                                         initial_heartbeat=False)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def write_csv(self, rows=1000):
+        path = os.path.join(self.directory, 'history.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write('time,uid,temp,humidity\n')
+            for n in range(rows):
+                humidity = '' if n % 10 == 0 else '%s' % (n % 50)
+                csv_file.write('2016-03-01T%02d:%02d:%02d.250000,%s,%s.5,%s\n' %
+                               (n // 3600, n // 60 % 60, n % 60, 6000 + n % 3, n, humidity))
+        return path
+
+    def test_should_format_timestamps_as_auto_timestamp(self):
+        times = numpy.array(['2016-03-01T05:00:00', '2016-03-01T05:00:00.250', '2016-03-01T05:00:00.000001',
+                             '1969-12-31T23:59:59.5'], dtype='datetime64[ns]')
+        expected = [self.client.auto_timestamp(datetime.datetime(2016, 3, 1, 5)),
+                    self.client.auto_timestamp(datetime.datetime(2016, 3, 1, 5, 0, 0, 250000)),
+                    self.client.auto_timestamp(datetime.datetime(2016, 3, 1, 5, 0, 0, 1)), '-0.5']
+
+        self.assertEqual(expected, list(backfill.format_timestamps(times)))
+
+    def test_should_backfill_packets_by_device(self):
+        path = self.write_csv()
+        backfiller = ByteportBackfill(self.client, legacy_key='TEST', device_column='uid', batch_size=64, workers=3,
+                                      chunk_rows=300)
+        stats = backfiller.run(path)
+
+        self.assertEqual(1000, stats['rows'])
+        self.assertEqual(1000, stats['stored'])
+        self.assertEqual(17, stats['requests'])
+        self.assertEqual(17, self.server.request_counts[('POST', self.client.PACKETS_STORE_PATH)])
+
+        self.assertEqual(['%s.5' % n for n in range(1, 1000, 3)], self.server.values('test', '6001', 'temp'))
+        self.assertEqual(300, len(self.server.values('test', '6001', 'humidity')))
+        self.assertEqual(1456790401.25, self.server.load('test', '6001', 'temp', 0, float('inf'))[0][0])
+
+    def test_should_backfill_requests_and_resume_from_checkpoint(self):
+        path = self.write_csv(100)
+        checkpoint_path = os.path.join(self.directory, 'history.checkpoint')
+
+        self.server.error_rate = 1.0
+        backfiller = ByteportBackfill(self.client, device_column='uid', workers=2, chunk_rows=30)
+        self.assertRaises(Exception, backfiller.run, path, checkpoint_path)
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+        # Checkpointed after each chunk stored
+        self.server.error_rate = 0.0
+        chunks = list(backfill.read_chunks(path, 30))
+        backfiller.upload(chunks[:2], 0, lambda rows: backfill.write_checkpoint(
+            checkpoint_path, {'path': os.path.abspath(path), 'size': os.path.getsize(path)}, rows))
+        self.assertEqual(60, json.load(open(checkpoint_path))['rows'])
+
+        stats = backfiller.run(path, checkpoint_path)
+        self.assertEqual(40, stats['rows'])
+        self.assertEqual(40, stats['requests'])
+        self.assertEqual(100, json.load(open(checkpoint_path))['rows'])
+        self.assertEqual(['%s.5' % n for n in range(0, 100, 3)], self.server.values('test', '6000', 'temp'))
+
+        self.assertEqual(0, backfiller.run(path, checkpoint_path)['rows'])
+
+    @unittest.skipUnless(pyarrow is not None, "pyarrow is not installed")
+    def test_should_backfill_parquet_row_groups(self):
+        path = os.path.join(self.directory, 'history.parquet')
+        frame = pandas.read_csv(self.write_csv(250))
+        pyarrow.parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), path, row_group_size=100)
+
+        chunks = list(backfill.read_chunks(path, 40, 130))
+        self.assertEqual([40, 40, 40], [len(chunk) for chunk in chunks])
+        self.assertEqual(list(frame['temp'].iloc[130:]), list(pandas.concat(chunks)['temp']))
+
+        checkpoint_path = os.path.join(self.directory, 'history.checkpoint')
+        backfiller = ByteportBackfill(self.client, legacy_key='TEST', device_column='uid', chunk_rows=40)
+        self.assertEqual(250, backfiller.run(path, checkpoint_path)['stored'])
+        self.assertEqual(['%s.5' % n for n in range(2, 250, 3)], self.server.values('test', '6002', 'temp'))
+        self.assertEqual(0, backfiller.run(path, checkpoint_path)['rows'])
+
+    def test_should_leave_out_rows_without_device(self):
+        numeric = os.path.join(self.directory, 'numeric.csv')
+        with open(numeric, 'w') as csv_file:
+            csv_file.write('time,uid,temp\n2016-03-01T05:00:00,6001,20\n2016-03-01T05:01:00,,21\n'
+                           '2016-03-01T05:02:00,6002,22\n')
+        names = os.path.join(self.directory, 'names.csv')
+        with open(names, 'w') as csv_file:
+            csv_file.write('time,uid,temp\n2016-03-01T05:00:00,s1,30\n2016-03-01T05:01:00,,31\n')
+
+        backfiller = ByteportBackfill(self.client, legacy_key='TEST', device_column='uid')
+        stats = backfiller.run(numeric)
+        self.assertEqual((3, 2, 1), (stats['rows'], stats['stored'], stats['invalid']))
+        self.assertEqual(['20'], self.server.values('test', '6001', 'temp'))
+        self.assertEqual(['22'], self.server.values('test', '6002', 'temp'))
+
+        stats = backfiller.run(names)
+        self.assertEqual((2, 1, 1), (stats['rows'], stats['stored'], stats['invalid']))
+        self.assertEqual(['30'], self.server.values('test', 's1', 'temp'))
+        self.assertEqual([], self.server.values('test', 'nan', 'temp'))
+
+        if pyarrow is not None:
+            path = os.path.join(self.directory, 'numeric.parquet')
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(pandas.DataFrame({
+                'time': ['2016-03-01T06:00:00', '2016-03-01T06:01:00'],
+                'uid': pandas.Series([6003, None], dtype=object),
+                'temp': [40, 41]}), preserve_index=False), path)
+            stats = backfiller.run(path)
+            self.assertEqual((2, 1, 1), (stats['rows'], stats['stored'], stats['invalid']))
+            self.assertEqual(['40'], self.server.values('test', '6003', 'temp'))
+
+    def test_should_backfill_through_store_now_rate_limiter_and_aggregator(self):
+        path = self.write_csv(30)
+        aggregator = ByteportStreamAggregator(windows=(3600,))
+        client = ByteportHttpGetClient('test', 'TEST', '6000', byteport_api_hostname=self.server.hostname,
+                                       initial_heartbeat=False, rate_limiter=ByteportRateLimiter(rate=1000),
+                                       aggregator=aggregator)
+
+        # One worker, the aggregator leaves out samples older than the newest one of the series
+        stats = ByteportBackfill(client, device_column='uid', workers=1, chunk_rows=10).run(path)
+        self.assertEqual(30, stats['requests'])
+        self.assertEqual(30, client.rate_limiter.sent)
+
+        # The GET client sends its own requests
+        self.assertEqual(['GET'], list(set(method for (method, _) in self.server.request_counts)))
+        self.assertEqual(30, self.server.total_requests)
+        self.assertEqual(['%s.5' % n for n in range(1, 30, 3)], self.server.values('test', '6001', 'temp'))
+        self.assertEqual(10, aggregator.stats('6001', 'temp')[3600]['count'])
+
+    def test_should_run_from_command_line(self):
+        path = os.path.join(self.directory, 'history.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write('epoch,temp\n1456808400,20\n1456808460,x\n,21\n')
+
+        stats = backfill.main(['-n', 'test', '-k', 'TEST', '-d', '6000', '--hostname', self.server.hostname,
+                               '-l', 'TEST', '-f', path, '--time_column', 'epoch', '--time_unit', 's'])
+
+        self.assertEqual(3, stats['rows'])
+        self.assertEqual(1, stats['invalid'])
+        self.assertEqual(['20', 'x'], self.server.values('test', '6000', 'temp'))
@@ -0,0 +1,169 @@
+import time
+import logging
+
+from client_base import *
+
+
+class ByteportClient(AbstractByteportClient):
+    '''
+    Transport agnostic client that stores data through any of the HTTP, STOMP or MQTT clients.
+
+    Give the already created clients for the transports available at the site. Stores are routed to
+    the given transport, or if none is given, to the cheapest transport available (MQTT, then STOMP,
+    then HTTP). If a broker can not be reached the store falls back to HTTP and the broker is left
+    out for broker_retry_interval seconds before it is tried again. Note that the MQTT client is only
+    considered connected once its network loop is running and on_connect has been called, and that an
+    MQTT client with an offline queue never falls back since the queue delivers the data later.
+
+    Example:
+
+        http_client = ByteportHttpClient('myownspace', 'f00b4s3cretk3y', 'barDev1')
+        stomp_client = ByteportStompClient('myownspace', 'broker_user', 'broker_pass', device_uid='barDev1')
+
+        client = ByteportClient(http_client=http_client, stomp_client=stomp_client)
+        client.store({'temp': 20.5}, timestamp=time.time())
+    '''
+
+    HTTP = 'http'
+    STOMP = 'stomp'
+    MQTT = 'mqtt'
+
+    # Cheapest transport first, brokers have no per message request overhead
+    TRANSPORT_PREFERENCE = [MQTT, STOMP, HTTP]
+
+    # Seconds a failing broker is left out before being tried again
+    BROKER_RETRY_INTERVAL = 60
+
+    # Errors in the data itself, they would fail on any transport so no fallback is made
+    DATA_EXCEPTIONS = (ByteportClientInvalidFieldNameException,
+                       ByteportClientInvalidDataTypeException,
+                       ByteportClientUnsupportedTimestampTypeException)
+
+    def __init__(self, http_client=None, stomp_client=None, mqtt_client=None, transport=None,
+                 broker_retry_interval=BROKER_RETRY_INTERVAL, aggregator=None):
+        '''
+        :param http_client:             [optional] A ByteportHttpClient
+        :param stomp_client:            [optional] A connected ByteportStompClient
+        :param mqtt_client:             [optional] A ByteportMQTTClient
+        :param transport:               [optional] One of 'http', 'stomp' or 'mqtt' to always use that transport
+                                        (HTTP is still used as fallback for the brokers)
+        :param broker_retry_interval:   [optional] Seconds to wait before a failing broker is tried again
+        :param aggregator:              [optional] A ByteportStreamAggregator keeping rolling statistics of the
+                                        data stored, see streaming.py. Give it here rather than to the
+                                        underlying clients, a store falling back to HTTP would be counted twice.
+        '''
+        self.clients = dict()
+
+        if http_client is not None:
+            self.clients[self.HTTP] = http_client
+        if stomp_client is not None:
+            self.clients[self.STOMP] = stomp_client
+        if mqtt_client is not None:
+            self.clients[self.MQTT] = mqtt_client
+
+        if not self.clients:
+            raise ByteportClientException("At least one of the HTTP, STOMP or MQTT clients must be given")
+
+        if transport is not None and transport not in self.clients:
+            raise ByteportClientException("No client was given for the '%s' transport" % transport)
+
+        self.transport = transport
+        self.broker_retry_interval = broker_retry_interval
+        self.aggregator = aggregator
+
+        # Transport name -> time when a failing broker may be tried again
+        self.unavailable_until = dict()
+
+    def route(self):
+        '''
+        :return: The transports to try for the next store, in order
+        '''
+        if self.transport is not None:
+            transports = [self.transport]
+            if self.transport != self.HTTP and self.HTTP in self.clients:
+                transports.append(self.HTTP)
+        else:
+            transports = [t for t in self.TRANSPORT_PREFERENCE if t in self.clients]
+
+        now = time.time()
+        available = [t for t in transports if self.unavailable_until.get(t, 0) <= now]
+
+        # Rather try a failing broker again than not trying at all
+        return available or transports
+
+    def default_device_uid(self):
+        '''
+        :return: The device UID used by the underlying clients when none is given to store()
+        '''
+        for transport in self.TRANSPORT_PREFERENCE:
+            device_uid = getattr(self.clients.get(transport), 'device_uid', None)
+            if device_uid:
+                return device_uid
+        return None
+
+    def store(self, data=None, device_uid=None, timestamp=None):
+        '''
+        Store data using the cheapest working transport.
+
+        :param data:        Dictionary with field names and values
+        :param device_uid:  [optional] Overrides the device UID of the underlying client
+        :param timestamp:   [optional] Any timestamp accepted by auto_timestamp()
+        :return:            The name of the transport used
+        '''
+        if data is None:
+            data = dict()
+
+        transports = self.route()
+
+        for transport in transports:
+            try:
+                sent = self.store_using(transport, data, device_uid, timestamp)
+            except self.DATA_EXCEPTIONS:
+                raise
+            except Exception as e:
+                if transport == transports[-1]:
+                    raise
+
+                logging.warn(u'Failed to store using %s, trying %s next. Error was: %s' %
+                             (transport, transports[transports.index(transport) + 1], e))
+
+                if transport != self.HTTP:
+                    self.unavailable_until[transport] = time.time() + self.broker_retry_interval
+                continue
+
+            self.unavailable_until.pop(transport, None)
+
+            # Data queued offline, deferred or dropped by a rate limiter is not observed
+            if sent and self.aggregator is not None:
+                self.aggregator.observe(device_uid or self.default_device_uid(), data, timestamp)
+            return transport
+
+    def store_using(self, transport, data, device_uid=None, timestamp=None):
+        '''
+        :return: True if the transport sent the data now, False if it will be sent later or not at all
+        '''
+        client = self.clients[transport]
+
+        if transport == self.HTTP:
+            # The HTTP client adds its own _key and _ts fields to the dictionary
+            return client.store(dict(data), device_uid, timestamp)
+
+        elif transport == self.STOMP:
+            client.store(data, device_uid, timestamp)
+            return True
+
+        elif transport == self.MQTT:
+            data_string = self.build_delimited_data_string(data)
+
+            if client.offline_queue is None and not client.connected:
+                raise ByteportConnectException("Not connected to the MQTT broker")
+
+            result = client.store(data_string, timestamp, device_uid=device_uid)
+
+            # With an offline queue the message is delivered later, otherwise it is lost
+            if result != 0 and client.offline_queue is None:
+                raise ByteportConnectException("Failed to publish to the MQTT broker, error code %s" % result)
+            return result == 0
+
+        else:
+            raise ByteportClientException("Unsupported transport '%s'" % transport)
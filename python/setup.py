@@ -9,7 +9,7 @@ setup(name='Byteport API',
       author='Byteport developers',
       author_email='contact@byteport.se',
       url='https://github.com/iGW/byteport-api',
-      packages=['byteport'],
+      packages=['byteport', 'byteport.scientific'],
       install_requires=[
             'pytz>=2015.7',
             'stompest==2.1.6',